@@ -4,6 +4,7 @@
 
 from os import getenv
 from typing import TYPE_CHECKING, Any, Coroutine, Dict, List, Literal, Optional
+import asyncio
 import json
 import re
 import uuid
@@ -12,7 +13,7 @@ from datetime import datetime
 from eventprocessor_utils import (
     get_transcription_ttl
 )
-from lex_utils import recognize_text_lex
+from lex_utils import get_lex_session_id, recognize_text_lex
 
 # third-party imports from Lambda layer
 from aws_lambda_powertools import Logger
@@ -25,6 +26,7 @@ from botocore.config import Config as BotoCoreConfig
 LOGGER = Logger(location="%(filename)s:%(lineno)d - %(funcName)s()")
 
 if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.service_resource import Table
     from mypy_boto3_lambda.client import LambdaClient
     from mypy_boto3_kinesis.client import KinesisClient
     from mypy_boto3_lexv2_runtime.type_defs import RecognizeTextResponseTypeDef
@@ -32,6 +34,7 @@ if TYPE_CHECKING:
     from boto3 import Session as Boto3Session
 else:
     Boto3Session = object
+    Table = object
     LambdaClient = object
     KinesisClient = object
     LexRuntimeV2Client = object
@@ -71,6 +74,12 @@ IS_LAMBDA_AGENT_ASSIST_ENABLED = getenv(
 
 DYNAMODB_TABLE_NAME = getenv("DYNAMODB_TABLE_NAME", "")
 
+# holds the Lex session leases that serialize the requests of a call across invocations
+LEX_SESSION_LEASE_TABLE: Optional[Table] = (
+    BOTO3_SESSION.resource("dynamodb").Table(DYNAMODB_TABLE_NAME)
+    if DYNAMODB_TABLE_NAME else None
+)
+
 
 def write_agent_assist_to_kds(
     message: Dict[str, Any]
@@ -138,14 +147,14 @@ def publish_lex_agent_assist_transcript_segment(
                           "Transcript": "Checking...", "IsPartial": True}
     write_agent_assist_to_kds(transcript_segment)
 
-    transcript_segment = get_lex_agent_assist_transcript(
+    transcript_segment = asyncio.run(get_lex_agent_assist_transcript(
         **lex_agent_assist_input,
-    )
+    ))
 
     write_agent_assist_to_kds(transcript_segment)
 
 
-def get_lex_agent_assist_transcript(
+async def get_lex_agent_assist_transcript(
     transcript_segment_args: Dict[str, Any],
     content: str,
 ):
@@ -154,14 +163,15 @@ def get_lex_agent_assist_transcript(
 
     LOGGER.info("Bot Request: %s", content)
 
-    bot_response: RecognizeTextResponseTypeDef = recognize_text_lex(
+    bot_response: RecognizeTextResponseTypeDef = await recognize_text_lex(
         text=content,
-        session_id=str(hash(call_id)),
+        session_id=get_lex_session_id(call_id),
         lex_client=LEXV2_CLIENT,
         bot_id=LEX_BOT_ID,
         bot_alias_id=LEX_BOT_ALIAS_ID,
         locale_id=LEX_BOT_LOCALE_ID,
         call_id=call_id,
+        lease_table=LEX_SESSION_LEASE_TABLE,
     )
 
     LOGGER.info("Bot Response: ", extra=bot_response)
@@ -428,15 +438,25 @@ def publish_contact_lens_lex_agent_assist_transcript_segment(
             ),
         )
 
+    asyncio.run(send_lex_agent_assist_requests(send_lex_agent_assist_args))
+
+    return
+
+
+async def send_lex_agent_assist_requests(
+    send_lex_agent_assist_args: List[Dict[str, Any]],
+):
+    """Sends Lex Agent Assist Requests and writes the responses to KDS
+
+    The requests all go to the call's Lex session, so they are sent one at a time, in order.
+    """
     for agent_assist_args in send_lex_agent_assist_args:
-        transcript_segment = get_lex_agent_assist_transcript(
+        transcript_segment = await get_lex_agent_assist_transcript(
             **agent_assist_args,
         )
 
         write_agent_assist_to_kds(transcript_segment)
 
-    return
-
 
 def transform_segment_to_categories_agent_assist(
         category: str,
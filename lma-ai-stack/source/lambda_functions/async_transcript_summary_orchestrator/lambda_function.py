@@ -3,22 +3,26 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from os import getenv
-from typing import TYPE_CHECKING, Dict, List, Any
+from typing import TYPE_CHECKING, Dict, Any
 import json
-import re
 
 # third-party imports from Lambda layer
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
 from aws_lambda_powertools.utilities.typing import LambdaContext
 import boto3
 from botocore.config import Config as BotoCoreConfig
-from eventprocessor_utils import (
-    get_meeting_ttl
+from transcript_summary import (
+    TranscriptSummarizer,
+    compact_transcript,
+    create_bedrock_client,
+    write_call_summary_to_kds,
 )
 
 
 # pylint: enable=import-error
 LOGGER = Logger(location="%(filename)s:%(lineno)d - %(funcName)s()")
+# namespace from POWERTOOLS_METRICS_NAMESPACE
+METRICS = Metrics(service="AsyncTranscriptSummaryOrchestrator")
 
 if TYPE_CHECKING:
     from mypy_boto3_lambda.client import LambdaClient
@@ -45,11 +49,41 @@ KINESIS_CLIENT: KinesisClient = BOTO3_SESSION.client(
 
 TRANSCRIPT_SUMMARY_FUNCTION_ARN = getenv("TRANSCRIPT_SUMMARY_FUNCTION_ARN", "")
 CALL_DATA_STREAM_NAME = getenv("CALL_DATA_STREAM_NAME", "")
+# run the Bedrock summarizer in this function instead of invoking the summary Lambda function
+SUMMARY_IN_PROCESS = getenv("SUMMARY_IN_PROCESS", "false").lower() == "true"
+# write the compacted transcript document of the call at the end of the call, before the summary
+TRANSCRIPT_COMPACTION_ENABLED = getenv("TRANSCRIPT_COMPACTION_ENABLED", "false").lower() == "true"
+
+EVENTS_TABLE = BOTO3_SESSION.resource("dynamodb").Table(getenv("LCA_CALL_EVENTS_TABLE", ""))
+
+SUMMARIZER = None
+if SUMMARY_IN_PROCESS:
+    SUMMARIZER = TranscriptSummarizer(
+        bedrock_client=create_bedrock_client(BOTO3_SESSION),
+        dynamodb_client=BOTO3_SESSION.client("dynamodb"),
+        events_table=EVENTS_TABLE,
+    )
+
+
+def compact_call_transcript(call_id: str):
+    try:
+        compact_transcript(EVENTS_TABLE, call_id)
+    except Exception as error:  # pylint: disable=broad-except
+        # readers fall back to the segment items - the summary still runs
+        LOGGER.exception("Transcript compaction failed for CallId %s: %s", call_id, error)
 
 
 def get_call_summary(
     message: Dict[str, Any]
 ):
+    if SUMMARIZER:
+        summary = SUMMARIZER.summarize(
+            message["CallId"],
+            message.get("Prompt"),
+            rolling=bool(message.get("Rolling")),
+        )
+        return {"summary": summary}
+
     lambda_response = LAMBDA_CLIENT.invoke(
         FunctionName=TRANSCRIPT_SUMMARY_FUNCTION_ARN,
         InvocationType='RequestResponse',
@@ -60,42 +94,15 @@ def get_call_summary(
             "Payload").read().decode("utf-8"))
     except Exception as error:
         LOGGER.error(
-            "Transcript summary result payload parsing exception. Lambda must return JSON object with (modified) input event fields",
+            "Transcript summary result payload parsing exception. "
+            "Lambda must return JSON object with (modified) input event fields",
             extra=error,
         )
     return message
 
 
-def write_call_summary_to_kds(
-    message: Dict[str, Any]
-):
-    callId = message.get("CallId", None)
-    expiresAfter = message.get("ExpiresAfter", get_meeting_ttl())
-
-    new_message = dict(
-        CallId=callId,
-        EventType="ADD_SUMMARY",
-        ExpiresAfter=expiresAfter,
-        CallSummaryText=message["CallSummaryText"]
-    )
-
-    if callId:
-        try:
-            KINESIS_CLIENT.put_record(
-                StreamName=CALL_DATA_STREAM_NAME,
-                PartitionKey=callId,
-                Data=json.dumps(new_message)
-            )
-            LOGGER.info("Write ADD_SUMMARY event to KDS")
-        except Exception as error:
-            LOGGER.error(
-                "Error writing ADD_SUMMARY event to KDS ",
-                extra=error,
-            )
-    return
-
-
 @LOGGER.inject_lambda_context
+@METRICS.log_metrics
 def handler(event, context: LambdaContext):
     # pylint: disable=unused-argument
     """Lambda handler"""
@@ -103,10 +110,23 @@ def handler(event, context: LambdaContext):
 
     data = json.loads(json.dumps(event))
 
+    if TRANSCRIPT_COMPACTION_ENABLED and not data.get("Rolling"):
+        compact_call_transcript(data["CallId"])
+    if data.get("CompactOnly"):
+        # the call event processor only asks for compaction when summaries are disabled
+        return
+
     call_summary = get_call_summary(message=data)
+    if SUMMARIZER:
+        SUMMARIZER.bedrock_pacer.add_metrics(METRICS)
+
+    if data.get("Rolling"):
+        # running summary update during the meeting - kept by the summary function, not published
+        LOGGER.debug("Rolling summary updated for CallId: %s", data.get("CallId"))
+        return
 
     LOGGER.debug("Call summary: ")
     LOGGER.debug(call_summary)
     data['CallSummaryText'] = call_summary['summary']
 
-    write_call_summary_to_kds(data)
+    write_call_summary_to_kds(data, KINESIS_CLIENT, CALL_DATA_STREAM_NAME)
@@ -3,13 +3,16 @@
 """ Transcribe API Mutation Processor
 """
 import asyncio
+from collections import OrderedDict
 from datetime import datetime
 from statistics import fmean
 from os import getenv
 from typing import TYPE_CHECKING, Any, Coroutine, Dict, List, Literal, Optional, TypedDict
 import uuid
 import json
+import math
 import re
+import time
 
 # third-party imports from Lambda layer
 import boto3
@@ -53,6 +56,14 @@ else:
 SNS_TOPIC_ARN = getenv("SNS_TOPIC_ARN", "")
 
 IS_SENTIMENT_ANALYSIS_ENABLED = getenv("IS_SENTIMENT_ANALYSIS_ENABLED", "true").lower() == "true"
+# Sentiment aggregation reads the final segments of the call SENTIMENT_QUERY_PAGE_SIZE segments
+# at a time (0 - 1 MB pages). The rest of calls with more than one page is read in EndTime slices
+# of about a page, and at least SENTIMENT_QUERY_SLICE_SECONDS, SENTIMENT_QUERY_CONCURRENCY slices
+# at a time.
+SENTIMENT_QUERY_CONCURRENCY = int(getenv("SENTIMENT_QUERY_CONCURRENCY", "4"))
+SENTIMENT_QUERY_SLICE_SECONDS = int(getenv("SENTIMENT_QUERY_SLICE_SECONDS", "600"))
+SENTIMENT_QUERY_MAX_SLICES = int(getenv("SENTIMENT_QUERY_MAX_SLICES", "16"))
+SENTIMENT_QUERY_PAGE_SIZE = int(getenv("SENTIMENT_QUERY_PAGE_SIZE", "1000"))
 
 BOTO3_SESSION: Boto3Session = boto3.Session()
 CLIENT_CONFIG = BotoCoreConfig(
@@ -61,10 +72,22 @@ CLIENT_CONFIG = BotoCoreConfig(
 TRANSCRIPT_LAMBDA_HOOK_FUNCTION_ARN = getenv("TRANSCRIPT_LAMBDA_HOOK_FUNCTION_ARN", "")
 
 START_OF_CALL_LAMBDA_HOOK_FUNCTION_ARN = getenv("START_OF_CALL_LAMBDA_HOOK_FUNCTION_ARN", "")
-POST_CALL_SUMMARY_LAMBDA_HOOK_FUNCTION_ARN = getenv("POST_CALL_SUMMARY_LAMBDA_HOOK_FUNCTION_ARN", "")
+POST_CALL_SUMMARY_LAMBDA_HOOK_FUNCTION_ARN = getenv(
+    "POST_CALL_SUMMARY_LAMBDA_HOOK_FUNCTION_ARN", ""
+)
 
 ASYNC_TRANSCRIPT_SUMMARY_ORCHESTRATOR_ARN = getenv("ASYNC_TRANSCRIPT_SUMMARY_ORCHESTRATOR_ARN", "")
 IS_TRANSCRIPT_SUMMARY_ENABLED = getenv("IS_TRANSCRIPT_SUMMARY_ENABLED", "false").lower() == "true"
+# Rolling summary updates during the meeting - after this many new final segments, or this many
+# seconds since the last update (checked as segments arrive). 0 disables the trigger.
+ROLLING_SUMMARY_INTERVAL_SEGMENTS = int(getenv("ROLLING_SUMMARY_INTERVAL_SEGMENTS", "0"))
+ROLLING_SUMMARY_INTERVAL_SECONDS = int(getenv("ROLLING_SUMMARY_INTERVAL_SECONDS", "0"))
+IS_ROLLING_SUMMARY_ENABLED = IS_TRANSCRIPT_SUMMARY_ENABLED and bool(
+    ROLLING_SUMMARY_INTERVAL_SEGMENTS or ROLLING_SUMMARY_INTERVAL_SECONDS)
+# The summary orchestrator compacts the transcript into one document at the end of the call - it is
+# also invoked for this when summaries are disabled
+IS_TRANSCRIPT_COMPACTION_ENABLED = getenv(
+    "IS_TRANSCRIPT_COMPACTION_ENABLED", "false").lower() == "true"
 
 ASYNC_AGENT_ASSIST_ORCHESTRATOR_ARN = getenv("ASYNC_AGENT_ASSIST_ORCHESTRATOR_ARN", "")
 
@@ -104,6 +127,16 @@ CONNECT_CONTACT_ATTR_SYSTEM_PHONE_NUMBER = getenv(
 CUSTOMER_PHONE_NUMBER = ""
 CALL_ID = ""
 
+# Per container count of final segments since the last rolling summary update, by CallId.
+# KDS records are partitioned by CallId, so a call's segments are processed by the same container
+# unless the stream is resharded - at worst an update is triggered late. Calls whose END event is
+# processed elsewhere (or lost) are evicted once they haven't triggered an update for
+# ROLLING_SUMMARY_STATE_TTL_SECONDS, and the least recently updated calls over
+# ROLLING_SUMMARY_STATE_MAX_CALLS are evicted.
+ROLLING_SUMMARY_STATE_TTL_SECONDS = int(getenv("ROLLING_SUMMARY_STATE_TTL_SECONDS", "3600"))
+ROLLING_SUMMARY_STATE_MAX_CALLS = int(getenv("ROLLING_SUMMARY_STATE_MAX_CALLS", "1000"))
+ROLLING_SUMMARY_STATE: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+
 CALL_DATA_STREAM_NAME = getenv("CALL_DATA_STREAM_NAME", "")
 
 SentimentLabelType = Literal["NEGATIVE", "MIXED", "NEUTRAL", "POSITIVE"]
@@ -329,10 +362,22 @@ async def execute_update_call_status_mutation(
 
     return result
 
+
 async def execute_get_transcript_segments_query(
     message: Dict[str, Any],
     appsync_session: AppsyncAsyncClientSession,
+    indexed: Optional[bool] = None,
+    next_token: Optional[str] = None,
+    min_end_time: Optional[float] = None,
+    max_end_time: Optional[float] = None,
 ) -> Dict:
+    """Gets one page of the final transcript segments of the call, with sentiment
+
+    Only the fields used for sentiment aggregation are selected - the resolver reads only those.
+
+    :parameter indexed: read the final segment index (True) or, for calls added before the index,
+        the call partition (False)
+    """
 
     call_id = message.get("CallId")
     if not call_id:
@@ -343,23 +388,30 @@ async def execute_get_transcript_segments_query(
         raise ValueError("invalid AppSync schema")
     schema = DSLSchema(appsync_session.client.schema)
 
-    # get_transcript_segments_input = {
-    #     "CallId": call_id
-    # }
+    query_args: Dict[str, Any] = {"callId": call_id}
+    if indexed is not None:
+        query_args["indexed"] = indexed
+    if next_token:
+        query_args["nextToken"] = next_token
+    if SENTIMENT_QUERY_PAGE_SIZE:
+        query_args["limit"] = SENTIMENT_QUERY_PAGE_SIZE
+    if min_end_time is not None:
+        query_args["minEndTime"] = min_end_time
+    if max_end_time is not None:
+        query_args["maxEndTime"] = max_end_time
+
     query = dsl_gql(
         DSLQuery(
-            schema.Query.getTranscriptSegmentsWithSentiment.args(callId=call_id).select(
+            schema.Query.getTranscriptSegmentsWithSentiment.args(**query_args).select(
                 schema.TranscriptSegmentsWithSentimentList.TranscriptSegmentsWithSentiment.select(
-                    schema.TranscriptSegmentWithSentiment.PK,
-                    schema.TranscriptSegmentWithSentiment.SK,
-                    schema.TranscriptSegmentWithSentiment.CallId,
                     schema.TranscriptSegmentWithSentiment.Channel,
                     schema.TranscriptSegmentWithSentiment.SegmentId,
                     schema.TranscriptSegmentWithSentiment.StartTime,
                     schema.TranscriptSegmentWithSentiment.EndTime,
                     schema.TranscriptSegmentWithSentiment.Sentiment,
                     schema.TranscriptSegmentWithSentiment.SentimentWeighted,
-                )
+                ),
+                schema.TranscriptSegmentsWithSentimentList.nextToken,
             )
         )
     )
@@ -374,6 +426,115 @@ async def execute_get_transcript_segments_query(
 
     return result
 
+
+async def get_transcript_segments_pages(
+    message: Dict[str, Any],
+    appsync_session: AppsyncAsyncClientSession,
+    indexed: bool,
+    next_token: Optional[str] = None,
+    min_end_time: Optional[float] = None,
+    max_end_time: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Gets the transcript segments of one query, following nextToken a page at a time"""
+    segments: List[Dict[str, Any]] = []
+    while True:
+        result = await execute_get_transcript_segments_query(
+            message=message,
+            appsync_session=appsync_session,
+            indexed=indexed,
+            next_token=next_token,
+            min_end_time=min_end_time,
+            max_end_time=max_end_time,
+        )
+        page = result.get("getTranscriptSegmentsWithSentiment") or {}
+        segments.extend(page.get("TranscriptSegmentsWithSentiment") or [])
+        next_token = page.get("nextToken")
+        if not next_token:
+            return segments
+
+
+async def get_transcript_segments_with_sentiment(
+    message: Dict[str, Any],
+    appsync_session: AppsyncAsyncClientSession,
+) -> List[Dict[str, Any]]:
+    """Gets all the final transcript segments of the call, with sentiment
+
+    The first page is read from the final segment index. If it is empty, the call was added before
+    the index and is read from the call partition instead. If the index query has more pages, the
+    rest of the call is read in EndTime slices (from the end of the first page to the EndTime of
+    the message, and one open ended slice for later segments) that are queried concurrently.
+    """
+    result = await execute_get_transcript_segments_query(
+        message=message,
+        appsync_session=appsync_session,
+        indexed=True,
+    )
+    page = result.get("getTranscriptSegmentsWithSentiment") or {}
+    segments: List[Dict[str, Any]] = page.get("TranscriptSegmentsWithSentiment") or []
+    next_token = page.get("nextToken")
+    if not next_token:
+        if segments:
+            return segments
+        LOGGER.debug(
+            "No indexed final segments - reading the call partition",
+            extra=dict(CallId=message.get("CallId")),
+        )
+        return await get_transcript_segments_pages(
+            message=message, appsync_session=appsync_session, indexed=False
+        )
+
+    # the index is in EndTime order - the rest of the call starts at the end of the first page
+    start_time = float(segments[-1]["EndTime"]) if segments else 0.0
+    end_time = max(float(message.get("EndTime", 0.0)), start_time)
+    # the first page covered the call up to start_time - slices are about a page or longer
+    slice_seconds = max(start_time, SENTIMENT_QUERY_SLICE_SECONDS)
+    slice_count = 1
+    if slice_seconds > 0:
+        slice_count = min(
+            max(SENTIMENT_QUERY_MAX_SLICES, 1),
+            max(math.ceil((end_time - start_time) / slice_seconds), 1),
+        )
+    if slice_count == 1:
+        segments.extend(
+            await get_transcript_segments_pages(
+                message=message,
+                appsync_session=appsync_session,
+                indexed=True,
+                next_token=next_token,
+            )
+        )
+        return segments
+
+    slice_seconds = (end_time - start_time) / slice_count
+    semaphore = asyncio.Semaphore(max(SENTIMENT_QUERY_CONCURRENCY, 1))
+
+    async def get_slice_segments(index: int) -> List[Dict[str, Any]]:
+        async with semaphore:
+            return await get_transcript_segments_pages(
+                message=message,
+                appsync_session=appsync_session,
+                indexed=True,
+                min_end_time=start_time + index * slice_seconds,
+                max_end_time=(
+                    start_time + (index + 1) * slice_seconds if index < slice_count - 1 else None
+                ),
+            )
+
+    slices = await asyncio.gather(*(get_slice_segments(index) for index in range(slice_count)))
+    # slice bounds are inclusive - a segment ending exactly on a bound is read twice
+    segments_by_id: Dict[str, Dict[str, Any]] = {
+        segment["SegmentId"]: segment for segment in segments
+    }
+    for slice_segments in slices:
+        for segment in slice_segments:
+            segments_by_id[segment["SegmentId"]] = segment
+    LOGGER.debug(
+        "Transcript segments with sentiment",
+        extra=dict(CallId=message.get("CallId"), Segments=len(segments_by_id), Slices=slice_count),
+    )
+    return list(segments_by_id.values())
+
+
 def _get_sentiment_per_quarter(
     sentiment_list: List[SentimentEntry],
 ) -> List[SentimentByPeriodEntry]:
@@ -438,14 +599,14 @@ async def get_aggregated_sentiment(
         raise ValueError("invalid AppSync schema")
     schema = DSLSchema(appsync_session.client.schema)
  
-    result = await execute_get_transcript_segments_query(
+    segments = await get_transcript_segments_with_sentiment(
         message=message,
         appsync_session=appsync_session
     )
  
     sentiment_entry_list_by_channel: Dict[ChannelType, SentimentPerChannel] = {}
 
-    for segment in result.get("getTranscriptSegmentsWithSentiment").get("TranscriptSegmentsWithSentiment"):
+    for segment in segments:
         channel = segment.get("Channel", None)
         if channel and channel in ["AGENT", "CALLER"] :
             if segment.get("SentimentWeighted", None):
@@ -1243,6 +1404,55 @@ def isAssistantWakePhrase(transcript):
     return False
 
 
+##########################################################################
+# Rolling summary
+##########################################################################
+
+def evict_rolling_summary_state(now: float):
+    expired = [
+        call_id
+        for call_id, state in ROLLING_SUMMARY_STATE.items()
+        if now - state["LastTriggeredAt"] > ROLLING_SUMMARY_STATE_TTL_SECONDS
+    ]
+    for call_id in expired:
+        del ROLLING_SUMMARY_STATE[call_id]
+    while len(ROLLING_SUMMARY_STATE) > ROLLING_SUMMARY_STATE_MAX_CALLS:
+        ROLLING_SUMMARY_STATE.popitem(last=False)
+
+
+def trigger_rolling_summary(
+    message: Dict[str, Any],
+):
+    """Starts a rolling summary update when enough new final segments have arrived for the call"""
+    call_id = message["CallId"]
+    now = time.time()
+    state = ROLLING_SUMMARY_STATE.get(call_id)
+    if state is None:
+        state = ROLLING_SUMMARY_STATE[call_id] = dict(Segments=0, LastTriggeredAt=now)
+        # only scanned when a call is added, not on every segment
+        evict_rolling_summary_state(now)
+    else:
+        ROLLING_SUMMARY_STATE.move_to_end(call_id)
+    state["Segments"] += 1
+    if not (
+        (ROLLING_SUMMARY_INTERVAL_SEGMENTS
+         and state["Segments"] >= ROLLING_SUMMARY_INTERVAL_SEGMENTS)
+        or (ROLLING_SUMMARY_INTERVAL_SECONDS
+            and now - state["LastTriggeredAt"] >= ROLLING_SUMMARY_INTERVAL_SECONDS)
+    ):
+        return
+    LOGGER.debug(
+        "Trigger rolling summary update for CallId: %s, new segments: %d", call_id, state["Segments"]
+    )
+    state["Segments"] = 0
+    state["LastTriggeredAt"] = now
+    LAMBDA_HOOK_CLIENT.invoke(
+        FunctionName=ASYNC_TRANSCRIPT_SUMMARY_ORCHESTRATOR_ARN,
+        InvocationType='Event',
+        Payload=json.dumps(dict(CallId=call_id, Rolling=True))
+    )
+
+
 ##########################################################################
 # Main event processing
 ##########################################################################
@@ -1360,6 +1570,7 @@ async def execute_process_event_api_mutation(
         else:
             return_value["successes"].append(response)
         
+        ROLLING_SUMMARY_STATE.pop(message.get("CallId", ""), None)
         if (IS_TRANSCRIPT_SUMMARY_ENABLED):
             LAMBDA_HOOK_CLIENT.invoke(
                 FunctionName=ASYNC_TRANSCRIPT_SUMMARY_ORCHESTRATOR_ARN,
@@ -1367,6 +1578,13 @@ async def execute_process_event_api_mutation(
                 Payload=json.dumps(message)
             )
             LOGGER.debug("END Event: Invoked Async Transcript Summary Lambda")
+        elif (IS_TRANSCRIPT_COMPACTION_ENABLED):
+            LAMBDA_HOOK_CLIENT.invoke(
+                FunctionName=ASYNC_TRANSCRIPT_SUMMARY_ORCHESTRATOR_ARN,
+                InvocationType='Event',
+                Payload=json.dumps(dict(CallId=message.get("CallId", ""), CompactOnly=True))
+            )
+            LOGGER.debug("END Event: Invoked Async Transcript Summary Lambda for transcript compaction")
       
         if isinstance(response, Exception):
             return_value["errors"].append(response)
@@ -1473,6 +1691,10 @@ async def execute_process_event_api_mutation(
                     InvocationType='Event',
                     Payload=json.dumps(normalized_message)
                 )
+            if (IS_ROLLING_SUMMARY_ENABLED
+                    and not normalized_message["IsPartial"]
+                    and normalized_message.get("Channel") in ["AGENT", "CALLER"]):
+                trigger_rolling_summary(normalized_message)
 
         add_call_category_tasks = []
 
@@ -1,102 +1,30 @@
 import os
-import io
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
-from botocore.exceptions import ClientError
 import json
-import csv
-import logging
-import re
+
+from aws_lambda_powertools import Metrics
+# transcript fetch logic is shared with the in-process summary pipeline, in the transcript
+# enrichment layer
+from transcript_summary import TranscriptMemoryCache
+from lambda_utils import encode_payload
 
 # grab environment variables
 LCA_CALL_EVENTS_TABLE = os.environ['LCA_CALL_EVENTS_TABLE']
 
-runtime = boto3.client('runtime.sagemaker')
-logger = logging.getLogger(__name__)
 ddb = boto3.resource('dynamodb')
-
-issue_remover = re.compile('<span class=\'issue-pill\'>Issue Detected</span>')
-html_remover = re.compile('<[^>]*>')
-filler_remover = re.compile('(^| )([Uu]m|[Uu]h|[Ll]ike|[Mm]hm)[,]?')
+s3 = boto3.client('s3')
 
 lca_call_events = ddb.Table(LCA_CALL_EVENTS_TABLE)
 
+# responses for ended calls are kept in memory, so repeated reads after the call don't re-read and
+# re-format the transcript. Created once per container.
+transcript_cache = TranscriptMemoryCache(lca_call_events)
 
-def get_transcripts(callid):
-
-    pk = 'trs#'+callid
-    print(pk)
-
-    try:
-        response = lca_call_events.query(KeyConditionExpression=Key('PK').eq(pk), FilterExpression=(
-            Attr('Channel').eq('AGENT') | Attr('Channel').eq('CALLER')) & Attr('IsPartial').eq(False))
-        # response = lca_call_events.query(KeyConditionExpression=Key('PK').eq(pk))
-    except ClientError as err:
-        logger.error("Error getting transcripts from LCA Call Events table %s: %s",
-                     err.response['Error']['Code'], err.response['Error']['Message'])
-        raise
-    else:
-        # print(response['Items'])
-        return response['Items']
-
-
-def preprocess_transcripts(transcripts, condense, includeSpeaker):
-    data = []
-
-    transcripts.sort(key=lambda x: x['EndTime'])
-
-    last_channel = 'start'
-    for row in transcripts:
-        transcript = row['Transcript']
-        
-        # prefix Speaker name to transcript segments if "IncludeSpeaker" parameter is set to True. 
-        if includeSpeaker == True:
-            # For LMA 'Hey Q' answers, we should keep assistant replies as part of the transcript for any contextual followup 'Hey Q' questions.
-            if row['Channel'] == 'AGENT_ASSISTANT':
-                # Add the 'MeetingAssistant:' prefix for assistant messages
-                transcript = "MeetingAssistant: " + transcript
-            else: 
-                # Add the 'Speaker:' prefix for Transcript segments if "Speaker" field is present
-                speakerName = row.get('Speaker', None)
-                if speakerName:
-                    transcript = speakerName.strip() + ': ' + transcript
-                    
-        if condense == True:
-            transcript = remove_issues(transcript)
-            transcript = remove_html(transcript)
-            transcript = remove_filler_words(transcript).strip()
-
-            if len(transcript) > 1:
-                transcript = '\n' + transcript
-        else:
-            transcript = '\n' + transcript
-
-        data.append(transcript)
-
-    return data
-
-
-def remove_issues(transcript_string):
-    return re.sub(issue_remover, '', transcript_string)
-
-
-def remove_html(transcript_string):
-    return re.sub(html_remover, '', transcript_string)
-
-
-def remove_filler_words(transcript_string):
-    return re.sub(filler_remover, '', transcript_string)
-
-
-def truncate_number_of_words(transcript_string, truncateLength):
-    # findall can retain carriage returns
-    data = re.findall(r'\S+|\n|.|,', transcript_string)
-    if truncateLength > 0:
-        data = data[0:truncateLength]
-    print('Token Count: ' + str(len(data)))
-    return ''.join(data)
+# namespace from POWERTOOLS_METRICS_NAMESPACE
+METRICS = Metrics(service="FetchTranscript")
 
 
+@METRICS.log_metrics
 def lambda_handler(event, context):
     print("Received event: " + json.dumps(event, indent=2))
 
@@ -114,14 +42,49 @@ def lambda_handler(event, context):
     includeSpeaker = False
     if 'IncludeSpeaker' in data:
         includeSpeaker = data['IncludeSpeaker']
-        
-    transcripts = get_transcripts(callid)
-    transcripts = preprocess_transcripts(transcripts, preProcess, includeSpeaker)
-    transcript_string = ''.join(transcripts)
-    transcript_string = truncate_number_of_words(transcript_string, tokenCount)
-    response = {'transcript': transcript_string}
-    # print(transcript_string)
-    return response
+
+    sinceEndTime = 0
+    if 'SinceEndTime' in data:
+        sinceEndTime = data['SinceEndTime']
+
+    # only the latest N segments - read newest first from the final segment index, so the cost
+    # doesn't grow with the length of the meeting
+    lastNTurns = 0
+    if 'LastNTurns' in data:
+        lastNTurns = int(data['LastNTurns'])
+
+    # "turns" returns a list of {id, speaker, channel, text, start, end} instead of the transcript
+    # string
+    outputFormat = data.get('OutputFormat', 'text')
+
+    # consecutive segments of the same speaker up to MergeGapSeconds apart are returned as one turn
+    mergeGapSeconds = -1
+    if 'MergeGapSeconds' in data:
+        mergeGapSeconds = float(data['MergeGapSeconds'])
+
+    # large responses are returned as a pointer to a gzip compressed S3 object - callers that can
+    # read pointers opt in, others only get one when the response is over the Lambda payload limit
+    acceptPayloadUrl = bool(data.get('AcceptPayloadUrl', False))
+
+    # lastEndTime is the EndTime of the latest segment returned, used by callers as the SinceEndTime
+    # cursor for their next request
+    response = transcript_cache.fetch_transcript(
+        callid,
+        token_count=tokenCount,
+        process_transcript=preProcess,
+        include_speaker=includeSpeaker,
+        since_end_time=sinceEndTime,
+        last_n_turns=lastNTurns,
+        output_format=outputFormat,
+        merge_gap_seconds=mergeGapSeconds,
+    )
+    transcript_cache.add_metrics(METRICS)
+    return encode_payload(
+        response,
+        s3,
+        key_prefix=f"fetch-transcript/{callid}/",
+        accept_pointer=acceptPayloadUrl,
+    )
 
 
 # Test case
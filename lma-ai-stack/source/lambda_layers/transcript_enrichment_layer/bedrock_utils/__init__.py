@@ -0,0 +1,6 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Bedrock Client Utilities"""
+from .pacer import BedrockPacer
+
+__all__ = ["BedrockPacer"]
@@ -0,0 +1,252 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Bedrock Request Pacer
+
+Paces the concurrent Bedrock InvokeModel requests of one container (eg the prompt templates of
+one summary), and retries throttled requests. Requests wait for capacity in two token buckets -
+requests per minute and estimated (input + output) tokens per minute - instead of being sent in
+a burst. The bucket rates are halved when Bedrock throttles a request, and increased additively
+on each success back up to the configured rates.
+
+This is not a quota limiter: the buckets aren't shared between containers or functions, and
+don't see Bedrock requests made outside this package (eg the meeting assistant hooks). Bedrock
+quotas are kept by limiting the concurrency of the functions.
+"""
+from os import getenv
+from threading import Condition
+from typing import TYPE_CHECKING, Any, Dict, Optional
+import json
+import random
+import time
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from botocore.exceptions import ClientError
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_bedrock_runtime.client import BedrockRuntimeClient
+else:
+    BedrockRuntimeClient = object
+
+# Rates of one container - 0 disables pacing (throttled requests are still retried with backoff)
+BEDROCK_CONTAINER_REQUESTS_PER_MINUTE = int(getenv("BEDROCK_CONTAINER_REQUESTS_PER_MINUTE", "0"))
+BEDROCK_CONTAINER_TOKENS_PER_MINUTE = int(getenv("BEDROCK_CONTAINER_TOKENS_PER_MINUTE", "0"))
+BEDROCK_MAX_RETRIES = int(getenv("BEDROCK_MAX_RETRIES", "4"))
+
+RETRYABLE_ERROR_CODES = (
+    "ThrottlingException",
+    "InternalServerException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+)
+# AIMD parameters - the rate scale is halved at most once per cooldown, so one burst of throttled
+# requests only counts as one decrease
+RATE_SCALE_MIN = 0.05
+RATE_SCALE_DECREASE_FACTOR = 0.5
+RATE_SCALE_INCREASE = 0.05
+RATE_SCALE_DECREASE_COOLDOWN_SECONDS = 2.0
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+# Fast local token estimate - roughly 4 characters per token
+CHARS_PER_TOKEN = 4
+
+
+class TokenBucket:
+    """Token bucket refilled at rate_per_minute * scale, holding up to one minute of tokens"""
+
+    def __init__(self, rate_per_minute: int) -> None:
+        self.rate_per_minute = rate_per_minute
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.updated_at = time.monotonic()
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.rate_per_minute > 0
+
+    def refill(self, scale: float) -> None:
+        now = time.monotonic()
+        refilled = (now - self.updated_at) * self.rate_per_minute * scale / 60
+        self.tokens = min(self.capacity, self.tokens + refilled)
+        self.updated_at = now
+
+    def get_wait_seconds(self, amount: float, scale: float) -> float:
+        """Seconds until amount tokens can be taken"""
+        if not self.is_enabled:
+            return 0.0
+        # a request larger than the bucket waits for a full bucket, rather than forever
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) * 60 / (self.rate_per_minute * scale)
+
+    def take(self, amount: float) -> None:
+        if self.is_enabled:
+            # may go negative for requests larger than the bucket, and for estimate corrections
+            self.tokens -= amount
+
+
+class BedrockPacer:
+    """Paced Bedrock InvokeModel with throttling retries
+
+    Shared by all the threads of a container - create one instance per container.
+    """
+
+    def __init__(
+        self,
+        bedrock_client: BedrockRuntimeClient,
+        requests_per_minute: int = BEDROCK_CONTAINER_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = BEDROCK_CONTAINER_TOKENS_PER_MINUTE,
+        max_retries: int = BEDROCK_MAX_RETRIES,
+    ) -> None:
+        self.bedrock_client = bedrock_client
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.rate_scale = 1.0
+        self.decreased_at = 0.0
+        self.condition = Condition()
+        self.stats: Dict[str, float] = {}
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats = dict(
+            Requests=0,
+            Throttles=0,
+            Retries=0,
+            Errors=0,
+            WaitMilliseconds=0,
+            EstimatedTokens=0,
+            InvocationTokens=0,
+        )
+
+    @staticmethod
+    def estimate_tokens(body: str) -> int:
+        """Estimated input + maximum output tokens of a request body"""
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = {}
+        max_output_tokens = request.get("max_tokens") or request.get("max_tokens_to_sample") or 0
+        return len(body) // CHARS_PER_TOKEN + int(max_output_tokens)
+
+    def acquire(self, estimated_tokens: int, deadline: Optional[float] = None) -> float:
+        """Waits for capacity for one request of estimated_tokens - returns the seconds waited
+
+        Raises TimeoutError if there is no capacity by the deadline (time.monotonic()).
+        """
+        started_at = time.monotonic()
+        with self.condition:
+            while True:
+                self.request_bucket.refill(self.rate_scale)
+                self.token_bucket.refill(self.rate_scale)
+                wait_seconds = max(
+                    self.request_bucket.get_wait_seconds(1, self.rate_scale),
+                    self.token_bucket.get_wait_seconds(estimated_tokens, self.rate_scale),
+                )
+                if wait_seconds <= 0:
+                    self.request_bucket.take(1)
+                    self.token_bucket.take(estimated_tokens)
+                    break
+                if deadline is not None:
+                    remaining_seconds = deadline - time.monotonic()
+                    if remaining_seconds <= 0:
+                        raise TimeoutError("Timed out waiting for Bedrock request capacity")
+                    wait_seconds = min(wait_seconds, remaining_seconds)
+                self.condition.wait(timeout=wait_seconds)
+        return time.monotonic() - started_at
+
+    def on_success(self) -> None:
+        with self.condition:
+            self.rate_scale = min(1.0, self.rate_scale + RATE_SCALE_INCREASE)
+
+    def on_throttle(self) -> None:
+        with self.condition:
+            now = time.monotonic()
+            if now - self.decreased_at >= RATE_SCALE_DECREASE_COOLDOWN_SECONDS:
+                self.rate_scale = max(RATE_SCALE_MIN, self.rate_scale * RATE_SCALE_DECREASE_FACTOR)
+                self.decreased_at = now
+                LOGGER.info("Bedrock throttled - rate scale decreased to %.2f", self.rate_scale)
+
+    def correct_token_estimate(self, response: Dict[str, Any], estimated_tokens: int) -> None:
+        """Charges the token bucket for the actual, rather than estimated, token count"""
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        input_tokens = headers.get("x-amzn-bedrock-input-token-count")
+        output_tokens = headers.get("x-amzn-bedrock-output-token-count")
+        if input_tokens is None or output_tokens is None:
+            return
+        actual_tokens = int(input_tokens) + int(output_tokens)
+        with self.condition:
+            self.stats["InvocationTokens"] += actual_tokens
+            self.token_bucket.take(actual_tokens - estimated_tokens)
+
+    def invoke_model(
+        self, timeout_seconds: Optional[float] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        """Bedrock InvokeModel, with the same arguments and response as the client method
+
+        :parameter timeout_seconds: no attempt is started after this many seconds - the last
+            attempt is bounded by the client read_timeout (None - no timeout)
+        """
+        estimated_tokens = self.estimate_tokens(kwargs.get("body", ""))
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        attempt = 0
+        while True:
+            try:
+                waited = self.acquire(estimated_tokens, deadline)
+            except TimeoutError:
+                with self.condition:
+                    self.stats["Errors"] += 1
+                raise
+            with self.condition:
+                self.stats["Requests"] += 1
+                self.stats["EstimatedTokens"] += estimated_tokens
+                self.stats["WaitMilliseconds"] += int(waited * 1000)
+            try:
+                response = self.bedrock_client.invoke_model(**kwargs)
+            except ClientError as error:
+                code = error.response.get("Error", {}).get("Code", "")
+                # full jitter backoff, so throttled requests don't retry in lockstep
+                backoff_seconds = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**(attempt + 1))
+                sleep_seconds = random.uniform(0, backoff_seconds)
+                if (
+                    code not in RETRYABLE_ERROR_CODES
+                    or attempt >= self.max_retries
+                    or (deadline is not None and time.monotonic() + sleep_seconds >= deadline)
+                ):
+                    with self.condition:
+                        self.stats["Errors"] += 1
+                    raise
+                if code == "ThrottlingException":
+                    with self.condition:
+                        self.stats["Throttles"] += 1
+                    self.on_throttle()
+                attempt += 1
+                with self.condition:
+                    self.stats["Retries"] += 1
+                time.sleep(sleep_seconds)
+                continue
+            self.on_success()
+            self.correct_token_estimate(response, estimated_tokens)
+            return response
+
+    def add_metrics(self, metrics: Metrics) -> None:
+        """Adds the counters since the last call to metrics, published by its log_metrics
+
+        The counters are reset.
+        """
+        with self.condition:
+            stats = self.stats
+            rate_scale = self.rate_scale
+            self.reset_stats()
+        if not stats["Requests"]:
+            return
+        for name, value in stats.items():
+            unit = MetricUnit.Milliseconds if name == "WaitMilliseconds" else MetricUnit.Count
+            metrics.add_metric(name=f"Bedrock{name}", unit=unit, value=value)
+        metrics.add_metric(
+            name="BedrockRateScale", unit=MetricUnit.Percent, value=round(rate_scale * 100, 1)
+        )
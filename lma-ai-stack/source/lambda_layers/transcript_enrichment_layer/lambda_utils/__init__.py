@@ -2,5 +2,6 @@
 # SPDX-License-Identifier: Apache-2.0
 """Async Lambda Client Utilities"""
 from .lambda_request import invoke_lambda
+from .payload_transport import decode_payload, encode_payload, is_payload_pointer
 
-__all__ = ["invoke_lambda"]
+__all__ = ["invoke_lambda", "decode_payload", "encode_payload", "is_payload_pointer"]
@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Large Lambda Payload Transport
+
+Synchronous Lambda responses are limited to 6 MB of JSON, and the transcript of a long meeting
+gets close to it. Responses larger than a threshold are written to S3 as gzip compressed JSON
+instead, and a pointer to the object (with a presigned URL, so receivers need no S3 permissions)
+is returned in their place. Smaller responses are returned inline, unchanged.
+
+Pointer:
+    {
+        "PayloadUrl": "https://...",
+        "PayloadBucket": "...",
+        "PayloadKey": "...",
+        "PayloadEncoding": "gzip",
+        "PayloadBytes": 1234567
+    }
+"""
+from os import getenv
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from urllib.request import urlopen
+import gzip
+import json
+import uuid
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3.client import S3Client
+else:
+    S3Client = object
+
+LAMBDA_PAYLOAD_BUCKET_NAME = getenv("LAMBDA_PAYLOAD_BUCKET_NAME", "")
+# serialized bytes above which a payload is sent through S3, when the receiver accepts pointers
+LAMBDA_PAYLOAD_INLINE_MAX_BYTES = int(getenv("LAMBDA_PAYLOAD_INLINE_MAX_BYTES", str(256 * 1024)))
+LAMBDA_PAYLOAD_URL_EXPIRES_SECONDS = int(getenv("LAMBDA_PAYLOAD_URL_EXPIRES_SECONDS", "900"))
+# synchronous invoke response limit (6 MB), less some room for the runtime envelope
+LAMBDA_RESPONSE_MAX_BYTES = 6 * 1024 * 1024 - 16 * 1024
+PAYLOAD_ENCODING_GZIP = "gzip"
+
+
+def is_payload_pointer(payload: Any) -> bool:
+    return isinstance(payload, dict) and "PayloadUrl" in payload and "PayloadEncoding" in payload
+
+
+def encode_payload(
+    payload: Dict[str, Any],
+    s3_client: S3Client,
+    key_prefix: str = "",
+    accept_pointer: bool = True,
+    bucket_name: str = LAMBDA_PAYLOAD_BUCKET_NAME,
+) -> Dict[str, Any]:
+    """Returns the payload, or a pointer to it in S3 if it is too large to send inline
+
+    :parameter accept_pointer: the receiver understands pointers - if false, the payload is only
+        sent through S3 when it is over the Lambda response limit (it would fail inline anyway)
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    max_bytes = LAMBDA_PAYLOAD_INLINE_MAX_BYTES if accept_pointer else LAMBDA_RESPONSE_MAX_BYTES
+    if len(body) <= max_bytes:
+        return payload
+    if not bucket_name:
+        LOGGER.warning(
+            "Payload of %d bytes returned inline - LAMBDA_PAYLOAD_BUCKET_NAME is not set", len(body)
+        )
+        return payload
+
+    data = gzip.compress(body, compresslevel=6)
+    key = f"{key_prefix}{uuid.uuid4().hex}.json.gz"
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=data, ContentType="application/gzip")
+    url = s3_client.generate_presigned_url(
+        "get_object",
+        Params=dict(Bucket=bucket_name, Key=key),
+        ExpiresIn=LAMBDA_PAYLOAD_URL_EXPIRES_SECONDS,
+    )
+    LOGGER.info(
+        "Payload of %d bytes sent through s3://%s/%s (%d bytes)",
+        len(body),
+        bucket_name,
+        key,
+        len(data),
+    )
+    return {
+        "PayloadUrl": url,
+        "PayloadBucket": bucket_name,
+        "PayloadKey": key,
+        "PayloadEncoding": PAYLOAD_ENCODING_GZIP,
+        "PayloadBytes": len(body),
+    }
+
+
+def decode_payload(payload: Any, s3_client: Optional[S3Client] = None) -> Any:
+    """Returns the payload - read from S3 if it is a pointer
+
+    The object is decompressed as it is downloaded. Reads through the S3 client if one is given,
+    otherwise from the presigned URL.
+    """
+    if not is_payload_pointer(payload):
+        return payload
+    if payload["PayloadEncoding"] != PAYLOAD_ENCODING_GZIP:
+        raise ValueError(f"unsupported payload encoding: {payload['PayloadEncoding']}")
+    if s3_client:
+        response = s3_client.get_object(Bucket=payload["PayloadBucket"], Key=payload["PayloadKey"])
+        body = response["Body"]
+        with gzip.GzipFile(fileobj=body) as stream:
+            return json.load(stream)
+    with urlopen(payload["PayloadUrl"]) as response:  # nosec B310 - presigned https S3 URL
+        with gzip.GzipFile(fileobj=response) as stream:
+            return json.load(stream)
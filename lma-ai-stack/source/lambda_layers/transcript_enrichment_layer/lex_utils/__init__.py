@@ -1,6 +1,6 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 """Async Lex Client Utilities"""
-from .lex import recognize_text_lex
+from .lex import get_lex_session_id, recognize_text_lex
 
-__all__ = ["recognize_text_lex"]
+__all__ = ["get_lex_session_id", "recognize_text_lex"]
@@ -2,61 +2,193 @@
 # SPDX-License-Identifier: Apache-2.0
 """ Async Lex Client Utilities
 """
+from decimal import Decimal
+from os import getenv
+from typing import TYPE_CHECKING, Optional
 import asyncio
-from typing import TYPE_CHECKING
+import time
+import uuid
 
 # third-party imports from Lambda layer
 from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
 
 
 LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
 
 
 if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.service_resource import Table
     from mypy_boto3_lexv2_runtime.client import LexRuntimeV2Client
     from mypy_boto3_lexv2_runtime.type_defs import RecognizeTextResponseTypeDef
 else:
+    Table = object
     LexRuntimeV2Client = object
     RecognizeTextResponseTypeDef = object
 
+# namespace for deriving Lex session ids from call ids
+LEX_SESSION_NAMESPACE = uuid.UUID("6f1d3a52-8c1e-4b8e-9d2a-3f0c5e7a9b14")
 
-def recognize_text_lex(
+# Lex rejects concurrent requests for the same session with ConflictException, and the requests
+# of a call are sent by separate invocations, so each request holds a lease on its session in
+# DynamoDB (PK lexlease#<sessionId>) while it runs. A lease that isn't released (eg the invocation
+# timed out) expires after LEX_SESSION_LEASE_SECONDS. A request that waits longer than
+# LEX_SESSION_LEASE_WAIT_SECONDS for the lease is sent anyway, and retried on conflict.
+LEX_SESSION_LEASE_SECONDS = float(getenv("LEX_SESSION_LEASE_SECONDS", "15"))
+LEX_SESSION_LEASE_WAIT_SECONDS = float(getenv("LEX_SESSION_LEASE_WAIT_SECONDS", "30"))
+LEX_SESSION_LEASE_POLL_SECONDS = float(getenv("LEX_SESSION_LEASE_POLL_SECONDS", "0.1"))
+# lease items are deleted by the table TTL after a day
+LEX_SESSION_LEASE_EXPIRATION_SECONDS = 24 * 60 * 60
+
+
+def get_lex_session_id(call_id: str) -> str:
+    """Returns a Lex session id for the call that is the same in every container
+
+    The built in hash() is randomized per process, so it can't be used for this.
+    """
+    return str(uuid.uuid5(LEX_SESSION_NAMESPACE, call_id))
+
+
+def get_lease_key(session_id: str) -> dict:
+    pk = f"lexlease#{session_id}"
+    return {"PK": pk, "SK": pk}
+
+
+async def acquire_session_lease(lease_table: Table, session_id: str) -> Optional[str]:
+    """Waits for the lease on the Lex session
+
+    Returns the lease id, or None if the wait timed out.
+    """
+    lease_id = uuid.uuid4().hex
+    event_loop = asyncio.get_running_loop()
+    deadline = time.time() + LEX_SESSION_LEASE_WAIT_SECONDS
+    while True:
+        now = time.time()
+        try:
+            await event_loop.run_in_executor(
+                None,
+                lambda: lease_table.put_item(
+                    Item={
+                        **get_lease_key(session_id),
+                        "LeaseId": lease_id,
+                        "LeaseUntil": Decimal(str(round(now + LEX_SESSION_LEASE_SECONDS, 3))),
+                        "ExpiresAfter": int(now) + LEX_SESSION_LEASE_EXPIRATION_SECONDS,
+                    },
+                    # free, or held by a request that didn't release it in time
+                    ConditionExpression="attribute_not_exists(PK) OR LeaseUntil < :now",
+                    ExpressionAttributeValues={":now": Decimal(str(round(now, 3)))},
+                ),
+            )
+            return lease_id
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        if now >= deadline:
+            LOGGER.warning(
+                "Lex session lease wait timed out - sending the request",
+                extra=dict(session_id=session_id),
+            )
+            return None
+        await asyncio.sleep(LEX_SESSION_LEASE_POLL_SECONDS)
+
+
+async def release_session_lease(lease_table: Table, session_id: str, lease_id: str) -> None:
+    event_loop = asyncio.get_running_loop()
+    try:
+        await event_loop.run_in_executor(
+            None,
+            lambda: lease_table.delete_item(
+                Key=get_lease_key(session_id),
+                # the lease may have expired and been taken by another request
+                ConditionExpression="LeaseId = :leaseId",
+                ExpressionAttributeValues={":leaseId": lease_id},
+            ),
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            LOGGER.warning("Lex session lease release failed", extra=dict(error=error))
+
+
+async def recognize_text_lex(
     text: str,
-    session_id: str,
     lex_client: LexRuntimeV2Client,
     bot_id: str,
     bot_alias_id: str,
     locale_id: str,
+    session_id: Optional[str] = None,
     max_retries: int = 3,
-    call_id: str = None,
+    call_id: Optional[str] = None,
+    lease_table: Optional[Table] = None,
+) -> RecognizeTextResponseTypeDef:
+    """Runs Lex Recognize Text in the Async Event Loop
+
+    :parameter lease_table: table holding the Lex session leases, which serialize the requests of
+        a session across invocations (None - requests are only retried on ConflictException)
+    """
+    # pylint: disable=too-many-arguments
+    if session_id is None:
+        session_id = get_lex_session_id(call_id)
+
+    lease_id = None
+    if lease_table is not None:
+        lease_id = await acquire_session_lease(lease_table, session_id)
+    try:
+        return await _recognize_text(
+            text=text,
+            session_id=session_id,
+            lex_client=lex_client,
+            bot_id=bot_id,
+            bot_alias_id=bot_alias_id,
+            locale_id=locale_id,
+            max_retries=max_retries,
+            call_id=call_id,
+        )
+    finally:
+        if lease_id:
+            await release_session_lease(lease_table, session_id, lease_id)
+
+
+async def _recognize_text(
+    text: str,
+    session_id: str,
+    lex_client: LexRuntimeV2Client,
+    bot_id: str,
+    bot_alias_id: str,
+    locale_id: str,
+    max_retries: int,
+    call_id: Optional[str],
 ) -> RecognizeTextResponseTypeDef:
-    """Runs Lex Recognize Text in the Async Event Loop"""
     # pylint: disable=too-many-arguments
     retry_count = 0
     bot_responded: bool = False
     bot_response: RecognizeTextResponseTypeDef
+    event_loop = asyncio.get_running_loop()
     while not bot_responded and retry_count < max_retries:
         try:
-            # we do not set sessionAttributes here, since client is stateless and we want to 
+            # we do not set sessionAttributes here, since client is stateless and we want to
             # preserve Lex sessionAttribute state. Use requestAttributes for callId.
-            bot_response = lex_client.recognize_text(
+            bot_response = await event_loop.run_in_executor(
+                None,
+                lambda: lex_client.recognize_text(
                     text=text,
                     sessionId=session_id,
                     botId=bot_id,
                     botAliasId=bot_alias_id,
                     localeId=locale_id,
-                    requestAttributes={'callId':call_id}
-                )
+                    requestAttributes={'callId': call_id}
+                ),
+            )
             bot_responded = True
         except lex_client.exceptions.ConflictException as error:
+            # a request that didn't get the session lease in time, or outlived it
             retry_count = retry_count + 1
             LOGGER.warning(
-                "recognize_text retriable exception",
+                "recognize_text conflict with a request from another invocation",
                 extra=dict(error=error, retry_count=retry_count),
             )
-            sleep(0.25 * retry_count)
             if retry_count >= max_retries:
                 raise
+            await asyncio.sleep(0.25 * retry_count)
         except Exception:  # pylint: disable=broad-except
             LOGGER.exception("recognize_text_lex")
             raise
@@ -0,0 +1,31 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Call Transcript Fetch, Summary and Publishing"""
+from .cache import SummaryCache
+from .document import read_transcript_document
+from .fetch import (
+    compact_transcript,
+    fetch_transcript,
+    format_transcript,
+    iter_transcript_segments,
+    read_transcripts,
+)
+from .memory_cache import TranscriptMemoryCache
+from .publish import write_call_summary_to_kds
+from .routing import ModelRouter
+from .summary import TranscriptSummarizer, create_bedrock_client
+
+__all__ = [
+    "SummaryCache",
+    "read_transcript_document",
+    "compact_transcript",
+    "fetch_transcript",
+    "format_transcript",
+    "read_transcripts",
+    "iter_transcript_segments",
+    "TranscriptMemoryCache",
+    "write_call_summary_to_kds",
+    "ModelRouter",
+    "TranscriptSummarizer",
+    "create_bedrock_client",
+]
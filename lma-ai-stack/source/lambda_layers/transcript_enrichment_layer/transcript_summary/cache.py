@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Summary Result Cache
+
+Stores on demand summaries in DynamoDB, keyed on the call, the transcript they were generated
+from, the prompt templates and the model, so repeated requests with unchanged inputs return
+the stored summary without calling Bedrock. Concurrent identical requests share one generation:
+the first request takes a PENDING lease on the item and the others wait for its result.
+"""
+from datetime import datetime
+from os import getenv
+from typing import TYPE_CHECKING, Any, Dict, Optional
+import hashlib
+import json
+import time
+import uuid
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+else:
+    DynamoDBClient = object
+
+SUMMARY_CACHE_TABLE_NAME = getenv("SUMMARY_CACHE_TABLE_NAME", "")
+SUMMARY_CACHE_TTL_SECONDS = int(getenv("SUMMARY_CACHE_TTL_SECONDS", "86400"))
+# how long a request may hold the PENDING lease while it generates the summary, after which
+# waiting requests stop waiting and generate the summary themselves
+SUMMARY_CACHE_LEASE_SECONDS = int(getenv("SUMMARY_CACHE_LEASE_SECONDS", "300"))
+SUMMARY_CACHE_POLL_SECONDS = float(getenv("SUMMARY_CACHE_POLL_SECONDS", "1"))
+
+STATUS_PENDING = "PENDING"
+STATUS_DONE = "DONE"
+
+
+def get_cache_key(*parts: Any) -> str:
+    """Hash of the JSON serialized inputs"""
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """DynamoDB summary cache with single-flight generation"""
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBClient,
+        table_name: str = SUMMARY_CACHE_TABLE_NAME,
+        ttl_seconds: int = SUMMARY_CACHE_TTL_SECONDS,
+        lease_seconds: int = SUMMARY_CACHE_LEASE_SECONDS,
+    ) -> None:
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = str(uuid.uuid4())
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(self.table_name) and self.ttl_seconds > 0
+
+    @staticmethod
+    def get_item_key(call_id: str, cache_key: str) -> Dict[str, Dict[str, str]]:
+        return {"PK": {"S": f"sc#{call_id}"}, "SK": {"S": f"sc#{cache_key}"}}
+
+    def get(self, call_id: str, cache_key: str) -> Optional[Dict[str, Any]]:
+        response = self.dynamodb_client.get_item(
+            Key=self.get_item_key(call_id, cache_key),
+            TableName=self.table_name,
+            ConsistentRead=True,
+        )
+        return response.get("Item")
+
+    def acquire(self, call_id: str, cache_key: str) -> Optional[str]:
+        """Returns the cached summary, or None if this request now holds the lease to generate it
+
+        Waits while another request holds the lease. If that request doesn't finish within the
+        lease, returns None without the lease, so this request generates the summary itself.
+        """
+        now = time.time()
+        try:
+            self.dynamodb_client.put_item(
+                Item={
+                    **self.get_item_key(call_id, cache_key),
+                    "Status": {"S": STATUS_PENDING},
+                    "Owner": {"S": self.owner},
+                    "LeaseExpiresAt": {"N": str(now + self.lease_seconds)},
+                    "ExpiresAfter": {"N": str(int(now) + self.ttl_seconds)},
+                },
+                TableName=self.table_name,
+                ConditionExpression=(
+                    "attribute_not_exists(PK) OR (#status = :pending AND LeaseExpiresAt < :now)"
+                ),
+                ExpressionAttributeNames={"#status": "Status"},
+                ExpressionAttributeValues={
+                    ":pending": {"S": STATUS_PENDING},
+                    ":now": {"N": str(now)},
+                },
+            )
+            LOGGER.debug("Summary cache miss - lease acquired", extra=dict(cache_key=cache_key))
+            return None
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        while True:
+            item = self.get(call_id, cache_key)
+            if not item:
+                # the request holding the lease failed and released it
+                LOGGER.info("Summary cache lease released without a result - generating summary")
+                return None
+            if item["Status"]["S"] == STATUS_DONE:
+                LOGGER.info("Summary cache hit", extra=dict(cache_key=cache_key))
+                return item["Summary"]["S"]
+            if float(item["LeaseExpiresAt"]["N"]) < time.time():
+                LOGGER.info("Summary cache lease expired - generating summary")
+                return None
+            time.sleep(SUMMARY_CACHE_POLL_SECONDS)
+
+    def put(self, call_id: str, cache_key: str, summary: str) -> None:
+        try:
+            self.dynamodb_client.put_item(
+                Item={
+                    **self.get_item_key(call_id, cache_key),
+                    "Status": {"S": STATUS_DONE},
+                    "Summary": {"S": summary},
+                    "CreatedAt": {"S": datetime.utcnow().astimezone().isoformat()},
+                    "ExpiresAfter": {"N": str(int(time.time()) + self.ttl_seconds)},
+                },
+                TableName=self.table_name,
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Error writing summary cache item: %r", error)
+            self.release(call_id, cache_key)
+
+    def release(self, call_id: str, cache_key: str) -> None:
+        """Removes this request's lease without a result, so waiting requests stop waiting"""
+        try:
+            self.dynamodb_client.delete_item(
+                Key=self.get_item_key(call_id, cache_key),
+                TableName=self.table_name,
+                ConditionExpression="#status = :pending AND #owner = :owner",
+                ExpressionAttributeNames={"#status": "Status", "#owner": "Owner"},
+                ExpressionAttributeValues={
+                    ":pending": {"S": STATUS_PENDING},
+                    ":owner": {"S": self.owner},
+                },
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.debug("Summary cache lease not released: %r", error)
@@ -0,0 +1,197 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Compacted Transcript Document
+
+At the end of a call, its final transcript segments (in EndTime order, with sentiment) are
+written to the event sourcing table as one gzip compressed JSON document, so that post-call
+readers get the whole transcript from a single query instead of reading every segment item.
+
+The document is stored under PK tdoc#<callId>, split into parts to stay under the DynamoDB
+item size limit. The header item (SK p#00000) is written last and holds the document version,
+the number of data parts (SK p#00001...) and the id of the compaction that wrote them, so a
+partially written or mixed document is never read. It also holds the last EndTime and the ids of
+the last segments, so readers can tell when segments were stored after the compaction.
+"""
+from decimal import Decimal
+from os import getenv
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import gzip
+import json
+import time
+import uuid
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.service_resource import Table
+else:
+    Table = object
+
+# read the compacted document first in fetch_transcript - "false" always reads the segment items
+TRANSCRIPT_DOCUMENT_ENABLED = getenv("TRANSCRIPT_DOCUMENT_ENABLED", "true").lower() == "true"
+MEETING_RECORD_EXPIRATION_IN_DAYS = int(getenv("MEETING_RECORD_EXPIRATION_IN_DAYS", "90"))
+# compressed bytes per part item - under the 400 KB DynamoDB item limit
+TRANSCRIPT_DOCUMENT_PART_BYTES = 350 * 1024
+TRANSCRIPT_DOCUMENT_VERSION = 1
+# The two channels of a call are written independently, so segments that end shortly before the
+# last one can still be stored after the call ends. The ids of the segments in this window before
+# the last EndTime are kept in the header, so readers can check that no segment is missing.
+TRANSCRIPT_DOCUMENT_TAIL_SECONDS = int(getenv("TRANSCRIPT_DOCUMENT_TAIL_SECONDS", "30"))
+# segment attributes kept in the document
+TRANSCRIPT_DOCUMENT_ATTRIBUTES = (
+    "SegmentId",
+    "Channel",
+    "Speaker",
+    "StartTime",
+    "EndTime",
+    "Transcript",
+    "Sentiment",
+    "SentimentScore",
+    "SentimentWeighted",
+)
+
+
+def get_document_pk(call_id: str) -> str:
+    return f"tdoc#{call_id}"
+
+
+def get_part_sk(part: int) -> str:
+    return f"p#{part:05d}"
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_document(segments: List[Dict[str, Any]]) -> bytes:
+    rows = [
+        {name: row[name] for name in TRANSCRIPT_DOCUMENT_ATTRIBUTES if name in row}
+        for row in segments
+    ]
+    body = json.dumps(rows, default=to_json_value, separators=(",", ":"))
+    return gzip.compress(body.encode("utf-8"))
+
+
+def write_transcript_document(
+    table: Table,
+    call_id: str,
+    segments: List[Dict[str, Any]],
+    expires_after: int = 0,
+) -> Dict[str, Any]:
+    """Writes the segments as the compacted transcript document of the call
+
+    Returns the header item.
+
+    :parameter segments: final transcript segments, in EndTime order
+    :parameter expires_after: TTL epoch seconds (0 - MEETING_RECORD_EXPIRATION_IN_DAYS from now)
+    """
+    data = encode_document(segments)
+    parts = [
+        data[start:start + TRANSCRIPT_DOCUMENT_PART_BYTES]
+        for start in range(0, len(data), TRANSCRIPT_DOCUMENT_PART_BYTES)
+    ] or [b""]
+    pk = get_document_pk(call_id)
+    document_id = uuid.uuid4().hex
+    expires_after = expires_after or (
+        int(time.time()) + MEETING_RECORD_EXPIRATION_IN_DAYS * 24 * 60 * 60
+    )
+    last_end_time = max((float(row["EndTime"]) for row in segments), default=0)
+    tail_start_time = last_end_time - TRANSCRIPT_DOCUMENT_TAIL_SECONDS
+    for number, part in enumerate(parts, start=1):
+        table.put_item(
+            Item={
+                "PK": pk,
+                "SK": get_part_sk(number),
+                "DocumentId": document_id,
+                "Data": part,
+                "ExpiresAfter": expires_after,
+            }
+        )
+    header = {
+        "PK": pk,
+        "SK": get_part_sk(0),
+        "CallId": call_id,
+        "DocumentId": document_id,
+        "Version": TRANSCRIPT_DOCUMENT_VERSION,
+        "Parts": len(parts),
+        "SegmentCount": len(segments),
+        "LastEndTime": Decimal(str(last_end_time)),
+        "TailStartTime": Decimal(str(tail_start_time)),
+        "TailSegmentIds": [
+            row["SegmentId"] for row in segments if float(row["EndTime"]) > tail_start_time
+        ],
+        "CompressedBytes": len(data),
+        "CreatedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        "ExpiresAfter": expires_after,
+    }
+    # written last - readers ignore the parts until the header points at them
+    table.put_item(Item=header)
+    LOGGER.info(
+        "Transcript document written for %s: %d segments, %d bytes in %d parts",
+        call_id,
+        len(segments),
+        len(data),
+        len(parts),
+    )
+    return header
+
+
+def read_transcript_document_header(table: Table, call_id: str) -> Optional[Dict[str, Any]]:
+    """The header item of the compacted transcript document of the call, or None if it has none
+
+    The DocumentId of the header changes whenever the document is rewritten.
+    """
+    response = table.query(
+        KeyConditionExpression=(
+            Key("PK").eq(get_document_pk(call_id)) & Key("SK").eq(get_part_sk(0))
+        ),
+    )
+    items = response["Items"]
+    if not items or int(items[0].get("Version", 0)) != TRANSCRIPT_DOCUMENT_VERSION:
+        return None
+    return items[0]
+
+
+def read_transcript_document(table: Table, call_id: str) -> Optional[List[Dict[str, Any]]]:
+    """The segments of the compacted transcript document of the call, in EndTime order
+
+    Returns None if the call has no complete document (eg the call is still in progress).
+    """
+    query_args: Dict[str, Any] = dict(KeyConditionExpression=Key("PK").eq(get_document_pk(call_id)))
+    items: List[Dict[str, Any]] = []
+    try:
+        while True:
+            response = table.query(**query_args)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as error:
+        LOGGER.error(
+            "Error getting transcript document from call events table %s: %s",
+            error.response["Error"]["Code"],
+            error.response["Error"]["Message"],
+        )
+        raise
+    if not items or items[0]["SK"] != get_part_sk(0):
+        return None
+    header = items[0]
+    if int(header.get("Version", 0)) != TRANSCRIPT_DOCUMENT_VERSION:
+        LOGGER.info(
+            "Ignoring transcript document version %s for %s", header.get("Version"), call_id
+        )
+        return None
+    parts = [item for item in items[1:] if item.get("DocumentId") == header["DocumentId"]]
+    if len(parts) != int(header["Parts"]):
+        LOGGER.warning("Incomplete transcript document for %s - reading the segments", call_id)
+        return None
+    # binary attributes are returned as boto3 Binary values
+    data = b"".join(bytes(getattr(part["Data"], "value", part["Data"])) for part in parts)
+    return json.loads(gzip.decompress(data))
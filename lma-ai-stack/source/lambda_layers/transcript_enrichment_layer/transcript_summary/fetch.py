@@ -0,0 +1,484 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Call Transcript Fetch
+
+Reads the final transcript segments of a call from the event sourcing table and
+formats them as a transcript string.
+"""
+from decimal import Decimal
+from itertools import islice
+from os import getenv
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Set
+import re
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from .document import (
+    TRANSCRIPT_DOCUMENT_ENABLED,
+    TRANSCRIPT_DOCUMENT_TAIL_SECONDS,
+    read_transcript_document,
+    write_transcript_document,
+)
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.service_resource import Table
+else:
+    Table = object
+
+ISSUE_REMOVER = re.compile('<span class=\'issue-pill\'>Issue Detected</span>')
+HTML_REMOVER = re.compile('<[^>]*>')
+FILLER_REMOVER = re.compile('(^| )([Uu]m|[Uu]h|[Ll]ike|[Mm]hm)[,]?')
+TOKEN_FINDER = re.compile(r'\S+|\n|.|,')
+
+# Sparse index of the final segments - FinalSegmentPK (trs#<callId>) and EndTime are only set on
+# final segments by the addTranscriptSegment resolver. "" reads the call partitions instead.
+FINAL_SEGMENT_INDEX_NAME = getenv("FINAL_SEGMENT_INDEX_NAME", "FinalSegmentsByEndTime")
+
+
+# Only the attributes used to format the transcript - segment items also carry sentiment, timing
+# and status attributes that don't need to be read back
+TRANSCRIPT_PROJECTION = dict(
+    ProjectionExpression=(
+        "#SegmentId, #Channel, #Speaker, #Transcript, #StartTime, #EndTime, #IsPartial"
+    ),
+    ExpressionAttributeNames={
+        "#SegmentId": "SegmentId",
+        "#Channel": "Channel",
+        "#Speaker": "Speaker",
+        "#Transcript": "Transcript",
+        "#StartTime": "StartTime",
+        "#EndTime": "EndTime",
+        "#IsPartial": "IsPartial",
+    },
+)
+OUTPUT_FORMAT_TEXT = "text"
+OUTPUT_FORMAT_TURNS = "turns"
+# merge_gap_seconds value that leaves every segment on its own line
+MERGE_DISABLED = -1
+
+
+def query_items(table: Table, page_size: int = 0, **query_args: Any) -> Iterator[Dict[str, Any]]:
+    """Yields the items of a query, following LastEvaluatedKey one page at a time
+
+    :parameter page_size: maximum items read per query (0 - up to 1 MB)
+    """
+    if page_size:
+        query_args['Limit'] = page_size
+    while True:
+        try:
+            response = table.query(**query_args)
+        except ClientError as error:
+            LOGGER.error(
+                "Error getting transcripts from call events table %s: %s",
+                error.response['Error']['Code'],
+                error.response['Error']['Message'],
+            )
+            raise
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def is_call_indexed(table: Table, pk: str) -> bool:
+    """True if any final segment of the call is in the final segment index"""
+    response = table.query(
+        IndexName=FINAL_SEGMENT_INDEX_NAME,
+        KeyConditionExpression=Key('FinalSegmentPK').eq(pk),
+        ProjectionExpression='FinalSegmentPK',
+        Limit=1,
+    )
+    return bool(response['Items'])
+
+
+def has_segments_after_document(
+    table: Table,
+    call_id: str,
+    tail_start_time: float,
+    tail_segment_ids: Set[str],
+) -> bool:
+    """True if final segments that ended after tail_start_time were stored after the compaction
+
+    :parameter tail_segment_ids: ids of the segments in the document that ended after
+        tail_start_time
+    """
+    if not FINAL_SEGMENT_INDEX_NAME:
+        return False
+    key_condition = Key('FinalSegmentPK').eq(f"trs#{call_id}") & Key('EndTime').gt(
+        Decimal(str(tail_start_time))
+    )
+    for item in query_items(
+        table,
+        IndexName=FINAL_SEGMENT_INDEX_NAME,
+        KeyConditionExpression=key_condition,
+        FilterExpression=Attr('Channel').eq('AGENT') | Attr('Channel').eq('CALLER'),
+        ProjectionExpression="#SegmentId",
+        ExpressionAttributeNames={"#SegmentId": "SegmentId"},
+    ):
+        if item['SegmentId'] not in tail_segment_ids:
+            return True
+    return False
+
+
+def iter_transcript_segments(
+    table: Table,
+    call_id: str,
+    since_end_time: float = 0,
+    page_size: int = 0,
+    newest_first: bool = False,
+    full_items: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """Yields the final AGENT and CALLER segments of a call, one query page at a time
+
+    Reads the final segment index, in EndTime order, so partial segments aren't read at all. Calls
+    with no segments in the index (written before the index was added) are read from the call
+    partition instead, filtering out the partial segments, in SegmentId order. The next page is
+    only queried when the consumer gets to it, so consumers that stop early don't read the rest.
+
+    :parameter since_end_time: only return segments that ended after this time
+    :parameter page_size: maximum items read per query (0 - up to 1 MB)
+    :parameter newest_first: yield the segments in descending EndTime order - with page_size,
+        reading the last N segments of an indexed call only reads about N items
+    :parameter full_items: return all the segment attributes, not only those used in the transcript
+    """
+    pk = f"trs#{call_id}"
+    projection = {} if full_items else TRANSCRIPT_PROJECTION
+    channel_filter = Attr('Channel').eq('AGENT') | Attr('Channel').eq('CALLER')
+
+    if FINAL_SEGMENT_INDEX_NAME:
+        key_condition = Key('FinalSegmentPK').eq(pk)
+        if since_end_time:
+            # only return segments that ended after the caller's last seen segment
+            key_condition = key_condition & Key('EndTime').gt(Decimal(str(since_end_time)))
+        found = False
+        for item in query_items(
+            table,
+            page_size,
+            IndexName=FINAL_SEGMENT_INDEX_NAME,
+            KeyConditionExpression=key_condition,
+            FilterExpression=channel_filter,
+            ScanIndexForward=not newest_first,
+            **projection,
+        ):
+            found = True
+            yield item
+        if found or is_call_indexed(table, pk):
+            return
+        LOGGER.debug("Call %s has no indexed final segments - reading the call partition", call_id)
+
+    filter_expression = channel_filter & Attr('IsPartial').eq(False)
+    if since_end_time:
+        filter_expression = filter_expression & Attr('EndTime').gt(Decimal(str(since_end_time)))
+    items = query_items(
+        table,
+        # the partition isn't in time order, so reading the latest segments reads the whole call
+        0 if newest_first else page_size,
+        KeyConditionExpression=Key('PK').eq(pk),
+        FilterExpression=filter_expression,
+        **projection,
+    )
+    if newest_first:
+        yield from sorted(items, key=lambda item: item['EndTime'], reverse=True)
+    else:
+        yield from items
+
+
+def get_transcript_segments(
+    table: Table,
+    call_id: str,
+    since_end_time: float = 0,
+) -> List[Dict[str, Any]]:
+    """Gets all the final AGENT and CALLER segments of a call
+
+    :parameter since_end_time: only return segments that ended after this time
+    """
+    return list(iter_transcript_segments(table, call_id, since_end_time))
+
+
+def remove_issues(transcript_string: str) -> str:
+    return re.sub(ISSUE_REMOVER, '', transcript_string)
+
+
+def remove_html(transcript_string: str) -> str:
+    return re.sub(HTML_REMOVER, '', transcript_string)
+
+
+def remove_filler_words(transcript_string: str) -> str:
+    return re.sub(FILLER_REMOVER, '', transcript_string)
+
+
+def iter_transcript_lines(
+    transcripts: List[Dict[str, Any]],
+    condense: bool,
+    include_speaker: bool,
+) -> Iterator[str]:
+    """Yields the segments as transcript lines, sorted by EndTime
+
+    Each line starts with a newline.
+    """
+    transcripts.sort(key=lambda x: x['EndTime'])
+
+    for row in transcripts:
+        transcript = row['Transcript']
+
+        # prefix Speaker name to transcript segments if "IncludeSpeaker" parameter is set to True.
+        if include_speaker:
+            # For LMA 'Hey Q' answers, we should keep assistant replies as part of the transcript
+            # for any contextual followup 'Hey Q' questions.
+            if row['Channel'] == 'AGENT_ASSISTANT':
+                # Add the 'MeetingAssistant:' prefix for assistant messages
+                transcript = "MeetingAssistant: " + transcript
+            else:
+                # Add the 'Speaker:' prefix for Transcript segments if "Speaker" field is present
+                speaker_name = row.get('Speaker', None)
+                if speaker_name:
+                    transcript = speaker_name.strip() + ': ' + transcript
+
+        if condense:
+            # the issue pill and other HTML tags all start with '<' - most segments have none
+            if '<' in transcript:
+                transcript = remove_issues(transcript)
+                transcript = remove_html(transcript)
+            transcript = remove_filler_words(transcript).strip()
+
+            # single characters are kept, without a line break
+            if len(transcript) > 1:
+                transcript = '\n' + transcript
+        else:
+            transcript = '\n' + transcript
+
+        yield transcript
+
+
+def merge_transcript_turns(
+    transcripts: List[Dict[str, Any]],
+    max_gap_seconds: float,
+) -> List[Dict[str, Any]]:
+    """Merges consecutive segments of the same speaker into one segment per turn, sorted by EndTime
+
+    Segments are merged when they are on the same channel, have the same speaker, and the next one
+    starts at most max_gap_seconds after the previous one ended. Meeting assistant messages are
+    never merged. The segments themselves are not modified.
+    """
+    merged: List[Dict[str, Any]] = []
+    copied = False
+    for row in sorted(transcripts, key=lambda x: x['EndTime']):
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and row['Channel'] != 'AGENT_ASSISTANT'
+            and row['Channel'] == previous['Channel']
+            and (row.get('Speaker') or '').strip() == (previous.get('Speaker') or '').strip()
+            and float(row.get('StartTime', row['EndTime'])) - float(previous['EndTime'])
+            <= max_gap_seconds
+        ):
+            if not copied:
+                previous = merged[-1] = dict(previous)
+                copied = True
+            if row['Transcript']:
+                previous['Transcript'] = (
+                    f"{previous['Transcript']} {row['Transcript']}"
+                    if previous['Transcript']
+                    else row['Transcript']
+                )
+            previous['EndTime'] = row['EndTime']
+            continue
+        merged.append(row)
+        copied = False
+    return merged
+
+
+def get_transcript_turns(
+    transcripts: List[Dict[str, Any]],
+    condense: bool,
+) -> List[Dict[str, Any]]:
+    """The segments as {id, speaker, channel, text, start, end} turns, sorted by EndTime
+
+    The id is the SegmentId of the (first) segment of the turn.
+
+    The speaker of meeting assistant messages is "MeetingAssistant". With condense, the text is
+    cleaned up as in the transcript string, and turns left empty are dropped.
+    """
+    turns = []
+    for row in sorted(transcripts, key=lambda x: x['EndTime']):
+        text = row['Transcript']
+        if condense:
+            if '<' in text:
+                text = remove_html(remove_issues(text))
+            text = remove_filler_words(text).strip()
+            if not text:
+                continue
+        channel = row['Channel']
+        if channel == 'AGENT_ASSISTANT':
+            speaker = 'MeetingAssistant'
+        else:
+            speaker = (row.get('Speaker') or '').strip()
+        turns.append({
+            'id': row.get('SegmentId', ''),
+            'speaker': speaker,
+            'channel': channel,
+            'text': text,
+            'start': float(row.get('StartTime', 0)),
+            'end': float(row['EndTime']),
+        })
+    return turns
+
+
+def join_transcript_lines(lines: Iterable[str], truncate_length: int) -> str:
+    """Joins the lines, keeping the first truncate_length tokens (0 - do not truncate)
+
+    Tokens are runs of non-whitespace characters, and each whitespace character (so the kept
+    tokens are a prefix of the joined lines). They are counted line by line, and no more lines
+    are read once the budget is reached.
+    """
+    data = []
+    count = 0
+    ends_in_word = False
+    for line in lines:
+        if not line:
+            continue
+        words = line.split()
+        # a line without a leading line break continues the last word of the previous line
+        continues_word = ends_in_word and not line[0].isspace()
+        tokens = len(words) + len(line) - sum(map(len, words)) - continues_word
+        if truncate_length > 0 and count + tokens > truncate_length:
+            data.append(cut_tokens(line, truncate_length - count, continues_word))
+            count = truncate_length
+            break
+        data.append(line)
+        count += tokens
+        ends_in_word = not line[-1].isspace()
+    LOGGER.debug("Token Count: %d", count)
+    return ''.join(data)
+
+
+def cut_tokens(line: str, tokens: int, continues_word: bool) -> str:
+    """The start of the line with this many tokens
+
+    Plus the end of a word continued from the previous line.
+    """
+    end = 0
+    matches = TOKEN_FINDER.finditer(line)
+    for match in islice(matches, tokens + continues_word):
+        end = match.end()
+    return line[:end]
+
+
+def read_transcripts(
+    table: Table,
+    call_id: str,
+    since_end_time: float = 0,
+    last_n_turns: int = 0,
+) -> List[Dict[str, Any]]:
+    """The final segments of the call that ended after since_end_time
+
+    Read from the compacted transcript document of the call if it has one, and no segment was
+    stored after it was written (checked with a query of the segments that ended in the last
+    TRANSCRIPT_DOCUMENT_TAIL_SECONDS of the document), otherwise from the segment items.
+
+    :parameter last_n_turns: only the latest N segments (0 - all segments)
+    """
+    document = read_transcript_document(table, call_id) if TRANSCRIPT_DOCUMENT_ENABLED else None
+    if document:
+        tail_start_time = float(document[-1]['EndTime']) - TRANSCRIPT_DOCUMENT_TAIL_SECONDS
+        tail_segment_ids = {
+            row['SegmentId'] for row in document if float(row['EndTime']) > tail_start_time
+        }
+        if has_segments_after_document(table, call_id, tail_start_time, tail_segment_ids):
+            LOGGER.info("Transcript document of %s is missing segments - reading segments", call_id)
+            document = None
+    if document is not None:
+        # ended call - the whole transcript is in its compacted document, already in EndTime order
+        transcripts = [row for row in document if float(row['EndTime']) > since_end_time]
+        return transcripts[-last_n_turns:] if last_n_turns else transcripts
+    if last_n_turns:
+        segments = iter_transcript_segments(
+            table, call_id, since_end_time, page_size=last_n_turns, newest_first=True
+        )
+        return list(islice(segments, last_n_turns))
+    return get_transcript_segments(table, call_id, since_end_time)
+
+
+def format_transcript(
+    transcripts: List[Dict[str, Any]],
+    since_end_time: float = 0,
+    token_count: int = 0,
+    process_transcript: bool = False,
+    include_speaker: bool = False,
+    output_format: str = OUTPUT_FORMAT_TEXT,
+    merge_gap_seconds: float = MERGE_DISABLED,
+) -> Dict[str, Any]:
+    """The fetch_transcript response for these segments - see fetch_transcript"""
+    # pylint: disable=too-many-arguments
+    last_end_time = max([float(row['EndTime']) for row in transcripts], default=since_end_time)
+    if merge_gap_seconds >= 0:
+        segment_count = len(transcripts)
+        transcripts = merge_transcript_turns(transcripts, merge_gap_seconds)
+        LOGGER.debug("Merged %d transcript segments into %d turns", segment_count, len(transcripts))
+    if output_format == OUTPUT_FORMAT_TURNS:
+        return {
+            'turns': get_transcript_turns(transcripts, process_transcript),
+            'lastEndTime': last_end_time,
+        }
+    lines = iter_transcript_lines(transcripts, process_transcript, include_speaker)
+    transcript_string = join_transcript_lines(lines, token_count)
+    return {'transcript': transcript_string, 'lastEndTime': last_end_time}
+
+
+def fetch_transcript(
+    table: Table,
+    call_id: str,
+    token_count: int = 0,
+    process_transcript: bool = False,
+    include_speaker: bool = False,
+    since_end_time: float = 0,
+    last_n_turns: int = 0,
+    output_format: str = OUTPUT_FORMAT_TEXT,
+    merge_gap_seconds: float = MERGE_DISABLED,
+) -> Dict[str, Any]:
+    """Fetches the call transcript
+
+    :parameter since_end_time: only segments that ended after this time. Segments of the two
+        channels can be written out of EndTime order, so callers that fetch incrementally should
+        re-read an overlap before their cursor, and skip the SegmentIds they already have.
+    :parameter last_n_turns: only return the latest N segments (0 - all segments)
+    :parameter output_format: "text" - the transcript as one string, "turns" - the transcript as a
+        list of {id, speaker, channel, text, start, end} turns (token_count and include_speaker
+        don't apply)
+    :parameter merge_gap_seconds: merge consecutive segments of the same speaker up to this many
+        seconds apart into one turn, so the speaker name is written once per turn (negative -
+        don't merge)
+
+    Returns the same response as the FetchTranscript Lambda function:
+    {"transcript": str, "lastEndTime": float} or {"turns": list, "lastEndTime": float}, where
+    lastEndTime is the EndTime of the latest segment returned, used as since_end_time for the
+    next request.
+    """
+    # pylint: disable=too-many-arguments
+    transcripts = read_transcripts(table, call_id, since_end_time, last_n_turns)
+    return format_transcript(
+        transcripts,
+        since_end_time,
+        token_count=token_count,
+        process_transcript=process_transcript,
+        include_speaker=include_speaker,
+        output_format=output_format,
+        merge_gap_seconds=merge_gap_seconds,
+    )
+
+
+def compact_transcript(table: Table, call_id: str) -> Dict[str, Any]:
+    """Writes the final segments of an ended call as its compacted transcript document
+
+    Returns the document header item.
+    """
+    segments = sorted(
+        iter_transcript_segments(table, call_id, full_items=True),
+        key=lambda row: row['EndTime'],
+    )
+    return write_transcript_document(table, call_id, segments)
@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Ended Call Transcript Memory Cache
+
+Per container LRU cache of fetch_transcript responses, keyed by call id and fetch options. The
+transcript of an ended call doesn't change, so repeated reads after the call (summary prompts,
+meeting assistant questions, on demand requests) are served from memory.
+
+Only calls with a compacted transcript document (written when the call ends) are cached. Each
+request reads the document header item as a cursor: a cached response is only used if it was
+made from the document with the same DocumentId, and no segment was stored after the document was
+written. In progress calls are always fetched.
+
+Entries are evicted least recently used first, when the estimated size of the cached responses
+goes over TRANSCRIPT_MEMORY_CACHE_MAX_BYTES.
+"""
+from collections import OrderedDict
+from os import getenv
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+import json
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+from .document import read_transcript_document_header
+from .fetch import fetch_transcript, has_segments_after_document
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_dynamodb.service_resource import Table
+else:
+    Table = object
+
+# 0 disables the cache
+TRANSCRIPT_MEMORY_CACHE_MAX_BYTES = int(
+    getenv("TRANSCRIPT_MEMORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+
+
+class TranscriptMemoryCache:
+    """LRU cache of the fetch_transcript responses of ended calls
+
+    Cached responses are shared between requests, and must not be modified.
+    """
+
+    def __init__(self, table: Table, max_bytes: int = TRANSCRIPT_MEMORY_CACHE_MAX_BYTES) -> None:
+        self.table = table
+        self.max_bytes = max_bytes
+        # key -> (DocumentId, size, response)
+        self.entries: "OrderedDict[str, Tuple[str, int, Dict[str, Any]]]" = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.stats: Dict[str, int] = {}
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats = dict(Hits=0, Misses=0, Bypassed=0, Evictions=0)
+
+    def fetch_transcript(self, call_id: str, **options: Any) -> Dict[str, Any]:
+        """fetch_transcript(table, call_id, **options), from the cache if the call has ended"""
+        header = (
+            read_transcript_document_header(self.table, call_id) if self.max_bytes > 0 else None
+        )
+        if header is not None and self.has_newer_segments(call_id, header):
+            header = None
+        if header is None:
+            # in progress call, segments stored after compaction (or cache disabled)
+            with self.lock:
+                self.stats["Bypassed"] += 1
+            return fetch_transcript(self.table, call_id, **options)
+
+        key = json.dumps([call_id, options], sort_keys=True, default=str)
+        document_id = header["DocumentId"]
+        response = self.get(key, document_id)
+        if response is not None:
+            return response
+        response = fetch_transcript(self.table, call_id, **options)
+        self.put(key, document_id, response)
+        return response
+
+    def has_newer_segments(self, call_id: str, header: Dict[str, Any]) -> bool:
+        """True if segments were stored after the document was written"""
+        # documents written before the tail was recorded - only check for later segments
+        tail_start_time = float(header.get("TailStartTime", header["LastEndTime"]))
+        tail_segment_ids = set(header.get("TailSegmentIds", []))
+        return has_segments_after_document(self.table, call_id, tail_start_time, tail_segment_ids)
+
+    def get(self, key: str, document_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != document_id:
+                self.stats["Misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["Hits"] += 1
+            return entry[2]
+
+    def put(self, key: str, document_id: str, response: Dict[str, Any]) -> None:
+        # size of the serialized response - close to its size in memory for transcript strings
+        size = len(key) + len(json.dumps(response, default=str))
+        if size > self.max_bytes:
+            LOGGER.debug("Transcript response of %d bytes is larger than the cache", size)
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (document_id, size, response)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.stats["Evictions"] += 1
+
+    def add_metrics(self, metrics: Metrics) -> None:
+        """Adds the counters since the last call to metrics, published by its log_metrics
+
+        The counters are reset.
+        """
+        with self.lock:
+            stats = self.stats
+            size = self.size
+            entries = len(self.entries)
+            self.reset_stats()
+        if not any(stats.values()):
+            return
+        for name, value in stats.items():
+            metrics.add_metric(name=f"TranscriptCache{name}", unit=MetricUnit.Count, value=value)
+        metrics.add_metric(name="TranscriptCacheBytes", unit=MetricUnit.Bytes, value=size)
+        metrics.add_metric(name="TranscriptCacheEntries", unit=MetricUnit.Count, value=entries)
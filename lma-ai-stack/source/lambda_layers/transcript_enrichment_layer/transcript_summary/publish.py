@@ -0,0 +1,48 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Call Summary Publishing"""
+from typing import TYPE_CHECKING, Any, Dict
+import json
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+
+from eventprocessor_utils import get_meeting_ttl
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_kinesis.client import KinesisClient
+else:
+    KinesisClient = object
+
+
+def write_call_summary_to_kds(
+    message: Dict[str, Any],
+    kinesis_client: KinesisClient,
+    stream_name: str,
+) -> None:
+    """Writes an ADD_SUMMARY event with message CallSummaryText to the call data stream"""
+    call_id = message.get("CallId", None)
+    expires_after = message.get("ExpiresAfter", get_meeting_ttl())
+
+    new_message = dict(
+        CallId=call_id,
+        EventType="ADD_SUMMARY",
+        ExpiresAfter=expires_after,
+        CallSummaryText=message["CallSummaryText"],
+    )
+
+    if call_id:
+        try:
+            kinesis_client.put_record(
+                StreamName=stream_name,
+                PartitionKey=call_id,
+                Data=json.dumps(new_message),
+            )
+            LOGGER.info("Write ADD_SUMMARY event to KDS")
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.error(
+                "Error writing ADD_SUMMARY event to KDS ",
+                extra=dict(error=error),
+            )
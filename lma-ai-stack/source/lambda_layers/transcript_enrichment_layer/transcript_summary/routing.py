@@ -0,0 +1,113 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Summary Model Routing
+
+Picks the Bedrock model for each summary prompt from a routing policy, so that short inputs and
+simple templates can use a faster, cheaper model than full summaries of long meetings.
+
+The policy is a JSON object with named model tiers and an ordered list of rules. The first rule
+whose conditions all match the prompt picks the model, otherwise the default model is used:
+
+    {
+        "tiers": {"fast": "anthropic.claude-3-haiku-20240307-v1:0"},
+        "rules": [
+            {"title": "^(Topic|DETAILS)$", "tier": "fast"},
+            {"prompt": "most recent issue or topic", "tier": "fast"},
+            {"maxInputTokens": 4000, "tier": "fast"}
+        ]
+    }
+
+Rule conditions - "title" and "prompt" are regular expressions searched in the template title
+and the prompt text, "maxInputTokens" and "minInputTokens" bound the estimated prompt tokens.
+A rule picks either a "tier" or a "modelId".
+"""
+from os import getenv
+from typing import Any, Dict, List, Optional
+import json
+import re
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+SUMMARY_MODEL_ROUTING = getenv("SUMMARY_MODEL_ROUTING", "")
+
+
+class ModelRouter:
+    """Routes summary prompts to Bedrock models"""
+
+    def __init__(self, default_model_id: str, policy: str = SUMMARY_MODEL_ROUTING) -> None:
+        self.default_model_id = default_model_id
+        self.policy = policy
+        self.rules: List[Dict[str, Any]] = []
+        if not policy:
+            return
+        try:
+            self.rules = self.parse_policy(json.loads(policy))
+        except (ValueError, TypeError, AttributeError, re.error) as error:
+            # an invalid policy doesn't stop summaries - everything uses the default model
+            LOGGER.error(
+                "Invalid SUMMARY_MODEL_ROUTING policy - using %s: %s", default_model_id, error
+            )
+            self.rules = []
+
+    @staticmethod
+    def parse_policy(policy: Dict[str, Any]) -> List[Dict[str, Any]]:
+        tiers = policy.get("tiers", {})
+        rules = []
+        for rule in policy.get("rules", []):
+            model_id = rule.get("modelId") or tiers.get(rule.get("tier"))
+            if not model_id:
+                raise ValueError(f"rule has no modelId and no known tier: {rule}")
+            rules.append(
+                dict(
+                    title=re.compile(rule["title"]) if "title" in rule else None,
+                    prompt=re.compile(rule["prompt"]) if "prompt" in rule else None,
+                    max_input_tokens=rule.get("maxInputTokens"),
+                    min_input_tokens=rule.get("minInputTokens"),
+                    tier=rule.get("tier", ""),
+                    model_id=model_id,
+                )
+            )
+        return rules
+
+    @staticmethod
+    def matches(rule: Dict[str, Any], title: str, prompt: str, input_tokens: int) -> bool:
+        if rule["title"] and not rule["title"].search(title):
+            return False
+        if rule["prompt"] and not rule["prompt"].search(prompt):
+            return False
+        if rule["max_input_tokens"] is not None and input_tokens > rule["max_input_tokens"]:
+            return False
+        if rule["min_input_tokens"] is not None and input_tokens < rule["min_input_tokens"]:
+            return False
+        return True
+
+    def route(self, title: str, prompt: str, input_tokens: int) -> str:
+        """Returns the model id for the prompt, and logs the decision"""
+        if not self.rules:
+            return self.default_model_id
+        model_id = self.default_model_id
+        rule_index: Optional[int] = None
+        tier = "default"
+        for index, rule in enumerate(self.rules):
+            if self.matches(rule, title, prompt, input_tokens):
+                model_id = rule["model_id"]
+                rule_index = index
+                tier = rule["tier"]
+                break
+        LOGGER.info(
+            "Model routing: %s (%d estimated tokens) -> %s",
+            title,
+            input_tokens,
+            model_id,
+            extra=dict(
+                template=title,
+                input_tokens=input_tokens,
+                model_id=model_id,
+                rule=rule_index,
+                tier=tier,
+            ),
+        )
+        return model_id
@@ -0,0 +1,850 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Bedrock Call Transcript Summary
+
+Runs the summary prompt templates on a call transcript using Bedrock. Used in-process by the
+transcript summary orchestrator, and by the BedrockSummaryLambda function for on demand summaries.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+import json
+import re
+import time
+
+# third-party imports from Lambda layer
+from aws_lambda_powertools import Logger
+import boto3
+from botocore.config import Config as BotoCoreConfig
+
+from bedrock_utils import BedrockPacer
+from .cache import SUMMARY_CACHE_TABLE_NAME, SummaryCache, get_cache_key
+from .fetch import fetch_transcript, format_transcript, read_transcripts
+from .routing import ModelRouter
+
+LOGGER = Logger(child=True, location="%(filename)s:%(lineno)d - %(funcName)s()")
+
+if TYPE_CHECKING:
+    from mypy_boto3_bedrock_runtime.client import BedrockRuntimeClient
+    from mypy_boto3_dynamodb.client import DynamoDBClient
+    from mypy_boto3_dynamodb.service_resource import Table
+else:
+    BedrockRuntimeClient = object
+    DynamoDBClient = object
+    Table = object
+
+BEDROCK_MODEL_ID = getenv("BEDROCK_MODEL_ID", "")
+PROCESS_TRANSCRIPT = getenv("PROCESS_TRANSCRIPT", "False") == "True"
+TOKEN_COUNT = int(getenv("TOKEN_COUNT", "0"))  # default 0 - do not truncate.
+# Consecutive segments of the same speaker up to this many seconds apart are merged into one turn,
+# so the speaker name is sent once per turn instead of once per segment. Default -1 - not merged.
+TRANSCRIPT_MERGE_GAP_SECONDS = float(getenv("TRANSCRIPT_MERGE_GAP_SECONDS", "-1"))
+# Prompt templates run concurrently, up to SUMMARY_PROMPT_CONCURRENCY at a time.
+SUMMARY_PROMPT_CONCURRENCY = int(getenv("SUMMARY_PROMPT_CONCURRENCY", "4"))
+# Time allowed for each prompt. A prompt that fails or times out doesn't affect the others. This is
+# the Bedrock client read_timeout, and no Bedrock request (pacing wait or throttling retry) of a
+# prompt is started after it, so a prompt gives up within twice this time.
+SUMMARY_PROMPT_TIMEOUT_SECONDS = int(getenv("SUMMARY_PROMPT_TIMEOUT_SECONDS", "120"))
+# Map-reduce mode for long meetings - transcripts longer than MAP_REDUCE_CHUNK_TOKENS (estimated)
+# are split on speaker turns into chunks of that size, the chunks are condensed into notes in
+# parallel, and the summary prompts run on the combined notes. Default 0 - disabled.
+MAP_REDUCE_CHUNK_TOKENS = int(getenv("MAP_REDUCE_CHUNK_TOKENS", "0"))
+MAP_REDUCE_NOTES_MAX_TOKENS = int(getenv("MAP_REDUCE_NOTES_MAX_TOKENS", "1024"))
+# Rolling summary - when ROLLING_SUMMARY_TABLE_NAME (the call event sourcing table) is set, running
+# notes of each meeting are kept up to date while it is in progress. Each update writes notes on
+# only the transcript added since the last update, and appends them. End of call and on demand
+# summaries then run the prompt templates on the notes, brought up to date in the same way, instead
+# of on the full transcript.
+ROLLING_SUMMARY_TABLE_NAME = getenv("ROLLING_SUMMARY_TABLE_NAME", "")
+# output tokens allowed for the notes of one update - the prompt asks for notes of at most half as
+# many words, so they are not cut off
+ROLLING_SUMMARY_MAX_TOKENS = int(getenv("ROLLING_SUMMARY_MAX_TOKENS", "1024"))
+ROLLING_SUMMARY_MAX_WORDS = ROLLING_SUMMARY_MAX_TOKENS // 2
+# Notes longer than this (estimated tokens) are no longer updated or used, nor are notes that were
+# cut off - the summaries of the call run on the full transcript (or map-reduce notes) instead
+ROLLING_SUMMARY_MAX_NOTES_TOKENS = int(getenv("ROLLING_SUMMARY_MAX_NOTES_TOKENS", "50000"))
+# segments are read from an eventually consistent index, and the two channels are written out of
+# EndTime order, so each update re-reads this many seconds before its cursor and skips the segments
+# it has already summarized
+ROLLING_SUMMARY_OVERLAP_SECONDS = float(getenv("ROLLING_SUMMARY_OVERLAP_SECONDS", "30"))
+MEETING_RECORD_EXPIRATION_IN_DAYS = int(getenv("MEETING_RECORD_EXPIRATION_IN_DAYS", "90"))
+# Table name and keys used for default and custom prompt templates items in DDB
+LLM_PROMPT_TEMPLATE_TABLE_NAME = getenv("LLM_PROMPT_TEMPLATE_TABLE_NAME", "")
+DEFAULT_PROMPT_TEMPLATES_PK = "DefaultSummaryPromptTemplates"
+CUSTOM_PROMPT_TEMPLATES_PK = "CustomSummaryPromptTemplates"
+# Parsed prompt templates are cached, and re-read from DDB after TEMPLATE_CACHE_TTL_SECONDS
+# (0 disables the cache), so edits to the templates items take effect within the TTL.
+TEMPLATE_CACHE_TTL_SECONDS = int(getenv("TEMPLATE_CACHE_TTL_SECONDS", "300"))
+# Optional - name of an attribute that is changed whenever the templates items are edited (eg a
+# version number or timestamp). When set, an expired cache is revalidated by reading only this
+# attribute, and the templates are re-read only if it has changed.
+TEMPLATE_VERSION_ATTRIBUTE = getenv("TEMPLATE_VERSION_ATTRIBUTE", "")
+
+# Single-call mode - when there are several prompt templates, run them all in one request that
+# sends the transcript once and asks for a JSON object keyed by template title. Templates missing
+# from (or not parseable in) the response are run individually. Default False.
+SUMMARY_SINGLE_CALL = getenv("SUMMARY_SINGLE_CALL", "False").lower() == "true"
+# output tokens allowed per template in the single request
+SUMMARY_SINGLE_CALL_TOKENS_PER_TEMPLATE = int(
+    getenv("SUMMARY_SINGLE_CALL_TOKENS_PER_TEMPLATE", "512")
+)
+SUMMARY_SINGLE_CALL_MAX_TOKENS = int(getenv("SUMMARY_SINGLE_CALL_MAX_TOKENS", "4096"))
+
+# Fast local token estimate - roughly 4 characters per token
+CHARS_PER_TOKEN = 4
+CHUNK_NOTES_PROMPT = """The following is part {part} of {parts} of the transcript of a meeting.
+<transcript>
+{transcript}
+</transcript>
+
+Write detailed notes on this part of the meeting, in the order things were discussed, without preamble or additional explanation. Include the topics discussed, key points, decisions, questions raised, and any action items with their owner and due date if they can be determined. Reference speaker names where possible, but only use gender neutral pronouns."""  # noqa: E501
+ROLLING_SUMMARY_PROMPT = """The following is the transcript of the latest part of a meeting that is in progress.
+<transcript>
+{transcript}
+</transcript>
+
+Write notes on this part of the meeting in at most {max_words} words, in the order things were discussed, without preamble or additional explanation. Include the topics discussed, key points, decisions, questions raised, and any action items with their owner and due date if they can be determined. Reference speaker names where possible, but only use gender neutral pronouns."""  # noqa: E501
+ROLLING_SUMMARY_NOTES_HEADING = "[Notes on the meeting, in place of the full transcript]"
+SINGLE_CALL_PROMPT = """The following is the transcript of a meeting.
+<transcript>
+{transcript}
+</transcript>
+
+Complete each of the following tasks using the meeting transcript above.
+{tasks}
+
+Respond with only a JSON object, without preamble or additional explanation. The JSON object must have exactly one key for each task, using the task title exactly as given: {titles}. The value of each key is your complete response to that task, as a JSON string."""  # noqa: E501
+SINGLE_CALL_TASK = """<task title="{title}">
+{instructions}
+</task>"""
+# removes the transcript placeholder (and its enclosing tags) from a template, leaving its
+# instructions
+TRANSCRIPT_PLACEHOLDER_REMOVER = re.compile(
+    r"(?:<transcript>\s*)?\{transcript\}(?:\s*</transcript>)?"
+)
+
+
+def create_bedrock_client(session: Any = boto3) -> BedrockRuntimeClient:
+    """Creates a Bedrock runtime client, with optional region / endpoint override"""
+    # Optional environment variables allow region / endpoint override for bedrock Boto3
+    region = getenv("BEDROCK_REGION_OVERRIDE") or getenv("AWS_REGION")
+    endpoint_url = getenv("BEDROCK_ENDPOINT_URL", f"https://bedrock-runtime.{region}.amazonaws.com")
+    return session.client(
+        service_name="bedrock-runtime",
+        region_name=region,
+        endpoint_url=endpoint_url,
+        config=BotoCoreConfig(
+            read_timeout=SUMMARY_PROMPT_TIMEOUT_SECONDS,
+            max_pool_connections=max(10, SUMMARY_PROMPT_CONCURRENCY),
+            # throttling is retried by the BedrockPacer, so the client doesn't retry as well
+            retries={"mode": "standard", "max_attempts": 0},
+        ),
+    )
+
+
+def get_request_body(
+    model_id: str, prompt: str, max_tokens: int, temperature: float,
+) -> Dict[str, Any]:
+    provider = model_id.split(".")[0]
+    if provider == "anthropic":
+        # claude-3 models use new messages format
+        if model_id.startswith("anthropic.claude-3"):
+            return {
+                "anthropic_version": "bedrock-2023-05-31",
+                "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+            }
+        return {
+            "prompt": prompt,
+            "max_tokens_to_sample": max_tokens,
+            "temperature": temperature,
+        }
+    raise ValueError(f"Unsupported provider: {provider}")
+
+
+def get_generated_text(model_id: str, response: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """The generated text and the stop reason ("max_tokens" if the text was cut off)"""
+    provider = model_id.split(".")[0]
+    response_body = json.loads(response.get("body").read())
+    LOGGER.debug("Response body", extra=dict(response_body=response_body))
+    if provider == "anthropic":
+        stop_reason = response_body.get("stop_reason")
+        # claude-3 models use new messages format
+        if model_id.startswith("anthropic.claude-3"):
+            return response_body.get("content")[0].get("text"), stop_reason
+        return response_body.get("completion"), stop_reason
+    raise ValueError(f"Unsupported provider: {provider}")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def get_single_call_prompt(transcript: str, prompts: List[Tuple[str, str]]) -> str:
+    """Combines (title, template) pairs into one prompt, with the transcript included once"""
+    tasks = [
+        SINGLE_CALL_TASK.format(
+            title=title,
+            instructions=TRANSCRIPT_PLACEHOLDER_REMOVER.sub(
+                "(the meeting transcript above)", template
+            ).strip(),
+        )
+        for title, template in prompts
+    ]
+    return SINGLE_CALL_PROMPT.format(
+        transcript=transcript,
+        tasks="\n".join(tasks),
+        titles=", ".join(json.dumps(title) for title, _ in prompts),
+    )
+
+
+def parse_single_call_response(response: str, titles: List[str]) -> Dict[str, str]:
+    """Returns {title: text} for the titles with a valid (non-empty string) value in the response"""
+    start = response.find("{")
+    end = response.rfind("}")
+    if start < 0 or end < start:
+        LOGGER.warning("Single-call response is not a JSON object")
+        return {}
+    try:
+        sections = json.loads(response[start:end + 1])
+    except ValueError as error:
+        LOGGER.warning("Single-call response JSON parsing error: %s", error)
+        return {}
+    if not isinstance(sections, dict):
+        return {}
+    return {
+        title: sections[title].strip()
+        for title in titles
+        if isinstance(sections.get(title), str) and sections[title].strip()
+    }
+
+
+def split_transcript(transcript: str, max_tokens: int) -> List[str]:
+    """Splits on speaker turn (line) boundaries into chunks of at most max_tokens (estimated)
+
+    A single turn longer than max_tokens is split on word boundaries.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    lines: List[str] = []
+    chunk_chars = 0
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+        pieces = [line]
+        if len(line) > max_chars:
+            pieces = []
+            words = line.split(" ")
+            piece = words[0]
+            for word in words[1:]:
+                if len(piece) + len(word) + 1 > max_chars:
+                    pieces.append(piece)
+                    piece = word
+                else:
+                    piece = f"{piece} {word}"
+            pieces.append(piece)
+        for piece in pieces:
+            if lines and chunk_chars + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(lines))
+                lines = []
+                chunk_chars = 0
+            lines.append(piece)
+            chunk_chars += len(piece) + 1
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
+class TranscriptSummarizer:
+    """Bedrock Call Transcript Summarizer
+
+    Fetches the call transcript from the event sourcing table and runs the summary prompt
+    templates on it, without invoking the FetchTranscript or BedrockSummaryLambda functions.
+    Holds the prompt templates cache, so create one instance per container.
+    """
+
+    def __init__(
+        self,
+        bedrock_client: BedrockRuntimeClient,
+        dynamodb_client: DynamoDBClient,
+        events_table: Table,
+        model_id: str = BEDROCK_MODEL_ID,
+        prompt_template_table_name: str = LLM_PROMPT_TEMPLATE_TABLE_NAME,
+        rolling_summary_table_name: str = ROLLING_SUMMARY_TABLE_NAME,
+        summary_cache_table_name: str = SUMMARY_CACHE_TABLE_NAME,
+    ) -> None:
+        """Initializes the Transcript Summarizer
+
+        :parameter events_table: event sourcing table resource, used to read transcript segments
+        :parameter rolling_summary_table_name: table used to keep rolling summaries ("" disables
+            them)
+        :parameter summary_cache_table_name: table used to cache summaries ("" disables the cache)
+        """
+        # pylint: disable=too-many-arguments
+        self.bedrock_client = bedrock_client
+        self.bedrock_pacer = BedrockPacer(bedrock_client)
+        self.dynamodb_client = dynamodb_client
+        self.events_table = events_table
+        self.model_id = model_id
+        self.router = ModelRouter(model_id)
+        self.prompt_template_table_name = prompt_template_table_name
+        self.rolling_summary_table_name = rolling_summary_table_name
+        self.template_cache: Dict[str, Any] = dict(templates=None, versions=None, expires_at=0)
+        self.summary_cache = SummaryCache(dynamodb_client, summary_cache_table_name)
+
+    ##########################################################################
+    # Transcript
+    ##########################################################################
+
+    def get_transcript(self, call_id: str) -> Dict[str, Any]:
+        """Returns {"transcript", "lastEndTime"} for the call"""
+        return fetch_transcript(
+            self.events_table,
+            call_id,
+            # map-reduce mode covers the whole meeting, so don't truncate
+            token_count=0 if MAP_REDUCE_CHUNK_TOKENS else TOKEN_COUNT,
+            process_transcript=PROCESS_TRANSCRIPT,
+            include_speaker=True,
+            merge_gap_seconds=TRANSCRIPT_MERGE_GAP_SECONDS,
+        )
+
+    def get_new_transcript(
+        self, call_id: str, since_end_time: float, seen_segment_ids: Set[str],
+    ) -> Tuple[str, float, Set[str]]:
+        """The transcript of the segments not summarized yet
+
+        Re-reads ROLLING_SUMMARY_OVERLAP_SECONDS before since_end_time, and skips the segments in
+        seen_segment_ids. Returns the transcript, the new cursor, and the ids of the segments in the
+        overlap window before the new cursor (to skip on the next update).
+        """
+        read_since = max(since_end_time - ROLLING_SUMMARY_OVERLAP_SECONDS, 0)
+        transcripts = read_transcripts(self.events_table, call_id, read_since)
+        last_end_time = max([float(row["EndTime"]) for row in transcripts], default=since_end_time)
+        last_end_time = max(last_end_time, since_end_time)
+        overlap_start = last_end_time - ROLLING_SUMMARY_OVERLAP_SECONDS
+        overlap_ids = {
+            row["SegmentId"]
+            for row in transcripts
+            if row.get("SegmentId") and float(row["EndTime"]) > overlap_start
+        }
+        new_transcripts = [
+            row for row in transcripts if row.get("SegmentId") not in seen_segment_ids
+        ]
+        transcript = format_transcript(
+            new_transcripts,
+            process_transcript=PROCESS_TRANSCRIPT,
+            include_speaker=True,
+            merge_gap_seconds=TRANSCRIPT_MERGE_GAP_SECONDS,
+        )["transcript"]
+        return transcript, last_end_time, overlap_ids
+
+    ##########################################################################
+    # Prompt templates
+    ##########################################################################
+
+    def get_templates(self, prompt_override: Optional[str] = None) -> List[Dict[str, str]]:
+        """Returns [{title: prompt template}] - from prompt_override if set, otherwise from DDB"""
+        templates = []
+        if prompt_override is not None:
+            LOGGER.debug("Prompt Template String override: %s", prompt_override)
+            try:
+                prompt_templates = json.loads(prompt_override)
+                for key, value in prompt_templates.items():
+                    templates.append({key: value.replace("<br>", "\n")})
+            except Exception:  # pylint: disable=broad-except
+                templates.append({"Summary": prompt_override.replace("<br>", "\n")})
+            return templates
+        return self.get_cached_templates()
+
+    def batch_get_template_items(
+        self,
+        projection_expression: Optional[str] = None,
+        expression_attribute_names: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """One BatchGetItem for both the default and custom templates items"""
+        keys_and_attributes: Dict[str, Any] = {
+            "Keys": [
+                {"LLMPromptTemplateId": {"S": DEFAULT_PROMPT_TEMPLATES_PK}},
+                {"LLMPromptTemplateId": {"S": CUSTOM_PROMPT_TEMPLATES_PK}},
+            ]
+        }
+        if projection_expression:
+            keys_and_attributes["ProjectionExpression"] = projection_expression
+            keys_and_attributes["ExpressionAttributeNames"] = expression_attribute_names
+        request_items = {self.prompt_template_table_name: keys_and_attributes}
+        items = {}
+        while request_items:
+            response = self.dynamodb_client.batch_get_item(RequestItems=request_items)
+            for item in response.get("Responses", {}).get(self.prompt_template_table_name, []):
+                items[item["LLMPromptTemplateId"]["S"]] = item
+            request_items = response.get("UnprocessedKeys")
+        return items
+
+    def get_template_versions(self) -> Dict[str, str]:
+        items = self.batch_get_template_items(
+            projection_expression="#pk, #version",
+            expression_attribute_names={
+                "#pk": "LLMPromptTemplateId",
+                "#version": TEMPLATE_VERSION_ATTRIBUTE,
+            },
+        )
+        return {pk: json.dumps(item.get(TEMPLATE_VERSION_ATTRIBUTE)) for pk, item in items.items()}
+
+    @staticmethod
+    def parse_templates(
+        default_prompt_templates: Dict[str, Any],
+        custom_prompt_templates: Dict[str, Any],
+    ) -> List[Dict[str, str]]:
+        """Merges the default and custom templates items, in 'N#Title' key order"""
+        templates = []
+        merged_prompt_templates = {**default_prompt_templates, **custom_prompt_templates}
+        LOGGER.debug("Merged Prompt Template", extra=dict(templates=merged_prompt_templates))
+
+        for key in sorted(merged_prompt_templates):
+            if key in ("LLMPromptTemplateId", "*Information*", TEMPLATE_VERSION_ATTRIBUTE):
+                continue
+            prompt = merged_prompt_templates[key]["S"]
+            # skip if prompt value is empty, or set to 'NONE'
+            if prompt and prompt != "NONE":
+                title = key[key.find("#") + 1:]
+                templates.append({title: prompt.replace("<br>", "\n")})
+        return templates
+
+    def get_cached_templates(self) -> List[Dict[str, str]]:
+        now = time.time()
+        cache = self.template_cache
+        if cache["templates"] is not None and now < cache["expires_at"]:
+            LOGGER.debug("Using cached prompt templates")
+            return cache["templates"]
+
+        versions = None
+        if TEMPLATE_VERSION_ATTRIBUTE and cache["templates"] is not None:
+            versions = self.get_template_versions()
+            if versions == cache["versions"]:
+                LOGGER.debug(
+                    "Prompt templates unchanged (%s) - renewing cache", TEMPLATE_VERSION_ATTRIBUTE
+                )
+                cache["expires_at"] = now + TEMPLATE_CACHE_TTL_SECONDS
+                return cache["templates"]
+
+        items = self.batch_get_template_items()
+        templates = self.parse_templates(
+            items[DEFAULT_PROMPT_TEMPLATES_PK], items[CUSTOM_PROMPT_TEMPLATES_PK]
+        )
+
+        if TEMPLATE_CACHE_TTL_SECONDS > 0:
+            if TEMPLATE_VERSION_ATTRIBUTE:
+                versions = {
+                    pk: json.dumps(item.get(TEMPLATE_VERSION_ATTRIBUTE))
+                    for pk, item in items.items()
+                }
+            cache["templates"] = templates
+            cache["versions"] = versions
+            cache["expires_at"] = now + TEMPLATE_CACHE_TTL_SECONDS
+        return templates
+
+    ##########################################################################
+    # Bedrock
+    ##########################################################################
+
+    def call_bedrock(self, prompt: str, max_tokens: int = 512, title: str = "Summary") -> str:
+        """Runs the prompt on the model picked by the routing policy for the title and prompt"""
+        generated_text, _ = self.call_bedrock_with_stop_reason(prompt, max_tokens, title)
+        return generated_text
+
+    def call_bedrock_with_stop_reason(
+        self, prompt: str, max_tokens: int, title: str,
+    ) -> Tuple[str, Optional[str]]:
+        """call_bedrock, also returning the stop reason ("max_tokens" if the text was cut off)"""
+        model_id = self.router.route(title, prompt, estimate_tokens(prompt))
+        body = get_request_body(model_id, prompt, max_tokens=max_tokens, temperature=0)
+        LOGGER.debug("Bedrock request", extra=dict(model_id=model_id, body=body))
+        response = self.bedrock_pacer.invoke_model(
+            timeout_seconds=SUMMARY_PROMPT_TIMEOUT_SECONDS,
+            body=json.dumps(body),
+            modelId=model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        generated_text, stop_reason = get_generated_text(model_id, response)
+        LOGGER.debug("Bedrock response (%s): %s", stop_reason, generated_text)
+        return generated_text, stop_reason
+
+    def run_prompts(
+        self,
+        prompts: List[Tuple[str, str]],
+        max_tokens: int = 512,
+    ) -> List[Tuple[str, Optional[str], Optional[Exception]]]:
+        """Runs (key, prompt) pairs concurrently
+
+        Returns a list of (key, response, exception), in prompt order whatever order the
+        prompts finish in.
+        """
+        results: List[Tuple[str, Optional[str], Optional[Exception]]] = []
+        if not prompts:
+            return results
+        max_workers = max(1, min(SUMMARY_PROMPT_CONCURRENCY, len(prompts)))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [
+            (key, executor.submit(self.call_bedrock, prompt, max_tokens, key))
+            for key, prompt in prompts
+        ]
+        # each prompt times out by itself (see SUMMARY_PROMPT_TIMEOUT_SECONDS) - this deadline is
+        # only a backstop. Prompts beyond the concurrency cap wait for a worker, so it allows the
+        # longest a prompt can take for each batch.
+        batches = -(-len(prompts) // max_workers)
+        deadline = time.time() + 2 * SUMMARY_PROMPT_TIMEOUT_SECONDS * batches
+        for key, future in futures:
+            try:
+                response = future.result(timeout=max(0, deadline - time.time()))
+                results.append((key, response, None))
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.warning("Exception generating %s: %r", key, error)
+                results.append((key, None, error))
+        executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    ##########################################################################
+    # Map-reduce
+    ##########################################################################
+
+    def condense_transcript(self, transcript: str) -> str:
+        """Map step - returns meeting notes that fit in MAP_REDUCE_CHUNK_TOKENS
+
+        Chunks are condensed in parallel. Repeats (on the notes) if the combined notes are still
+        too long.
+        """
+        while estimate_tokens(transcript) > MAP_REDUCE_CHUNK_TOKENS:
+            chunks = split_transcript(transcript, MAP_REDUCE_CHUNK_TOKENS)
+            LOGGER.info(
+                "Map-reduce: condensing %d estimated tokens in %d chunks",
+                estimate_tokens(transcript), len(chunks),
+            )
+            if len(chunks) < 2:
+                break
+            prompts = [
+                (
+                    f"part {i + 1}",
+                    CHUNK_NOTES_PROMPT.format(part=i + 1, parts=len(chunks), transcript=chunk),
+                )
+                for i, chunk in enumerate(chunks)
+            ]
+            notes = []
+            results = self.run_prompts(prompts, max_tokens=MAP_REDUCE_NOTES_MAX_TOKENS)
+            for key, response, error in results:
+                if error:
+                    response = "[Notes for this part of the meeting are not available]"
+                notes.append(f"[Notes from {key} of {len(chunks)} of the meeting]\n{response}")
+            condensed = "\n\n".join(notes)
+            if estimate_tokens(condensed) >= estimate_tokens(transcript):
+                # notes are not getting any shorter - stop rather than loop forever
+                break
+            transcript = condensed
+        return transcript
+
+    ##########################################################################
+    # Rolling summary
+    ##########################################################################
+
+    @staticmethod
+    def get_rolling_summary_key(call_id: str) -> Dict[str, Dict[str, str]]:
+        pk = f"rs#{call_id}"
+        return {"PK": {"S": pk}, "SK": {"S": pk}}
+
+    def get_rolling_summary_state(self, call_id: str) -> Optional[Dict[str, Any]]:
+        response = self.dynamodb_client.get_item(
+            Key=self.get_rolling_summary_key(call_id),
+            TableName=self.rolling_summary_table_name,
+            ConsistentRead=True,
+        )
+        item = response.get("Item")
+        if not item:
+            return None
+        return dict(
+            summary=item["Summary"]["S"],
+            last_end_time=float(item["LastEndTime"]["N"]),
+            # items written before versioning have no Version or SegmentIds
+            version=int(item["Version"]["N"]) if "Version" in item else None,
+            segment_ids=set(item.get("SegmentIds", {}).get("SS", [])),
+            # items written before the notes were appended have no Updates - their notes were
+            # rewritten on each update, and may have been cut off
+            updates=int(item["Updates"]["N"]) if "Updates" in item else None,
+            is_truncated=item.get("IsTruncated", {}).get("BOOL", False),
+        )
+
+    def put_rolling_summary_state(
+        self,
+        call_id: str,
+        summary: str,
+        last_end_time: float,
+        segment_ids: Set[str],
+        previous_state: Optional[Dict[str, Any]],
+        is_truncated: bool = False,
+    ) -> Optional[str]:
+        """Saves the running notes, unless another update got there first
+
+        Returns the saved notes, or None if they are truncated.
+
+        :parameter segment_ids: ids of the summarized segments in the overlap window
+        :parameter previous_state: the state this update started from (None - no state yet)
+        :parameter is_truncated: the notes are incomplete, and are no longer updated or used
+        """
+        # pylint: disable=too-many-arguments
+        previous_version = previous_state.get("version") if previous_state else None
+        previous_updates = (previous_state.get("updates") if previous_state else None) or 0
+        expires_after = int(time.time()) + MEETING_RECORD_EXPIRATION_IN_DAYS * 24 * 60 * 60
+        item = {
+            **self.get_rolling_summary_key(call_id),
+            "Summary": {"S": summary},
+            "LastEndTime": {"N": str(last_end_time)},
+            "Version": {"N": str((previous_version or 0) + 1)},
+            "Updates": {"N": str(previous_updates + 1)},
+            "IsTruncated": {"BOOL": is_truncated},
+            "UpdatedAt": {"S": datetime.utcnow().astimezone().isoformat()},
+            "ExpiresAfter": {"N": str(expires_after)},
+        }
+        if segment_ids:
+            # string sets can't be empty
+            item["SegmentIds"] = {"SS": sorted(segment_ids)}
+        # only replace the state that this update started from - the cursor doesn't always move, so
+        # the version is compared
+        if previous_version is not None:
+            condition = "attribute_not_exists(PK) OR Version = :previousVersion"
+            values = {":previousVersion": {"N": str(previous_version)}}
+        else:
+            condition = (
+                "attribute_not_exists(PK) OR "
+                "(attribute_not_exists(Version) AND LastEndTime = :previousEndTime)"
+            )
+            previous_end_time = previous_state["last_end_time"] if previous_state else 0
+            values = {":previousEndTime": {"N": str(previous_end_time)}}
+        try:
+            self.dynamodb_client.put_item(
+                Item=item,
+                TableName=self.rolling_summary_table_name,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            LOGGER.info("Rolling summary was updated by another request - using its notes")
+            state = self.get_rolling_summary_state(call_id)
+            if not state:
+                return None if is_truncated else summary
+            return None if state["is_truncated"] else state["summary"]
+        return None if is_truncated else summary
+
+    def update_rolling_summary(self, call_id: str, create: bool = True) -> Optional[str]:
+        """Brings the running notes up to date with the transcript added since their last update
+
+        Returns None if there are no notes for the call and create is False, or if the notes are
+        truncated.
+        """
+        state = self.get_rolling_summary_state(call_id)
+        if not state and not create:
+            return None
+        if state and state["is_truncated"]:
+            LOGGER.debug("Rolling summary: notes are truncated - not updated")
+            return None
+        # notes rewritten on each update (before the notes were appended) are started over
+        has_notes = bool(state) and state["updates"] is not None
+        if state and not has_notes and not create:
+            return None
+        notes = state["summary"] if has_notes else ""
+        previous_end_time = state["last_end_time"] if has_notes else 0
+        transcript, last_end_time, segment_ids = self.get_new_transcript(
+            call_id, previous_end_time, state["segment_ids"] if has_notes else set(),
+        )
+        if not transcript.strip():
+            LOGGER.debug("Rolling summary: no new transcript since EndTime %s", previous_end_time)
+            return notes or None
+        if MAP_REDUCE_CHUNK_TOKENS:
+            transcript = self.condense_transcript(transcript)
+        prompt = ROLLING_SUMMARY_PROMPT.format(
+            transcript=transcript, max_words=ROLLING_SUMMARY_MAX_WORDS
+        )
+        new_notes, stop_reason = self.call_bedrock_with_stop_reason(
+            prompt, max_tokens=ROLLING_SUMMARY_MAX_TOKENS, title="RollingSummary"
+        )
+        notes = f"{notes}\n\n{new_notes.strip()}" if notes else new_notes.strip()
+        is_truncated = stop_reason == "max_tokens"
+        if is_truncated:
+            LOGGER.warning("Rolling summary: notes were cut off - using the full transcript")
+        elif estimate_tokens(notes) > ROLLING_SUMMARY_MAX_NOTES_TOKENS:
+            LOGGER.info("Rolling summary: notes are too long - using the full transcript")
+            is_truncated = True
+        return self.put_rolling_summary_state(
+            call_id, notes, last_end_time, segment_ids, state, is_truncated
+        )
+
+    ##########################################################################
+    # Summary
+    ##########################################################################
+
+    def generate_summary(
+        self,
+        transcript: str,
+        prompt_override: Optional[str] = None,
+    ) -> Tuple[str, List[str]]:
+        """Runs the prompt templates on the transcript
+
+        Returns the summary text if there is one template, otherwise a JSON object of
+        {title: summary}, and the titles of the templates that failed.
+        """
+        templates = self.get_templates(prompt_override)
+        if MAP_REDUCE_CHUNK_TOKENS:
+            transcript = self.condense_transcript(transcript)
+        result: Dict[str, str] = {}
+        if SUMMARY_SINGLE_CALL and len(templates) > 1:
+            result = self.run_single_call(transcript, templates)
+
+        prompts = []
+        for item in templates:
+            key = list(item.keys())[0]
+            if key not in result:
+                prompts.append((key, item[key].replace("{transcript}", transcript)))
+
+        failed = []
+        for key, response, error in self.run_prompts(prompts):
+            # a failed prompt doesn't affect the results of the others
+            result[key] = response if not error else f"An error occurred generating {key}."
+            if error:
+                failed.append(key)
+        # keep the template order
+        result = {list(item.keys())[0]: result[list(item.keys())[0]] for item in templates}
+        if len(result.keys()) == 1:
+            # there's only one summary in here, so let's return just that.
+            # this may contain json or a string.
+            return result[list(result.keys())[0]], failed
+        return json.dumps(result), failed
+
+    def run_single_call(self, transcript: str, templates: List[Dict[str, str]]) -> Dict[str, str]:
+        """Runs all the templates in one request
+
+        Returns {title: text} for the sections it produced.
+        """
+        prompts = [(title, template) for item in templates for title, template in item.items()]
+        titles = [title for title, _ in prompts]
+        max_tokens = min(
+            SUMMARY_SINGLE_CALL_MAX_TOKENS, SUMMARY_SINGLE_CALL_TOKENS_PER_TEMPLATE * len(prompts)
+        )
+        try:
+            response = self.call_bedrock(
+                get_single_call_prompt(transcript, prompts),
+                max_tokens=max_tokens,
+                title="SingleCall",
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning(
+                "Single-call summary exception - running templates individually: %r", error
+            )
+            return {}
+        result = parse_single_call_response(response, titles)
+        missing = [title for title in titles if title not in result]
+        if missing:
+            LOGGER.warning(
+                "Single-call summary missing sections %s - running them individually", missing
+            )
+        return result
+
+    def summarize(
+        self,
+        call_id: str,
+        prompt_override: Optional[str] = None,
+        rolling: bool = False,
+    ) -> Optional[str]:
+        """Returns the call summary
+
+        :parameter prompt_override: prompt template(s) to use instead of the templates in DDB
+        :parameter rolling: only update the running summary of a meeting in progress
+        """
+        if rolling:
+            # periodic update of the running summary while the meeting is in progress
+            summary = None
+            if self.rolling_summary_table_name:
+                summary = self.update_rolling_summary(call_id)
+            LOGGER.debug("Rolling summary: %s", summary)
+            return summary
+
+        if self.summary_cache.is_enabled:
+            return self.summarize_cached(call_id, prompt_override)
+
+        summary, _ = self.summarize_call(call_id, prompt_override)
+        return summary
+
+    def get_rolling_notes(self, call_id: str) -> Optional[str]:
+        """The running notes of the call, brought up to date, to summarize instead of the transcript
+
+        Returns None if rolling summaries are disabled, or there are no complete notes for the call.
+        """
+        if not self.rolling_summary_table_name:
+            return None
+        try:
+            notes = self.update_rolling_summary(call_id, create=False)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Rolling summary exception - using full transcript")
+            return None
+        return f"{ROLLING_SUMMARY_NOTES_HEADING}\n{notes}" if notes else None
+
+    def summarize_call(
+        self,
+        call_id: str,
+        prompt_override: Optional[str] = None,
+        transcript: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """Generates the call summary - returns the summary, and False if any part of it failed
+
+        :parameter transcript: the running notes or full transcript to summarize, if already read
+        """
+        if transcript is None:
+            transcript = self.get_rolling_notes(call_id)
+        if transcript is None:
+            transcript = self.get_transcript(call_id)["transcript"]
+
+        try:
+            summary, failed = self.generate_summary(transcript, prompt_override)
+            is_complete = not failed
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("generate_summary")
+            summary = "An error occurred generating summary."
+            is_complete = False
+        LOGGER.debug("Summary: %s", summary)
+        return summary, is_complete
+
+    def summarize_cached(self, call_id: str, prompt_override: Optional[str] = None) -> str:
+        """Returns the cached summary if its input, prompt templates and model are unchanged
+
+        The input is the running notes of the call if it has them - the full transcript is then not
+        read at all - otherwise the full transcript. On a miss, generates the summary - once, for
+        concurrent identical requests - and caches it. Summaries with failed parts are not cached.
+        """
+        transcript = self.get_rolling_notes(call_id)
+        if transcript is not None:
+            # the notes change (with a new rolling Version) whenever new transcript arrives
+            key_input: Tuple[Any, ...] = ("notes", transcript)
+        else:
+            transcript_json = self.get_transcript(call_id)
+            transcript = transcript_json["transcript"]
+            key_input = (transcript_json["lastEndTime"], transcript)
+        cache_key = get_cache_key(
+            *key_input,
+            self.get_templates(prompt_override),
+            self.model_id,
+            self.router.policy,
+        )
+        try:
+            summary = self.summary_cache.acquire(call_id, cache_key)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Summary cache exception - generating summary: %r", error)
+            summary, _ = self.summarize_call(call_id, prompt_override, transcript)
+            return summary
+        if summary is not None:
+            return summary
+
+        summary, is_complete = self.summarize_call(call_id, prompt_override, transcript)
+        if is_complete:
+            self.summary_cache.put(call_id, cache_key, summary)
+        else:
+            self.summary_cache.release(call_id, cache_key)
+        return summary
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Per-container cache of knowledge base answers, keyed on KB ID and the normalized
+# (LLM rewritten) query. Set ANSWER_CACHE_TTL_SECONDS to 0 to disable the cache.
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "300"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))
+# Minimum word overlap (Jaccard similarity) for two queries to be treated as near-duplicates. Their
+# key terms (numbers, negations and capitalized names) must also be the same.
+# Set to 1 to allow exact matches only.
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(
+    os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.85"))
+# CALL: answers are reused only within the same meeting. GLOBAL: answers are shared across meetings,
+# except answers generated with the meeting transcript in the prompt, which are only reused in the
+# same meeting while the transcript in the prompt is unchanged.
+ANSWER_CACHE_SCOPE = os.environ.get("ANSWER_CACHE_SCOPE", "CALL").upper()
+
+non_word_remover = re.compile(r"[^\w\s]")
+word_finder = re.compile(r"[\w']+")
+NEGATIONS = frozenset(["not", "no", "never", "nor", "none", "without", "cannot"])
+
+
+def normalize_query(query):
+    query = non_word_remover.sub(" ", query.lower())
+    return " ".join(query.split())
+
+
+def key_terms(query):
+    """Words that change the meaning of a question when they differ - numbers, negations and
+    capitalized names (the first word excepted)"""
+    terms = set()
+    for index, word in enumerate(word_finder.findall(query)):
+        lower = word.lower()
+        if (any(c.isdigit() for c in word) or lower in NEGATIONS or lower.endswith("n't")
+                or (index > 0 and word[0].isupper())):
+            terms.add(lower)
+    return frozenset(terms)
+
+
+def similarity(words1, words2):
+    if not words1 or not words2:
+        return 0.0
+    return len(words1 & words2) / len(words1 | words2)
+
+
+class AnswerCache:
+    def __init__(self, ttl_seconds, max_entries, similarity_threshold):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        # (scope, normalized query) -> (expires_at, query words, key terms, response),
+        # least recently used first
+        self.entries = OrderedDict()
+
+    def evict_expired(self, now):
+        for key in [k for k, v in self.entries.items() if v[0] <= now]:
+            del self.entries[key]
+
+    def get(self, scope, query):
+        if self.ttl_seconds <= 0:
+            return None
+        now = time.time()
+        self.evict_expired(now)
+        normalized = normalize_query(query)
+        key = (scope, normalized)
+        if key not in self.entries:
+            # no exact match - look for the most similar query asked in the same scope
+            words = frozenset(normalized.split())
+            terms = key_terms(query)
+            best_score = 0.0
+            key = None
+            for (entry_scope, entry_query), entry in self.entries.items():
+                if entry_scope != scope or entry[2] != terms:
+                    continue
+                score = similarity(words, entry[1])
+                if score >= self.similarity_threshold and score > best_score:
+                    best_score = score
+                    key = (entry_scope, entry_query)
+            if key is None:
+                return None
+            print(f"Answer cache near-duplicate match ({best_score:.2f}): '{key[1]}'")
+        self.entries.move_to_end(key)
+        return self.entries[key][3]
+
+    def put(self, scope, query, response):
+        if self.ttl_seconds <= 0:
+            return
+        normalized = normalize_query(query)
+        key = (scope, normalized)
+        self.entries[key] = (time.time() + self.ttl_seconds,
+                             frozenset(normalized.split()), key_terms(query), response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+ANSWER_CACHE = AnswerCache(
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD
+)
+
+
+def get_transcript_key(transcript):
+    """Key of the transcript turns in a prompt"""
+    return hashlib.sha1(json.dumps(transcript, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_scope(kbId, callId, transcriptKey):
+    # answers generated from the meeting transcript must not be returned to other meetings, or
+    # later in the meeting, when the transcript has moved on
+    if transcriptKey:
+        return f"{kbId}#{callId}#{transcriptKey}"
+    if ANSWER_CACHE_SCOPE == "GLOBAL":
+        return kbId
+    return f"{kbId}#{callId}"
+
+
+def get_cached_answer(kbId, callId, query, transcriptKey=None):
+    return ANSWER_CACHE.get(get_scope(kbId, callId, transcriptKey), query)
+
+
+def put_cached_answer(kbId, callId, query, response, transcriptKey=None):
+    ANSWER_CACHE.put(get_scope(kbId, callId, transcriptKey), query, response)
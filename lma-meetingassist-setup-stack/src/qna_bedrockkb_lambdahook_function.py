@@ -1,47 +1,49 @@
 import json
 import os
 import boto3
+from botocore.config import Config
 import re
+import time
+from answer_cache import get_cached_answer, get_transcript_key, put_cached_answer
+from transcript_cache import get_transcript_turns
+from transcript_window import window_transcript
 
 print("Boto3 version: ", boto3.__version__)
 
-FETCH_TRANSCRIPT_FUNCTION_ARN = os.environ['FETCH_TRANSCRIPT_FUNCTION_ARN']
-
 KB_REGION = os.environ.get("KB_REGION") or os.environ["AWS_REGION"]
 KB_ID = os.environ.get("KB_ID")
 MODEL_ID = os.environ.get("MODEL_ID")
 MODEL_ARN = f"arn:aws:bedrock:{KB_REGION}::foundation-model/{MODEL_ID}"
 DEFAULT_MAX_TOKENS = 256
 
-LAMBDA_CLIENT = boto3.client("lambda")
+# adaptive retry mode adds client side rate limiting, which slows requests down when Bedrock
+# throttles them instead of retrying them all at once
+BEDROCK_CLIENT_CONFIG = Config(retries={"mode": "adaptive", "max_attempts": 5})
 KB_CLIENT = boto3.client(
     service_name="bedrock-agent-runtime",
-    region_name=KB_REGION
+    region_name=KB_REGION,
+    config=BEDROCK_CLIENT_CONFIG
 )
 BEDROCK_CLIENT = boto3.client(
     service_name="bedrock-runtime",
-    region_name=KB_REGION
+    region_name=KB_REGION,
+    config=BEDROCK_CLIENT_CONFIG
 )
+S3_CLIENT = boto3.client('s3')
 
+# Presigned URLs for KB citations are cached per container, keyed by S3 URI, and reused
+# until they are within PRESIGNED_URL_MIN_REMAINING_SECONDS of expiry.
+PRESIGNED_URL_EXPIRATION_SECONDS = int(
+    os.environ.get("PRESIGNED_URL_EXPIRATION_SECONDS", "3600"))
+PRESIGNED_URL_MIN_REMAINING_SECONDS = int(
+    os.environ.get("PRESIGNED_URL_MIN_REMAINING_SECONDS", "900"))
+PRESIGNED_URL_CACHE_MAX_ENTRIES = 1024
+# s3 uri -> (expires_at, presigned url)
+PRESIGNED_URL_CACHE = {}
 
-def get_call_transcript(callId, userInput, maxMessages):
-    payload = {
-        'CallId': callId,
-        'ProcessTranscript': True,
-        'IncludeSpeaker': True
-    }
-    lambda_response = LAMBDA_CLIENT.invoke(
-        FunctionName=FETCH_TRANSCRIPT_FUNCTION_ARN,
-        InvocationType='RequestResponse',
-        Payload=json.dumps(payload)
-    )
-    result = json.loads(lambda_response.get("Payload").read().decode("utf-8"))
-    transcriptSegments = result["transcript"].strip().split('\n')
 
-    transcript = []
-    for transcriptSegment in transcriptSegments:
-        speaker, text = transcriptSegment.split(":", 1)
-        transcript.append({"name": speaker, "transcript": text.strip()})
+def get_call_transcript(callId, userInput, maxMessages, maxTokens):
+    transcript = get_transcript_turns(callId)
 
     if transcript:
         # remove final segment if it matches the current input
@@ -52,8 +54,9 @@ def get_call_transcript(callId, userInput, maxMessages):
 
     if transcript:
         print(
-            f"Using last {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
-        transcript = transcript[-maxMessages:]
+            f"Using last {maxTokens} tokens (LLM_CHAT_HISTORY_MAX_TOKENS), "
+            f"at most {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
+        transcript = window_transcript(transcript, maxTokens, maxMessages)
         print(f"Transcript: {json.dumps(transcript)}")
     else:
         print(f'No transcript for callId {callId}')
@@ -61,7 +64,7 @@ def get_call_transcript(callId, userInput, maxMessages):
     return transcript
 
 
-def get_kb_response(generatePromptTemplate, transcript, query):
+def get_kb_response(generatePromptTemplate, transcript, query, callId=None):
     # if the query has already been labeled "small talk", we can skip
     # ensure the reponse matches the default ASSISTANT_NO_HITS_REGEX value ("Sorry,")
     if query == "small talk":
@@ -70,6 +73,16 @@ def get_kb_response(generatePromptTemplate, transcript, query):
         }
         print("Small talk response: ", json.dumps(resp))
     else:
+        # answers generated with the meeting transcript in the prompt are only reused in the same
+        # meeting, with the same transcript
+        transcriptKey = None
+        if transcript and "{transcript}" in generatePromptTemplate:
+            transcriptKey = get_transcript_key(transcript)
+        cached_resp = get_cached_answer(KB_ID, callId, query, transcriptKey)
+        if cached_resp:
+            print("Amazon Bedrock KB Response (from answer cache): ",
+                  json.dumps(cached_resp))
+            return cached_resp
         promptTemplate = generatePromptTemplate
         promptTemplate = promptTemplate.format(transcript=json.dumps(
             transcript))
@@ -93,6 +106,8 @@ def get_kb_response(generatePromptTemplate, transcript, query):
         print("Amazon Bedrock KB Request: ", input)
         try:
             resp = KB_CLIENT.retrieve_and_generate(**input)
+            if resp.get("output", {}).get("text"):
+                put_cached_answer(KB_ID, callId, query, resp, transcriptKey)
         except Exception as e:
             print("Amazon Bedrock KB Exception: ", e)
             resp = {
@@ -176,11 +191,23 @@ def get_args_from_lambdahook_args(event):
     return parameters
 
 
-def s3_uri_to_presigned_url(s3_uri, expiration=3600):
+def evict_presigned_urls(now):
+    for s3_uri in [k for k, v in PRESIGNED_URL_CACHE.items()
+                   if v[0] - now < PRESIGNED_URL_MIN_REMAINING_SECONDS]:
+        del PRESIGNED_URL_CACHE[s3_uri]
+    while len(PRESIGNED_URL_CACHE) >= PRESIGNED_URL_CACHE_MAX_ENTRIES:
+        # dicts keep insertion order - drop the oldest (soonest to expire) first
+        del PRESIGNED_URL_CACHE[next(iter(PRESIGNED_URL_CACHE))]
+
+
+def s3_uri_to_presigned_url(s3_uri, expiration=PRESIGNED_URL_EXPIRATION_SECONDS):
+    now = time.time()
+    cached = PRESIGNED_URL_CACHE.get(s3_uri)
+    if cached and cached[0] - now >= PRESIGNED_URL_MIN_REMAINING_SECONDS:
+        return cached[1]
     # Extract bucket name and object key from S3 URI
     bucket_name, object_key = s3_uri[5:].split('/', 1)
-    s3_client = boto3.client('s3')
-    return s3_client.generate_presigned_url(
+    url = S3_CLIENT.generate_presigned_url(
         'get_object',
         Params={
             'Bucket': bucket_name,
@@ -188,6 +215,9 @@ def s3_uri_to_presigned_url(s3_uri, expiration=3600):
         },
         ExpiresIn=expiration
     )
+    evict_presigned_urls(now)
+    PRESIGNED_URL_CACHE[s3_uri] = (now + expiration, url)
+    return url
 
 
 def get_url_from_reference(reference):
@@ -236,32 +266,33 @@ def format_response(event, kb_response, query):
     if queryprefix:
         plainttext = f"{queryprefix} {query}\n\n{plainttext}"
         markdown = f"**{queryprefix}** *{query}*\n\n{markdown}"
+    # resolve each citation's url once, for both context text and source links
+    references = [
+        (reference, get_url_from_reference(reference))
+        for source in kb_response.get("citations", [])
+        for reference in source.get("retrievedReferences", [])
+    ] if showContextText or showSourceLinks else []
     if showContextText:
         contextText = ""
-        for source in kb_response.get("citations", []):
-            for reference in source.get("retrievedReferences", []):
-                snippet = reference.get("content", {}).get(
-                    "text", "no reference text")
-                url = get_url_from_reference(reference)
-                if url:
-                    # get title from url - handle presigned urls by ignoring path after '?'
-                    title = os.path.basename(url.split('?')[0])
-                    title = os.path.basename(url)
-                    contextText = f'{contextText}<br><a href="{url}">{title}</a>'
-                else:
-                    contextText = f"{contextText}<br>{snippet}\n"
+        for reference, url in references:
+            snippet = reference.get("content", {}).get(
+                "text", "no reference text")
+            if url:
+                # get title from url - handle presigned urls by ignoring path after '?'
+                title = os.path.basename(url.split('?')[0])
+                contextText = f'{contextText}<br><a href="{url}">{title}</a>'
+            else:
                 contextText = f"{contextText}<br>{snippet}\n"
+            contextText = f"{contextText}<br>{snippet}\n"
         if contextText:
             markdown = f'{markdown}\n<details><summary>Context</summary><p style="white-space: pre-line;">{contextText}</p></details>'
     if showSourceLinks:
         sourceLinks = []
-        for source in kb_response.get("citations", []):
-            for reference in source.get("retrievedReferences", []):
-                url = get_url_from_reference(reference)
-                if url:
-                    # get title from url - handle presigned urls by ignoring path after '?'
-                    title = os.path.basename(url.split('?')[0])
-                    sourceLinks.append(f'<a href="{url}">{title}</a>')
+        for reference, url in references:
+            if url:
+                # get title from url - handle presigned urls by ignoring path after '?'
+                title = os.path.basename(url.split('?')[0])
+                sourceLinks.append(f'<a href="{url}">{title}</a>')
         if len(sourceLinks):
             markdown = f'{markdown}<br>Sources: ' + ", ".join(sourceLinks)
 
@@ -316,7 +347,9 @@ def handler(event, context):
     if callId:
         maxMessages = int(event["req"]["_settings"].get(
             "LLM_CHAT_HISTORY_MAX_MESSAGES", 20))
-        transcript = get_call_transcript(callId, userInput, maxMessages)
+        maxTokens = int(event["req"]["_settings"].get(
+            "LLM_CHAT_HISTORY_MAX_TOKENS", 2000))
+        transcript = get_call_transcript(callId, userInput, maxMessages, maxTokens)
     else:
         print("no callId in request or session attributes")
 
@@ -328,7 +361,7 @@ def handler(event, context):
     generatePromptTemplate = event["req"]["_settings"].get(
         "ASSISTANT_GENERATE_PROMPT_TEMPLATE")
     kb_response = get_kb_response(
-        generatePromptTemplate, transcript, query)
+        generatePromptTemplate, transcript, query, callId)
 
     event = format_response(event, kb_response, query)
     print("Returning response: %s" % json.dumps(event))
@@ -2,39 +2,26 @@ import json
 import os
 import uuid
 import boto3
-
-FETCH_TRANSCRIPT_FUNCTION_ARN = os.environ['FETCH_TRANSCRIPT_FUNCTION_ARN']
+from botocore.config import Config
+from transcript_cache import get_transcript_turns
+from transcript_window import window_transcript
 
 BR_REGION = os.environ.get("BR_REGION") or os.environ["AWS_REGION"]
 MODEL_ID = os.environ.get("MODEL_ID")
 MODEL_ARN = f"arn:aws:bedrock:{BR_REGION}::foundation-model/{MODEL_ID}"
 DEFAULT_MAX_TOKENS = 256
 
-LAMBDA_CLIENT = boto3.client("lambda")
+# adaptive retry mode adds client side rate limiting, which slows requests down when Bedrock
+# throttles them instead of retrying them all at once
 BEDROCK_CLIENT = boto3.client(
     service_name="bedrock-runtime",
-    region_name=BR_REGION
+    region_name=BR_REGION,
+    config=Config(retries={"mode": "adaptive", "max_attempts": 5})
 )
 
 
-def get_call_transcript(callId, userInput, maxMessages):
-    payload = {
-        'CallId': callId,
-        'ProcessTranscript': True,
-        'IncludeSpeaker': True
-    }
-    lambda_response = LAMBDA_CLIENT.invoke(
-        FunctionName=FETCH_TRANSCRIPT_FUNCTION_ARN,
-        InvocationType='RequestResponse',
-        Payload=json.dumps(payload)
-    )
-    result = json.loads(lambda_response.get("Payload").read().decode("utf-8"))
-    transcriptSegments = result["transcript"].strip().split('\n')
-
-    transcript = []
-    for transcriptSegment in transcriptSegments:
-        speaker, text = transcriptSegment.split(":", 1)
-        transcript.append({"name": speaker, "transcript": text.strip()})
+def get_call_transcript(callId, userInput, maxMessages, maxTokens):
+    transcript = get_transcript_turns(callId)
 
     if transcript:
         # remove final segment if it matches the current input
@@ -45,8 +32,9 @@ def get_call_transcript(callId, userInput, maxMessages):
 
     if transcript:
         print(
-            f"Using last {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
-        transcript = transcript[-maxMessages:]
+            f"Using last {maxTokens} tokens (LLM_CHAT_HISTORY_MAX_TOKENS), "
+            f"at most {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
+        transcript = window_transcript(transcript, maxTokens, maxMessages)
         print(f"Transcript: {json.dumps(transcript)}")
     else:
         print(f'No transcript for callId {callId}')
@@ -201,7 +189,9 @@ def handler(event, context):
     if callId:
         maxMessages = int(event["req"]["_settings"].get(
             "LLM_CHAT_HISTORY_MAX_MESSAGES", 20))
-        transcript = get_call_transcript(callId, userInput, maxMessages)
+        maxTokens = int(event["req"]["_settings"].get(
+            "LLM_CHAT_HISTORY_MAX_TOKENS", 2000))
+        transcript = get_call_transcript(callId, userInput, maxMessages, maxTokens)
     else:
         print("no callId in request or session attributes")
 
@@ -1,40 +1,19 @@
 import json
-import boto3
-import os
-FETCH_TRANSCRIPT_FUNCTION_ARN = os.environ['FETCH_TRANSCRIPT_FUNCTION_ARN']
-LAMBDA_CLIENT = boto3.client("lambda")
-
-def get_call_transcript(callId):
-    payload = {
-        'CallId': callId, 
-        'ProcessTranscript': True,
-        'IncludeSpeaker': True
-    }
-    lambda_response = LAMBDA_CLIENT.invoke(
-        FunctionName=FETCH_TRANSCRIPT_FUNCTION_ARN,
-        InvocationType='RequestResponse',
-        Payload=json.dumps(payload)
-    )
-    result = json.loads(lambda_response.get("Payload").read().decode("utf-8"))
-    return result["transcript"]
+from transcript_cache import get_transcript_turns
 
 def format_response(event, transcript):
     maxMessages = int(event["req"]["_settings"].get("LLM_CHAT_HISTORY_MAX_MESSAGES", 20))
     print(f"Using last {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
-    transcriptSegments = transcript.strip().split('\n')
     # remove final segment if it matches the current utterance
-    lastMessageRole, lastMessageText = transcriptSegments[-1].split(":")
-    if lastMessageText.strip() == event["req"].get("question").strip():
-      transcriptSegments.pop()
-    transcriptSegments = transcriptSegments[-maxMessages:]
+    if transcript and transcript[-1]["transcript"] == event["req"].get("question").strip():
+      transcript.pop()
+    transcript = transcript[-maxMessages:]
     chatHistory = []
-    role, text = None, None
-    for transcriptSegment in transcriptSegments:
-      role, text = transcriptSegment.split(":")
-      if role == "CALLER":
-        chatHistory.append({"Human": text.strip()})
+    for turn in transcript:
+      if turn["name"] == "CALLER":
+        chatHistory.append({"Human": turn["transcript"]})
       else:
-        chatHistory.append({"AI": text.strip()})
+        chatHistory.append({"AI": turn["transcript"]})
     event.setdefault("req",{}).setdefault("_userInfo",{})["chatMessageHistory"] = json.dumps(chatHistory)
     return event
 
@@ -44,7 +23,7 @@ def handler(event, context):
     callId = event["req"]["_event"].get("requestAttributes",{}).get("callId")
     if callId:
       print(f"Replacing chat history with call transcript for callId {callId}.")
-      transcript = get_call_transcript(callId)
+      transcript = get_transcript_turns(callId)
       event = format_response(event, transcript)
       # set callId sessionAttribute for possible later use in QnABot / Handlebars, etc.
       event["req"]["session"]["callId"] = callId
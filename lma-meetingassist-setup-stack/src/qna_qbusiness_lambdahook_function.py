@@ -2,8 +2,8 @@ import json
 import os
 import uuid
 import boto3
-
-FETCH_TRANSCRIPT_FUNCTION_ARN = os.environ['FETCH_TRANSCRIPT_FUNCTION_ARN']
+from transcript_cache import get_transcript_turns
+from transcript_window import window_transcript
 
 AMAZONQ_APP_ID = os.environ.get("AMAZONQ_APP_ID")
 AMAZONQ_REGION = os.environ.get("AMAZONQ_REGION") or os.environ["AWS_REGION"]
@@ -11,7 +11,6 @@ AMAZONQ_ENDPOINT_URL = os.environ.get(
     "AMAZONQ_ENDPOINT_URL") or f'https://qbusiness.{AMAZONQ_REGION}.api.aws'
 print("AMAZONQ_ENDPOINT_URL:", AMAZONQ_ENDPOINT_URL)
 
-LAMBDA_CLIENT = boto3.client("lambda")
 QBUSINESS_CLIENT = boto3.client(
     service_name="qbusiness",
     region_name=AMAZONQ_REGION,
@@ -19,24 +18,8 @@ QBUSINESS_CLIENT = boto3.client(
 )
 
 
-def get_call_transcript(callId, userInput, maxMessages):
-    payload = {
-        'CallId': callId,
-        'ProcessTranscript': True,
-        'IncludeSpeaker': True
-    }
-    lambda_response = LAMBDA_CLIENT.invoke(
-        FunctionName=FETCH_TRANSCRIPT_FUNCTION_ARN,
-        InvocationType='RequestResponse',
-        Payload=json.dumps(payload)
-    )
-    result = json.loads(lambda_response.get("Payload").read().decode("utf-8"))
-    transcriptSegments = result["transcript"].strip().split('\n')
-
-    transcript = []
-    for transcriptSegment in transcriptSegments:
-        speaker, text = transcriptSegment.split(":", 1)
-        transcript.append({"name": speaker, "transcript": text.strip()})
+def get_call_transcript(callId, userInput, maxMessages, maxTokens):
+    transcript = get_transcript_turns(callId)
 
     if transcript:
         # remove final segment if it matches the current input
@@ -47,8 +30,9 @@ def get_call_transcript(callId, userInput, maxMessages):
 
     if transcript:
         print(
-            f"Using last {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
-        transcript = transcript[-maxMessages:]
+            f"Using last {maxTokens} tokens (LLM_CHAT_HISTORY_MAX_TOKENS), "
+            f"at most {maxMessages} conversation turns (LLM_CHAT_HISTORY_MAX_MESSAGES)")
+        transcript = window_transcript(transcript, maxTokens, maxMessages)
         print(f"Transcript: {json.dumps(transcript)}")
     else:
         print(f'No transcript for callId {callId}')
@@ -158,7 +142,7 @@ def format_response(event, amazonq_response):
         prefix = None
     plainttext = amazonq_response["systemMessage"]
     markdown = amazonq_response["systemMessage"]
-    ssml = f"<speak>{amazonq_response["systemMessage"]}</speak>"
+    ssml = f"<speak>{amazonq_response['systemMessage']}</speak>"
     if prefix:
         plainttext = f"{prefix}\n\n{plainttext}"
         markdown = f"**{prefix}**\n\n{markdown}"
@@ -230,7 +214,9 @@ def handler(event, context):
     if callId:
         maxMessages = int(event["req"]["_settings"].get(
             "LLM_CHAT_HISTORY_MAX_MESSAGES", 20))
-        transcript = get_call_transcript(callId, userInput, maxMessages)
+        maxTokens = int(event["req"]["_settings"].get(
+            "LLM_CHAT_HISTORY_MAX_TOKENS", 2000))
+        transcript = get_call_transcript(callId, userInput, maxMessages, maxTokens)
         if transcript:
             prompt = f'You are an AI assistant helping a human during a meeting. Here is the meeting transcript: {json.dumps(transcript)}.'
             prompt = f'{prompt}\nPlease respond to the following request from the human, using the transcript and any additional information as context.\n{userInput}'
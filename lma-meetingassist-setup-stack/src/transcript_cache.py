@@ -0,0 +1,149 @@
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+from urllib.request import urlopen
+import boto3
+
+FETCH_TRANSCRIPT_FUNCTION_ARN = os.environ['FETCH_TRANSCRIPT_FUNCTION_ARN']
+
+# Per-container cache of call transcripts, shared by the meeting assist lambdahooks.
+# Follow up questions only fetch the segments added since the previous question.
+TRANSCRIPT_CACHE_MAX_CALLS = int(os.environ.get("TRANSCRIPT_CACHE_MAX_CALLS", "32"))
+TRANSCRIPT_CACHE_TTL_SECONDS = int(os.environ.get("TRANSCRIPT_CACHE_TTL_SECONDS", "3600"))
+# Only the most recent turns are kept - assistant prompts never use more than this.
+TRANSCRIPT_CACHE_MAX_TURNS = int(os.environ.get("TRANSCRIPT_CACHE_MAX_TURNS", "500"))
+# Segments of the two channels are written out of EndTime order, so each fetch re-reads the segments
+# that ended up to this many seconds before the cursor, and skips the ones already cached.
+TRANSCRIPT_CACHE_OVERLAP_SECONDS = float(os.environ.get("TRANSCRIPT_CACHE_OVERLAP_SECONDS", "30"))
+
+LAMBDA_CLIENT = boto3.client("lambda")
+
+# callId -> {"turns": [{"id":..., "name":..., "transcript":..., "channel":..., "end":...}],
+#            "lastEndTime": float, "accessedAt": float}
+TRANSCRIPT_CACHE = OrderedDict()
+
+
+def fetch_transcript(callId, sinceEndTime):
+    payload = {
+        'CallId': callId,
+        'ProcessTranscript': True,
+        'IncludeSpeaker': True,
+        # structured turns - no speaker names to parse back out of the transcript string
+        'OutputFormat': 'turns',
+        # long transcripts are returned as a presigned URL to a gzip compressed S3 object
+        'AcceptPayloadUrl': True
+    }
+    if sinceEndTime:
+        payload['SinceEndTime'] = max(sinceEndTime - TRANSCRIPT_CACHE_OVERLAP_SECONDS, 0)
+    else:
+        # first fetch for the call - only the turns that will be kept
+        payload['LastNTurns'] = TRANSCRIPT_CACHE_MAX_TURNS
+    lambda_response = LAMBDA_CLIENT.invoke(
+        FunctionName=FETCH_TRANSCRIPT_FUNCTION_ARN,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload)
+    )
+    return read_payload(json.loads(lambda_response.get("Payload").read().decode("utf-8")))
+
+
+def read_payload(result):
+    if "PayloadUrl" not in result:
+        return result
+    print(f"Reading {result.get('PayloadBytes')} byte transcript from S3")
+    # decompressed as it is downloaded
+    with urlopen(result["PayloadUrl"]) as response:
+        with gzip.GzipFile(fileobj=response) as stream:
+            return json.load(stream)
+
+
+def to_cached_turns(fetchedTurns):
+    return [
+        {
+            # None for FetchTranscript functions without segment ids - see get_turn_key
+            "id": turn.get("id"),
+            "name": turn["speaker"],
+            "transcript": turn["text"],
+            "channel": turn["channel"],
+            "end": turn["end"]
+        }
+        for turn in fetchedTurns
+    ]
+
+
+def parse_transcript(transcriptString):
+    """Turns from a transcript string
+
+    For FetchTranscript functions without OutputFormat support.
+    """
+    turns = []
+    for transcriptSegment in transcriptString.strip().split('\n'):
+        if not transcriptSegment.strip():
+            continue
+        if ":" in transcriptSegment:
+            speaker, text = transcriptSegment.split(":", 1)
+        else:
+            speaker, text = "", transcriptSegment
+        turns.append({"name": speaker, "transcript": text.strip()})
+    return turns
+
+
+def evict_transcripts(now):
+    expired = [
+        callId
+        for callId, entry in TRANSCRIPT_CACHE.items()
+        if now - entry["accessedAt"] > TRANSCRIPT_CACHE_TTL_SECONDS
+    ]
+    for callId in expired:
+        del TRANSCRIPT_CACHE[callId]
+    while len(TRANSCRIPT_CACHE) > TRANSCRIPT_CACHE_MAX_CALLS:
+        TRANSCRIPT_CACHE.popitem(last=False)
+
+
+def get_turn_key(turn):
+    """Key of a turn for skipping the re-read overlap - its segment id, if it has one"""
+    if turn.get("id"):
+        return turn["id"]
+    return (turn.get("end"), turn.get("channel"), turn["transcript"])
+
+
+def add_turns(cachedTurns, fetchedTurns):
+    """Adds the fetched turns that aren't cached yet (re-read overlap), in EndTime order"""
+    if not fetchedTurns or "end" not in fetchedTurns[0]:
+        # transcript string from an older FetchTranscript - no overlap to skip
+        return cachedTurns + fetchedTurns
+    cachedKeys = set(get_turn_key(turn) for turn in cachedTurns)
+    newTurns = [turn for turn in fetchedTurns if get_turn_key(turn) not in cachedKeys]
+    if not newTurns:
+        return cachedTurns
+    # late segments are placed by EndTime, not appended
+    return sorted(cachedTurns + newTurns, key=lambda turn: turn.get("end", 0))
+
+
+def get_transcript_turns(callId):
+    """Returns the list of {"name", "transcript"} turns for the call, oldest first"""
+    now = time.time()
+    entry = TRANSCRIPT_CACHE.get(callId)
+    sinceEndTime = entry["lastEndTime"] if entry else 0
+    result = fetch_transcript(callId, sinceEndTime)
+    if "turns" in result:
+        newTurns = to_cached_turns(result["turns"])
+    else:
+        newTurns = parse_transcript(result.get("transcript", ""))
+    turns = add_turns(entry["turns"], newTurns) if entry else newTurns
+    print(
+        f"Fetched {len(newTurns)} transcript turns for callId {callId} "
+        f"since EndTime {sinceEndTime}"
+    )
+    turns = turns[-TRANSCRIPT_CACHE_MAX_TURNS:]
+    if "lastEndTime" in result:
+        TRANSCRIPT_CACHE[callId] = {
+            "turns": turns,
+            "lastEndTime": max(result["lastEndTime"], sinceEndTime),
+            "accessedAt": now
+        }
+        TRANSCRIPT_CACHE.move_to_end(callId)
+    evict_transcripts(now)
+    # return a copy so callers can trim it without changing the cached turns
+    return list(turns)
@@ -0,0 +1,68 @@
+# Fast local token estimate - roughly 4 characters per token for English text with
+# Anthropic / Titan tokenizers. Good enough to keep prompt sizes predictable without
+# calling a tokenizer on every question.
+CHARS_PER_TOKEN = 4
+# Allowance for the JSON keys and punctuation around each turn in the prompt
+TURN_OVERHEAD_TOKENS = 8
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def turn_tokens(turn):
+    return (
+        TURN_OVERHEAD_TOKENS + estimate_tokens(turn["name"]) + estimate_tokens(turn["transcript"])
+    )
+
+
+def truncate_to_tokens(text, maxTokens):
+    # keep the end of the text - the most recent words matter most
+    maxChars = maxTokens * CHARS_PER_TOKEN
+    if maxChars <= 0:
+        return ""
+    if len(text) <= maxChars:
+        return text
+    text = text[-maxChars:]
+    # don't start mid word
+    space = text.find(" ")
+    return text[space + 1:] if 0 <= space < len(text) - 1 else text
+
+
+def window_transcript(turns, maxTokens, maxMessages=None):
+    """Returns the most recent turns that fit within maxTokens (estimated), oldest first.
+    Consecutive turns from the same speaker are merged into one turn.
+    maxMessages, if set, also caps the number of (merged) turns returned."""
+    # built newest first, then reversed
+    window = []
+    usedTokens = 0
+    for turn in reversed(turns):
+        if window and window[-1]["name"] == turn["name"]:
+            # same speaker as the next (newer) turn already in the window - merge
+            merged = f'{turn["transcript"]} {window[-1]["transcript"]}'.strip()
+            addedTokens = estimate_tokens(merged) - estimate_tokens(window[-1]["transcript"])
+            if usedTokens + addedTokens > maxTokens:
+                break
+            window[-1] = {"name": turn["name"], "transcript": merged}
+            usedTokens += addedTokens
+            continue
+        if maxMessages and len(window) >= maxMessages:
+            break
+        tokens = turn_tokens(turn)
+        if usedTokens + tokens > maxTokens:
+            if not window:
+                # most recent turn alone is over budget - keep as much of its end as fits
+                available = maxTokens - TURN_OVERHEAD_TOKENS - estimate_tokens(turn["name"])
+                text = truncate_to_tokens(turn["transcript"], available)
+                if text:
+                    window.append({"name": turn["name"], "transcript": text})
+                    usedTokens += turn_tokens(window[-1])
+            break
+        window.append({"name": turn["name"], "transcript": turn["transcript"]})
+        usedTokens += tokens
+    window.reverse()
+    print(f"Transcript window: {len(window)} turns, ~{usedTokens} tokens "
+          f"(budget {maxTokens} tokens, from {len(turns)} turns)")
+    return window
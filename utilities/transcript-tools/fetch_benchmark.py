@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""LMA Transcript Fetch Benchmark
+
+Compares transcript segment reads on a long synthetic call in the local event sourcing table
+stand-in (local_stubs.py): a single unpaginated query (the original FetchTranscript read),
+paginated queries of the call partition returning full items, and the paginated, projected reader
+of the transcript enrichment layer - on the final segment index, read in full, stopped early and
+newest first for the last turns, and on a call written before the index was added - and
+fetch_transcript before and after the call transcript is compacted into one document, and from the
+FetchTranscript in-memory cache of ended call transcripts. See README.md.
+"""
+from itertools import islice
+from pathlib import Path
+from statistics import median
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import sys
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+from local_stubs import LocalEventsTable, make_segments
+
+LAYER_PATH = (
+    Path(__file__).resolve().parents[2]
+    / "lma-ai-stack/source/lambda_layers/transcript_enrichment_layer"
+)
+sys.path.insert(0, str(LAYER_PATH))
+
+# imported from the layer source, after its path is added
+# pylint: disable=wrong-import-position
+from transcript_summary import (  # noqa: E402
+    TranscriptMemoryCache,
+    compact_transcript,
+    fetch_transcript,
+    iter_transcript_segments,
+)
+
+CALL_ID = "benchmark-call"
+UNINDEXED_CALL_ID = "benchmark-call-unindexed"
+SEGMENT_FILTER = (
+    (Attr("Channel").eq("AGENT") | Attr("Channel").eq("CALLER")) & Attr("IsPartial").eq(False)
+)
+
+
+def read_single_query(table: LocalEventsTable) -> List[Dict[str, Any]]:
+    """The original read - one query, LastEvaluatedKey ignored, full items"""
+    response = table.query(
+        KeyConditionExpression=Key("PK").eq(f"trs#{CALL_ID}"), FilterExpression=SEGMENT_FILTER
+    )
+    return response["Items"]
+
+
+def read_paginated_full_items(table: LocalEventsTable) -> List[Dict[str, Any]]:
+    query_args: Dict[str, Any] = dict(
+        KeyConditionExpression=Key("PK").eq(f"trs#{CALL_ID}"), FilterExpression=SEGMENT_FILTER
+    )
+    items = []
+    while True:
+        response = table.query(**query_args)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def read_paginated_projected(table: LocalEventsTable, call_id: str) -> List[Dict[str, Any]]:
+    return list(iter_transcript_segments(table, call_id))
+
+
+def read_first_segments(table: LocalEventsTable, count: int) -> List[Dict[str, Any]]:
+    return list(islice(iter_transcript_segments(table, CALL_ID, page_size=count), count))
+
+
+def read_last_turns(table: LocalEventsTable, call_id: str, count: int) -> List[Dict[str, Any]]:
+    return list(
+        islice(iter_transcript_segments(table, call_id, page_size=count, newest_first=True), count)
+    )
+
+
+def run_case(
+    table: LocalEventsTable,
+    name: str,
+    read: Callable[[], Any],
+    repeat: int,
+    expected: Optional[int],
+) -> None:
+    durations = []
+    result: Any = None
+    for _ in range(repeat):
+        table.reset_counters()
+        started_at = time.perf_counter()
+        result = read()
+        durations.append(time.perf_counter() - started_at)
+    count = len(result) if isinstance(result, list) else len(result["transcript"].split())
+    unit = "segments" if isinstance(result, list) else "words"
+    missing = f" ({expected - count} missing)" if expected is not None and count < expected else ""
+    print(
+        f"{name:<34} {median(durations) * 1000:8.1f} ms  {table.query_count:3d} queries  "
+        f"{table.read_bytes / 1024:8.0f} KiB read  "
+        f"{table.returned_bytes / 1024:8.0f} KiB returned  "
+        f"{count} {unit}{missing}"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark transcript segment reads on a synthetic call"
+    )
+    parser.add_argument("--segments", type=int, default=5000, help="segments in the synthetic call")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="runs per case - the median time is reported",
+    )
+    parser.add_argument(
+        "--first",
+        type=int,
+        default=100,
+        help="segments read by the early stop case",
+    )
+    parser.add_argument(
+        "--last-turns",
+        type=int,
+        default=20,
+        help="segments read by the last turns cases",
+    )
+    args = parser.parse_args(argv)
+
+    table = LocalEventsTable()
+    for item in make_segments(CALL_ID, args.segments):
+        table.put_item(Item=item)
+    for item in make_segments(UNINDEXED_CALL_ID, args.segments, indexed=False):
+        table.put_item(Item=item)
+    expected = len(read_paginated_full_items(table))
+    print(f"Synthetic call: {args.segments} segments, {expected} final AGENT / CALLER segments\n")
+
+    run_case(
+        table,
+        "single query (original)",
+        lambda: read_single_query(table),
+        args.repeat,
+        expected,
+    )
+    run_case(
+        table,
+        "paginated, full items",
+        lambda: read_paginated_full_items(table),
+        args.repeat,
+        expected,
+    )
+    run_case(
+        table,
+        "index, projected",
+        lambda: read_paginated_projected(table, CALL_ID),
+        args.repeat,
+        expected,
+    )
+    run_case(
+        table,
+        f"index, projected, first {args.first}",
+        lambda: read_first_segments(table, args.first),
+        args.repeat,
+        None,
+    )
+    run_case(
+        table,
+        "unindexed call, projected",
+        lambda: read_paginated_projected(table, UNINDEXED_CALL_ID),
+        args.repeat,
+        expected,
+    )
+    for call_id, name in ((CALL_ID, "index"), (UNINDEXED_CALL_ID, "unindexed call")):
+        run_case(
+            table,
+            f"{name}, last {args.last_turns} turns",
+            lambda call_id=call_id: read_last_turns(table, call_id, args.last_turns),
+            args.repeat,
+            None,
+        )
+    run_case(
+        table,
+        "fetch_transcript",
+        lambda: fetch_transcript(table, CALL_ID, process_transcript=True, include_speaker=True),
+        args.repeat,
+        None,
+    )
+    # as at the end of the call
+    compact_transcript(table, CALL_ID)
+    run_case(
+        table,
+        "fetch_transcript, compacted",
+        lambda: fetch_transcript(table, CALL_ID, process_transcript=True, include_speaker=True),
+        args.repeat,
+        None,
+    )
+    # repeated reads of the ended call - only the document header is read
+    memory_cache = TranscriptMemoryCache(table)
+    memory_cache.fetch_transcript(CALL_ID, process_transcript=True, include_speaker=True)
+    run_case(
+        table,
+        "fetch_transcript, memory cache",
+        lambda: memory_cache.fetch_transcript(
+            CALL_ID, process_transcript=True, include_speaker=True
+        ),
+        args.repeat,
+        None,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Local stand-ins for the AWS services used by the transcript tools
+
+Lets the tools run (and be tested or benchmarked) without an AWS account:
+- LocalEventsTable - in-memory DynamoDB Table resource for the call event sourcing table, with
+  key conditions, filters, projections, 1MB pages, sort order, limits and sparse indexes
+- LocalDynamoDBClient - DynamoDB client serving the LMA default summary prompt templates
+- LocalBedrockClient - Bedrock runtime client returning a canned completion
+- LocalSummaryWriter - records summaries instead of calling the AppSync addCallSummaryText mutation
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import random
+import threading
+import time
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_PROMPT_TEMPLATES_FILE = (
+    REPO_ROOT / "lma-llm-template-setup-stack/source/lambda_functions/LLMPromptSummaryTemplate.json"
+)
+# DynamoDB returns at most 1MB of items read per Query page
+QUERY_PAGE_BYTES = 1024 * 1024
+# global secondary indexes of the event sourcing table - {index name: (partition key, sort key)}
+EVENTS_TABLE_INDEXES = {"FinalSegmentsByEndTime": ("FinalSegmentPK", "EndTime")}
+
+SHARDS_IN_DAY = 6
+SPEAKERS = ["Alice", "Bob", "Carol", "Dan"]
+WORDS = (
+    "we should review the budget timeline and follow up with the team about the launch plan "
+    "um I think like the customer feedback was mostly positive but uh there are a few issues "
+    "to resolve before next week so let's assign owners and due dates for each action item"
+).split()
+
+
+def item_size(item: Dict[str, Any]) -> int:
+    # binary attributes count their length, like DynamoDB does
+    return len(
+        json.dumps(
+            item, default=lambda value: "." * len(value) if isinstance(value, bytes) else str(value)
+        )
+    )
+
+
+def evaluate_condition(condition: Any, item: Dict[str, Any]) -> bool:
+    """Evaluates a boto3.dynamodb.conditions Key / Attr condition on an item"""
+    # pylint: disable=too-many-return-statements
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+    if operator == "AND":
+        return all(evaluate_condition(value, item) for value in values)
+    if operator == "OR":
+        return any(evaluate_condition(value, item) for value in values)
+    if operator == "NOT":
+        return not evaluate_condition(values[0], item)
+    name = values[0].name
+    if operator == "attribute_exists":
+        return name in item
+    if operator == "attribute_not_exists":
+        return name not in item
+    if name not in item:
+        return False
+    value = item[name]
+    operands = values[1:]
+    comparisons: Dict[str, Callable[[], bool]] = {
+        "=": lambda: value == operands[0],
+        "<>": lambda: value != operands[0],
+        "<": lambda: value < operands[0],
+        "<=": lambda: value <= operands[0],
+        ">": lambda: value > operands[0],
+        ">=": lambda: value >= operands[0],
+        "BETWEEN": lambda: operands[0] <= value <= operands[1],
+        "begins_with": lambda: str(value).startswith(operands[0]),
+        "contains": lambda: operands[0] in value,
+        "IN": lambda: value in operands[0],
+    }
+    return comparisons[operator]()
+
+
+class LocalEventsTable:
+    """In-memory stand-in for the boto3 DynamoDB Table resource of the call event sourcing table"""
+
+    def __init__(self, indexes: Optional[Dict[str, Tuple[str, str]]] = None) -> None:
+        """:parameter indexes: {index name: (partition key, sort key)} of sparse global secondary
+        indexes
+        """
+        self.name = "LocalEventsTable"
+        self.indexes = EVENTS_TABLE_INDEXES if indexes is None else indexes
+        self.partitions: Dict[Tuple[Optional[str], Any], Dict[Any, Dict[str, Any]]] = {}
+        self.lock = threading.Lock()
+        self.query_count = 0
+        # item bytes read (what read capacity is charged on) and returned (after projection)
+        self.read_bytes = 0
+        self.returned_bytes = 0
+
+    def reset_counters(self) -> None:
+        self.query_count = 0
+        self.read_bytes = 0
+        self.returned_bytes = 0
+
+    def get_keys(self, index_name: Optional[str]) -> Tuple[str, str]:
+        return self.indexes[index_name] if index_name else ("PK", "SK")
+
+    def put_item(self, Item: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        # pylint: disable=invalid-name,unused-argument
+        with self.lock:
+            self.delete_item({"PK": Item["PK"], "SK": Item["SK"]})
+            for index_name in [None, *self.indexes]:
+                partition_key, sort_key = self.get_keys(index_name)
+                if partition_key in Item and sort_key in Item:
+                    partition = self.partitions.setdefault((index_name, Item[partition_key]), {})
+                    # index sort keys aren't unique - the table key breaks ties
+                    partition[(Item[sort_key], Item["SK"]) if index_name else Item["SK"]] = Item
+        return {}
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        # pylint: disable=invalid-name,unused-argument
+        item = self.partitions.get((None, Key["PK"]), {}).get(Key["SK"])
+        if not item:
+            return {}
+        for index_name in [None, *self.indexes]:
+            partition_key, sort_key = self.get_keys(index_name)
+            if partition_key in item and sort_key in item:
+                partition = self.partitions.get((index_name, item[partition_key]), {})
+                partition.pop((item[sort_key], item["SK"]) if index_name else item["SK"], None)
+        return {}
+
+    def get_item(self, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        # pylint: disable=invalid-name
+        item = self.partitions.get((None, Key["PK"]), {}).get(Key["SK"])
+        if item is None:
+            return {}
+        return {
+            "Item": self.project(
+                item, kwargs.get("ProjectionExpression"), kwargs.get("ExpressionAttributeNames")
+            )
+        }
+
+    @staticmethod
+    def project(
+        item: Dict[str, Any],
+        projection_expression: Optional[str],
+        attribute_names: Optional[Dict[str, str]],
+    ) -> Dict[str, Any]:
+        if not projection_expression:
+            return item
+        names = [name.strip() for name in projection_expression.split(",")]
+        names = [(attribute_names or {}).get(name, name) for name in names]
+        return {name: item[name] for name in names if name in item}
+
+    def query(self, **kwargs: Any) -> Dict[str, Any]:
+        """Query with KeyConditionExpression, FilterExpression, ProjectionExpression,
+        ExpressionAttributeNames, IndexName, ScanIndexForward, Limit and ExclusiveStartKey"""
+        index_name = kwargs.get("IndexName")
+        partition_key, sort_key = self.get_keys(index_name)
+        key_condition = kwargs["KeyConditionExpression"]
+        partition_value = self.get_partition_value(key_condition, partition_key)
+        with self.lock:
+            partition = self.partitions.get((index_name, partition_value), {})
+            sort_values = sorted(partition, reverse=not kwargs.get("ScanIndexForward", True))
+            rows = [(sort_value, partition[sort_value]) for sort_value in sort_values]
+
+        start_key = kwargs.get("ExclusiveStartKey")
+        if start_key:
+            start = (start_key[sort_key], start_key["SK"]) if index_name else start_key[sort_key]
+            position = [sort_value for sort_value, _ in rows].index(start) + 1
+            rows = rows[position:]
+
+        limit = kwargs.get("Limit")
+        filter_expression = kwargs.get("FilterExpression")
+        items: List[Dict[str, Any]] = []
+        read = 0
+        read_bytes = 0
+        last_item = None
+        is_truncated = False
+        for _, item in rows:
+            if not evaluate_condition(key_condition, item):
+                continue
+            # Limit and the page size apply to the items read, before the filter
+            if (limit and read >= limit) or read_bytes >= QUERY_PAGE_BYTES:
+                is_truncated = True
+                break
+            read += 1
+            read_bytes += item_size(item)
+            last_item = item
+            if filter_expression is None or evaluate_condition(filter_expression, item):
+                items.append(
+                    self.project(
+                        item,
+                        kwargs.get("ProjectionExpression"),
+                        kwargs.get("ExpressionAttributeNames"),
+                    )
+                )
+
+        self.query_count += 1
+        self.read_bytes += read_bytes
+        self.returned_bytes += sum(item_size(item) for item in items)
+        response: Dict[str, Any] = {"Items": items, "Count": len(items), "ScannedCount": read}
+        if is_truncated and last_item is not None:
+            last_key = {"PK": last_item["PK"], "SK": last_item["SK"]}
+            if index_name:
+                last_key.update(
+                    {partition_key: last_item[partition_key], sort_key: last_item[sort_key]}
+                )
+            response["LastEvaluatedKey"] = last_key
+        return response
+
+    @staticmethod
+    def get_partition_value(key_condition: Any, partition_key: str) -> Any:
+        expression = key_condition.get_expression()
+        conditions = expression["values"] if expression["operator"] == "AND" else [key_condition]
+        for condition in conditions:
+            values = condition.get_expression()["values"]
+            if values[0].name == partition_key:
+                return values[1]
+        raise ValueError(f"KeyConditionExpression has no condition on {partition_key}")
+
+
+class LocalDynamoDBClient:
+    """DynamoDB client stand-in serving the prompt templates items"""
+
+    class exceptions:  # pylint: disable=invalid-name,too-few-public-methods
+        class ConditionalCheckFailedException(Exception):
+            pass
+
+    def __init__(self, prompt_templates: Optional[Dict[str, str]] = None) -> None:
+        if prompt_templates is None:
+            prompt_templates = json.loads(DEFAULT_PROMPT_TEMPLATES_FILE.read_text(encoding="utf-8"))
+        default_item = {"LLMPromptTemplateId": {"S": "DefaultSummaryPromptTemplates"}}
+        for i, (title, prompt) in enumerate(prompt_templates.items(), start=1):
+            default_item[f"{i}#{title}"] = {"S": prompt}
+        custom_item = {"LLMPromptTemplateId": {"S": "CustomSummaryPromptTemplates"}}
+        self.items = [default_item, custom_item]
+
+    def batch_get_item(self, RequestItems: Dict[str, Any]) -> Dict[str, Any]:
+        # pylint: disable=invalid-name
+        table_name = list(RequestItems)[0]
+        return {"Responses": {table_name: self.items}, "UnprocessedKeys": {}}
+
+
+class LocalBedrockClient:
+    """Bedrock runtime client stand-in - returns a short canned completion after latency_seconds"""
+
+    def __init__(self, latency_seconds: float = 0.05) -> None:
+        self.latency_seconds = latency_seconds
+        self.invocations = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, body: str, modelId: str, **kwargs: Any) -> Dict[str, Any]:
+        # pylint: disable=invalid-name,unused-argument
+        with self.lock:
+            self.invocations += 1
+        time.sleep(self.latency_seconds)
+        input_tokens = len(body) // 4
+        text = f"[Local summary of a {input_tokens} token prompt]"
+        if modelId.startswith("anthropic.claude-3"):
+            response_body = {"content": [{"type": "text", "text": text}]}
+        else:
+            response_body = {"completion": text}
+        return {
+            "body": BytesIO(json.dumps(response_body).encode("utf-8")),
+            "ResponseMetadata": {
+                "HTTPHeaders": {
+                    "x-amzn-bedrock-input-token-count": str(input_tokens),
+                    "x-amzn-bedrock-output-token-count": str(len(text) // 4),
+                }
+            },
+        }
+
+
+class LocalSummaryWriter:
+    """Records summaries instead of writing them through AppSync"""
+
+    def __init__(self) -> None:
+        self.summaries: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def write_summary(self, call_id: str, summary: str) -> None:
+        with self.lock:
+            self.summaries[call_id] = summary
+
+
+def get_call_list_key(created_at: datetime, call_id: str) -> Dict[str, str]:
+    """cls# call list item key, as written by the createCall resolver"""
+    shard = created_at.hour // (24 // SHARDS_IN_DAY)
+    created = created_at.isoformat(timespec="milliseconds") + "Z"
+    return {
+        "PK": f"cls#{created_at.date().isoformat()}#s#{shard:02d}",
+        "SK": f"ts#{created}#id#{call_id}",
+    }
+
+
+def make_segments(
+    call_id: str, segments: int, seed: int = 0, indexed: bool = True
+) -> Iterable[Dict[str, Any]]:
+    """Synthetic transcript segment items, keyed as written by the addTranscriptSegment resolver
+
+    Mostly final AGENT / CALLER segments with sentiment, plus a few partial segments that were never
+    finalized and a few meeting assistant (AGENT_ASSISTANT) messages.
+
+    :parameter indexed: add the final segments to the final segment index, as the resolver does
+        since the index was added
+    """
+    rng = random.Random(seed)
+    end_time = Decimal("0")
+    for _ in range(segments):
+        start_time = end_time
+        end_time = start_time + Decimal(str(round(rng.uniform(1, 8), 3)))
+        segment_id = "%032x" % rng.getrandbits(128)
+        channel = rng.choices(["AGENT", "CALLER", "AGENT_ASSISTANT"], weights=[48, 48, 4])[0]
+        item = {
+            "PK": f"trs#{call_id}",
+            "SK": f"s#{segment_id}",
+            "CallId": call_id,
+            "SegmentId": segment_id,
+            "Channel": channel,
+            "Speaker": rng.choice(SPEAKERS) if channel != "AGENT_ASSISTANT" else "",
+            "StartTime": start_time,
+            "EndTime": end_time,
+            "Transcript": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))),
+            "IsPartial": rng.random() < 0.02,
+            "Sentiment": rng.choice(["POSITIVE", "NEUTRAL", "NEGATIVE"]),
+            "SentimentScore": {
+                "Positive": Decimal(str(round(rng.random(), 3))),
+                "Negative": Decimal(str(round(rng.random(), 3))),
+                "Neutral": Decimal(str(round(rng.random(), 3))),
+                "Mixed": Decimal("0"),
+            },
+            "SentimentWeighted": Decimal(str(round(rng.uniform(-5, 5), 3))),
+            "Status": "TRANSCRIBING",
+            "CreatedAt": datetime.utcnow().isoformat() + "Z",
+            "ExpiresAfter": 0,
+        }
+        if indexed and not item["IsPartial"]:
+            item["FinalSegmentPK"] = item["PK"]
+        yield item
+
+
+def load_synthetic_calls(
+    table: LocalEventsTable,
+    start_date: date,
+    end_date: date,
+    calls: int,
+    segments: int,
+    seed: int = 0,
+) -> List[str]:
+    """Adds synthetic calls, spread over the date range, to the table - returns their call ids"""
+    # pylint: disable=too-many-arguments
+    rng = random.Random(seed)
+    days = (end_date - start_date).days + 1
+    call_ids = []
+    for i in range(calls):
+        call_id = f"local-call-{i:05d}"
+        created_at = datetime.combine(
+            start_date + timedelta(days=i % days), datetime.min.time()
+        ) + timedelta(seconds=rng.randint(0, 24 * 60 * 60 - 1))
+        table.put_item(Item={**get_call_list_key(created_at, call_id), "CallId": call_id})
+        for item in make_segments(call_id, segments, seed=seed + i):
+            table.put_item(Item=item)
+        call_ids.append(call_id)
+    return call_ids
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""LMA Transcript Preprocessing Benchmark
+
+Compares the streaming transcript formatting of fetch_transcript (iter_transcript_lines and
+join_transcript_lines in the transcript enrichment layer) with the original implementation,
+kept below for reference: three regular expression passes per segment, then a token list of
+the whole transcript to count and truncate it.
+
+First checks that both produce exactly the same transcript for every combination of options on
+synthetic calls, and on randomized segments with the edge cases (HTML, filler words, single
+character segments, unusual whitespace). Then reports the median time and peak memory of each
+on a large call, and the tokens saved by merging the segments of each speaker turn. See README.md.
+"""
+from pathlib import Path
+from statistics import median
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from local_stubs import SPEAKERS, WORDS, make_segments
+
+LAYER_PATH = (
+    Path(__file__).resolve().parents[2]
+    / "lma-ai-stack/source/lambda_layers/transcript_enrichment_layer"
+)
+sys.path.insert(0, str(LAYER_PATH))
+
+# imported from the layer source, after its path is added
+# pylint: disable=wrong-import-position
+from transcript_summary.fetch import (  # noqa: E402
+    iter_transcript_lines,
+    join_transcript_lines,
+    merge_transcript_turns,
+)
+
+ISSUE_REMOVER = re.compile("<span class='issue-pill'>Issue Detected</span>")
+HTML_REMOVER = re.compile("<[^>]*>")
+FILLER_REMOVER = re.compile("(^| )([Uu]m|[Uu]h|[Ll]ike|[Mm]hm)[,]?")
+ISSUE_PILL = "<br/><span class='issue-pill'>Issue Detected</span>"
+EDGE_CASE_PIECES = [
+    "a", "b", "Um", "um,", "like", "Mhm", " ", "  ",
+    "\t", "\n", " ", ",", "<b>", "</b>", ISSUE_PILL
+]
+
+
+def original_preprocess_transcripts(
+    transcripts: List[Dict[str, Any]], condense: bool, include_speaker: bool
+) -> List[str]:
+    """The original preprocess_transcripts"""
+    data = []
+    transcripts.sort(key=lambda x: x["EndTime"])
+    for row in transcripts:
+        transcript = row["Transcript"]
+        if include_speaker:
+            if row["Channel"] == "AGENT_ASSISTANT":
+                transcript = "MeetingAssistant: " + transcript
+            else:
+                speaker_name = row.get("Speaker", None)
+                if speaker_name:
+                    transcript = speaker_name.strip() + ": " + transcript
+        if condense:
+            transcript = re.sub(ISSUE_REMOVER, "", transcript)
+            transcript = re.sub(HTML_REMOVER, "", transcript)
+            transcript = re.sub(FILLER_REMOVER, "", transcript).strip()
+            if len(transcript) > 1:
+                transcript = "\n" + transcript
+        else:
+            transcript = "\n" + transcript
+        data.append(transcript)
+    return data
+
+
+def original_format(
+    segments: List[Dict[str, Any]], condense: bool, include_speaker: bool, tokens: int
+) -> str:
+    """The original formatting - preprocess_transcripts, then truncate_number_of_words"""
+    transcript_string = "".join(
+        original_preprocess_transcripts(segments, condense, include_speaker)
+    )
+    data = re.findall(r"\S+|\n|.|,", transcript_string)
+    if tokens > 0:
+        data = data[0:tokens]
+    return "".join(data)
+
+
+def streaming_format(
+    segments: List[Dict[str, Any]], condense: bool, include_speaker: bool, tokens: int
+) -> str:
+    return join_transcript_lines(
+        iter_transcript_lines(segments, condense, include_speaker), tokens
+    )
+
+
+def get_call_segments(segments: int, seed: int) -> List[Dict[str, Any]]:
+    """Final segments of a synthetic call, with some issue pills and filler words"""
+    rng = random.Random(seed)
+    rows = []
+    for item in make_segments("benchmark-call", segments, seed=seed):
+        if item["IsPartial"]:
+            continue
+        if rng.random() < 0.05:
+            item["Transcript"] += ISSUE_PILL
+        if rng.random() < 0.2:
+            item["Transcript"] = f"{rng.choice(['Um', 'uh,', 'Like', 'mhm'])} {item['Transcript']}"
+        rows.append(item)
+    return rows
+
+
+def get_edge_case_segments(rng: random.Random) -> List[Dict[str, Any]]:
+    rows = []
+    for index in range(rng.randint(0, 12)):
+        transcript = "".join(rng.choice(EDGE_CASE_PIECES) for _ in range(rng.randint(0, 6)))
+        rows.append(
+            dict(
+                Channel=rng.choice(["AGENT", "CALLER", "AGENT_ASSISTANT"]),
+                Speaker=rng.choice(["", "Alice", " Bob ", "Um"]),
+                Transcript=transcript,
+                EndTime=index,
+            )
+        )
+    return rows
+
+
+def get_turn_segments(turns: int, seed: int) -> List[Dict[str, Any]]:
+    """Final segments of a synthetic call where each speaker turn is split into 1 to 8 segments, as
+    Transcribe does - short pauses within a turn, longer ones between turns"""
+    rng = random.Random(seed)
+    rows = []
+    end_time = 0.0
+    speaker = ""
+    for _ in range(turns):
+        speaker = rng.choice([name for name in SPEAKERS if name != speaker])
+        end_time += rng.uniform(0.5, 4)
+        for index in range(rng.randint(1, 8)):
+            start_time = end_time + (rng.uniform(0, 1.5) if index else 0)
+            end_time = start_time + rng.uniform(1, 6)
+            rows.append(
+                dict(
+                    Channel="AGENT",
+                    Speaker=speaker,
+                    Transcript=" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20))),
+                    StartTime=start_time,
+                    EndTime=end_time,
+                )
+            )
+    return rows
+
+
+def report_turn_merging(segments: List[Dict[str, Any]]) -> None:
+    """Prints the transcript tokens and characters for each merge gap
+
+    Tokens are counted as by the token budget.
+    """
+    baseline = 0
+    for gap in (-1, 0, 1, 2, 3, 5):
+        rows = merge_transcript_turns(segments, gap) if gap >= 0 else segments
+        transcript = streaming_format(list(rows), True, True, 0)
+        tokens = len(re.findall(r"\S+|\n|.|,", transcript))
+        baseline = baseline or tokens
+        label = f"gap {gap}s" if gap >= 0 else "not merged"
+        print(
+            f"{label:<12} {len(rows):6d} lines {tokens:9d} tokens "
+            f"({(baseline - tokens) / baseline:6.1%} saved)"
+            f" {len(transcript):9d} chars"
+        )
+
+
+def check_equal_output(call_segments: List[Dict[str, Any]], cases: int, seed: int) -> int:
+    """Compares both implementations - returns the number of comparisons"""
+    rng = random.Random(seed)
+    inputs = [(call_segments, [0, 1, 2, 50, 1000, 25000, 10**9])]
+    for _ in range(cases):
+        inputs.append((get_edge_case_segments(rng), [0, 1, 2, 3, 5, 8, 13, 21]))
+    comparisons = 0
+    for segments, budgets in inputs:
+        for condense in (False, True):
+            for include_speaker in (False, True):
+                for tokens in budgets:
+                    expected = original_format(
+                        [dict(row) for row in segments], condense, include_speaker, tokens
+                    )
+                    actual = streaming_format(
+                        [dict(row) for row in segments], condense, include_speaker, tokens
+                    )
+                    if actual != expected:
+                        raise AssertionError(
+                            f"different output (condense={condense}, "
+                            f"include_speaker={include_speaker}, tokens={tokens}) "
+                            f"for {segments!r}:\n{expected!r}\n{actual!r}"
+                        )
+                    comparisons += 1
+    return comparisons
+
+
+def measure(run: Callable[[], str], repeat: int) -> Tuple[float, float]:
+    """Median seconds, and peak traced memory in bytes"""
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - started_at)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return median(durations), peak
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark transcript preprocessing on a synthetic call"
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=20000,
+        help="segments in the large synthetic call",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="runs per case - the median time is reported",
+    )
+    parser.add_argument(
+        "--edge-cases",
+        type=int,
+        default=2000,
+        help="randomized edge case calls compared",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    comparisons = check_equal_output(get_call_segments(2000, args.seed), args.edge_cases, args.seed)
+    print(f"Equal output: {comparisons} comparisons\n")
+
+    segments = get_call_segments(args.segments, args.seed)
+    print(f"Large call: {len(segments)} final segments")
+    for tokens in (0, 4000):
+        implementations = (("original", original_format), ("streaming", streaming_format))
+        for name, format_transcript in implementations:
+            seconds, peak = measure(
+                lambda format_transcript=format_transcript, tokens=tokens: format_transcript(
+                    list(segments), True, True, tokens
+                ),
+                args.repeat,
+            )
+            budget = f"first {tokens} tokens" if tokens else "all tokens"
+            print(
+                f"{name:<10} {budget:<18} {seconds * 1000:8.1f} ms  "
+                f"{peak / 1024 / 1024:7.1f} MiB peak"
+            )
+
+    turn_segments = get_turn_segments(args.segments // 4, args.seed)
+    print(
+        f"\nTurn merging: {len(turn_segments)} final segments "
+        f"in {args.segments // 4} speaker turns"
+    )
+    report_turn_merging(turn_segments)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
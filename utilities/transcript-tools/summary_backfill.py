@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""LMA Summary Backfill
+
+Regenerates the summaries of past calls, eg after the prompt templates are changed. Enumerates the
+calls started in a date range from the call list (cls#) partitions of the call event sourcing
+table, runs the summary pipeline on their transcripts with bounded concurrency, and writes the new
+summaries through the AppSync addCallSummaryText mutation. Progress is checkpointed, so an
+interrupted run can be resumed. See README.md.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+LAYER_PATH = (
+    Path(__file__).resolve().parents[2]
+    / "lma-ai-stack/source/lambda_layers/transcript_enrichment_layer"
+)
+sys.path.insert(0, str(LAYER_PATH))
+# same transcript settings as the deployed summary functions - override with environment variables
+os.environ.setdefault("PROCESS_TRANSCRIPT", "True")
+os.environ.setdefault("MAP_REDUCE_CHUNK_TOKENS", "20000")
+
+# imported from the layer source, after its path is added and its settings are set
+# pylint: disable=wrong-import-position
+from transcript_summary import TranscriptSummarizer, create_bedrock_client  # noqa: E402
+
+SHARDS_IN_DAY = 6
+CHARS_PER_TOKEN = 4
+ADD_CALL_SUMMARY_TEXT_MUTATION = """
+mutation AddCallSummaryText($input: AddCallSummaryTextInput!) {
+  addCallSummaryText(input: $input) {
+    CallId
+  }
+}
+"""
+
+
+def list_call_ids(events_table: Any, start_date: date, end_date: date) -> Iterator[str]:
+    """Call ids of the calls started from start_date to end_date (inclusive)
+
+    Read from the call list (cls#) partitions.
+    """
+    seen: Set[str] = set()
+    day = start_date
+    while day <= end_date:
+        for shard in range(SHARDS_IN_DAY):
+            query_args: Dict[str, Any] = dict(
+                KeyConditionExpression=Key("PK").eq(f"cls#{day.isoformat()}#s#{shard:02d}"),
+                ProjectionExpression="CallId",
+            )
+            while True:
+                response = events_table.query(**query_args)
+                for item in response["Items"]:
+                    call_id = item["CallId"]
+                    if call_id not in seen:
+                        seen.add(call_id)
+                        yield call_id
+                if "LastEvaluatedKey" not in response:
+                    break
+                query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        day += timedelta(days=1)
+
+
+class Checkpoint:
+    """Call ids already summarized, saved to a JSON file after each call"""
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self.path = path
+        self.completed: Set[str] = set()
+        self.failed: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        if path and path.exists():
+            state = json.loads(path.read_text(encoding="utf-8"))
+            self.completed = set(state.get("completed", []))
+            self.failed = state.get("failed", {})
+
+    def is_completed(self, call_id: str) -> bool:
+        return call_id in self.completed
+
+    def mark_completed(self, call_id: str) -> None:
+        with self.lock:
+            self.completed.add(call_id)
+            self.failed.pop(call_id, None)
+            self.save()
+
+    def mark_failed(self, call_id: str, reason: str) -> None:
+        with self.lock:
+            self.failed[call_id] = reason
+            self.save()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        # write then rename, so an interrupted run never leaves a truncated checkpoint
+        temp_path = self.path.with_suffix(".tmp")
+        temp_path.write_text(
+            json.dumps(dict(completed=sorted(self.completed), failed=self.failed), indent=2),
+            encoding="utf-8",
+        )
+        temp_path.replace(self.path)
+
+
+class AppSyncSummaryWriter:
+    """Writes summaries through the AppSync addCallSummaryText mutation, with IAM auth"""
+
+    def __init__(self, url: str) -> None:
+        # imported here so local runs don't need gql
+        # pylint: disable=import-outside-toplevel
+        from gql import gql
+        from appsync_utils import AppsyncRequestsGqlClient
+
+        self.url = url
+        self.mutation = gql(ADD_CALL_SUMMARY_TEXT_MUTATION)
+        self.client_class = AppsyncRequestsGqlClient
+        # gql sync clients aren't thread safe - one per worker thread
+        self.local = threading.local()
+
+    def write_summary(self, call_id: str, summary: str) -> None:
+        if not hasattr(self.local, "client"):
+            self.local.client = self.client_class(url=self.url, fetch_schema_from_transport=False)
+        self.local.client.execute(
+            self.mutation,
+            variable_values={
+                "input": {
+                    "CallId": call_id,
+                    "CallSummaryText": summary,
+                    "UpdatedAt": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                }
+            },
+        )
+
+
+class BackfillStats:
+    """Throughput counters"""
+
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.counts = dict(summarized=0, dry_run=0, skipped=0, empty=0, failed=0)
+        self.input_tokens = 0
+        self.lock = threading.Lock()
+
+    def add(self, status: str, input_tokens: int = 0) -> None:
+        with self.lock:
+            self.counts[status] += 1
+            self.input_tokens += input_tokens
+
+    def report(self, total: Optional[int] = None) -> str:
+        with self.lock:
+            elapsed = time.monotonic() - self.started_at
+            processed = sum(self.counts.values())
+            minutes = max(elapsed, 1e-6) / 60
+            counts = ", ".join(f"{name} {count}" for name, count in self.counts.items())
+            of_total = f"/{total}" if total is not None else ""
+            return (
+                f"{processed}{of_total} calls in {elapsed:.1f}s ({counts}) - "
+                f"{processed / minutes:.1f} calls/min, "
+                f"{self.input_tokens / minutes:,.0f} transcript tokens/min"
+            )
+
+
+class SummaryBackfill:
+    """Summarizes calls with bounded concurrency"""
+
+    def __init__(
+        self,
+        summarizer: TranscriptSummarizer,
+        writer: Any,
+        checkpoint: Checkpoint,
+        concurrency: int = 4,
+        dry_run: bool = False,
+        report_seconds: float = 30,
+    ) -> None:
+        # pylint: disable=too-many-arguments
+        self.summarizer = summarizer
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.concurrency = max(1, concurrency)
+        self.dry_run = dry_run
+        self.report_seconds = report_seconds
+        self.stats = BackfillStats()
+
+    def process_call(self, call_id: str) -> None:
+        if self.checkpoint.is_completed(call_id):
+            self.stats.add("skipped")
+            return
+        transcript_json = self.summarizer.get_transcript(call_id)
+        input_tokens = len(transcript_json["transcript"]) // CHARS_PER_TOKEN
+        if not transcript_json["transcript"].strip():
+            self.stats.add("empty")
+            return
+        if self.dry_run:
+            self.stats.add("dry_run", input_tokens)
+            return
+        summary, is_complete = self.summarizer.summarize_call(
+            call_id, transcript=transcript_json["transcript"]
+        )
+        if not is_complete:
+            # not written, and not checkpointed, so a re-run tries again
+            self.checkpoint.mark_failed(call_id, "summary generation failed")
+            self.stats.add("failed", input_tokens)
+            return
+        self.writer.write_summary(call_id, summary)
+        self.checkpoint.mark_completed(call_id)
+        self.stats.add("summarized", input_tokens)
+
+    def run(self, call_ids: Iterable[str], total: Optional[int] = None) -> BackfillStats:
+        """Processes the calls, with at most concurrency calls in progress"""
+        last_report = time.monotonic()
+        in_progress: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            call_id_iterator = iter(call_ids)
+            while True:
+                # keep the pool full, without queuing every call id up front
+                for call_id in call_id_iterator:
+                    in_progress[executor.submit(self.process_call, call_id)] = call_id
+                    if len(in_progress) >= self.concurrency:
+                        break
+                if not in_progress:
+                    break
+                done, _ = wait(
+                    list(in_progress), timeout=self.report_seconds, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    call_id = in_progress.pop(future)
+                    error = future.exception()
+                    if error:
+                        print(f"Error summarizing {call_id}: {error!r}", file=sys.stderr)
+                        self.checkpoint.mark_failed(call_id, repr(error))
+                        self.stats.add("failed")
+                if time.monotonic() - last_report >= self.report_seconds:
+                    print(self.stats.report(total), flush=True)
+                    last_report = time.monotonic()
+        return self.stats
+
+
+def parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Regenerate LMA call summaries for a date range")
+    parser.add_argument(
+        "--start-date",
+        type=parse_date,
+        required=True,
+        help="first call date (UTC), YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--end-date",
+        type=parse_date,
+        help="last call date (UTC), YYYY-MM-DD - default start date",
+    )
+    parser.add_argument(
+        "--call-id",
+        action="append",
+        help="summarize only these call ids (repeatable)",
+    )
+    parser.add_argument(
+        "--events-table",
+        default=os.getenv("LCA_CALL_EVENTS_TABLE"),
+        help="call event sourcing table name",
+    )
+    parser.add_argument(
+        "--prompt-template-table",
+        default=os.getenv("LLM_PROMPT_TEMPLATE_TABLE_NAME"),
+        help="LLM prompt template table name",
+    )
+    parser.add_argument(
+        "--appsync-url",
+        default=os.getenv("APPSYNC_GRAPHQL_URL"),
+        help="AppSync GraphQL URL",
+    )
+    parser.add_argument(
+        "--model-id",
+        default=os.getenv("BEDROCK_MODEL_ID"),
+        help="Bedrock model id",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="calls summarized at the same time",
+    )
+    parser.add_argument(
+        "--checkpoint-file",
+        type=Path,
+        default=Path("summary-backfill-checkpoint.json"),
+        help="progress file - calls already in it are skipped",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list calls and fetch transcripts only",
+    )
+    parser.add_argument(
+        "--report-seconds",
+        type=float,
+        default=30,
+        help="throughput report interval",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="run against local stand-ins with synthetic calls",
+    )
+    parser.add_argument("--local-calls", type=int, default=20, help="synthetic calls for --local")
+    parser.add_argument(
+        "--local-segments",
+        type=int,
+        default=200,
+        help="segments per synthetic call for --local",
+    )
+    args = parser.parse_args(argv)
+    args.end_date = args.end_date or args.start_date
+    if args.end_date < args.start_date:
+        parser.error("--end-date is before --start-date")
+    if not args.local:
+        missing = [
+            name
+            for name, value in (
+                ("--events-table", args.events_table),
+                ("--prompt-template-table", args.prompt_template_table),
+                ("--model-id", args.model_id),
+                ("--appsync-url", args.appsync_url if not args.dry_run else "-"),
+            )
+            if not value
+        ]
+        if missing:
+            parser.error(f"missing {', '.join(missing)} (or the matching environment variables)")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    writer: Any = None
+    if args.local:
+        # pylint: disable=import-outside-toplevel
+        from local_stubs import (
+            LocalBedrockClient,
+            LocalDynamoDBClient,
+            LocalEventsTable,
+            LocalSummaryWriter,
+            load_synthetic_calls,
+        )
+
+        events_table: Any = LocalEventsTable()
+        load_synthetic_calls(
+            events_table, args.start_date, args.end_date, args.local_calls, args.local_segments
+        )
+        bedrock_client: Any = LocalBedrockClient()
+        dynamodb_client: Any = LocalDynamoDBClient()
+        writer = LocalSummaryWriter()
+        model_id = args.model_id or "anthropic.claude-3-haiku-20240307-v1:0"
+        prompt_template_table = args.prompt_template_table or "LocalPromptTemplates"
+    else:
+        events_table = boto3.resource("dynamodb").Table(args.events_table)
+        bedrock_client = create_bedrock_client()
+        dynamodb_client = boto3.client("dynamodb")
+        if not args.dry_run:
+            writer = AppSyncSummaryWriter(args.appsync_url)
+        model_id = args.model_id
+        prompt_template_table = args.prompt_template_table
+
+    summarizer = TranscriptSummarizer(
+        bedrock_client=bedrock_client,
+        dynamodb_client=dynamodb_client,
+        events_table=events_table,
+        model_id=model_id,
+        prompt_template_table_name=prompt_template_table,
+        # summarize the full transcripts with the current templates - no rolling summaries or
+        # cached results
+        rolling_summary_table_name="",
+        summary_cache_table_name="",
+    )
+    checkpoint = Checkpoint(args.checkpoint_file)
+    backfill = SummaryBackfill(
+        summarizer,
+        writer,
+        checkpoint,
+        concurrency=args.concurrency,
+        dry_run=args.dry_run,
+        report_seconds=args.report_seconds,
+    )
+
+    call_ids: Iterable[str]
+    total = None
+    if args.call_id:
+        call_ids = args.call_id
+        total = len(args.call_id)
+    else:
+        call_ids = list_call_ids(events_table, args.start_date, args.end_date)
+    print(
+        f"Summarizing calls from {args.start_date} to {args.end_date} with model {model_id}, "
+        f"concurrency {args.concurrency}{' (dry run)' if args.dry_run else ''}",
+        flush=True,
+    )
+    stats = backfill.run(call_ids, total)
+    print(f"Done: {stats.report(total)}")
+    pacer_stats = summarizer.bedrock_pacer.stats
+    print(
+        f"Bedrock: {pacer_stats['Requests']} requests, "
+        f"{pacer_stats['Throttles']} throttled"
+    )
+    if args.local:
+        print(f"Local summaries written: {len(writer.summaries)}")
+    return 1 if stats.counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())